@@ -11,7 +11,7 @@ from astropy.stats import sigma_clip
 from ..models.geometry import projected_polar
 from ..models.asymmetry import asymmetry
 from ..models.axisym import AxisymmetricDisk, axisym_iter_fit
-from ..models.beam import ConvolveFFTW, smear
+from ..models.beam import get_convolver, smear
 
 class FitArgs:
     '''
@@ -284,7 +284,7 @@ class FitArgs:
             filledsig[mask] = asig[mask]
 
         #reconvolve psf on top of velocity and dispersion
-        cnvfftw = ConvolveFFTW(self.kin.spatial_shape)
+        cnvfftw = get_convolver(self.kin.spatial_shape, real=True)
         smeared = smear(filledvel, self.kin.beam_fft, beam_fft=True, sig=filledsig, sb=None, cnvfftw=cnvfftw)
 
         #cut out spaxels with too high residual because they're probably bad
@@ -25,6 +25,7 @@ from .util import get_map_bin_transformations, impose_positive_definite
 from ..models.beam import construct_beam, ConvolveFFTW, smear
 from ..models.geometry import projected_polar
 from ..models import oned
+from ..util.timing import timed
 
 class Kinematics():
     r"""
@@ -160,6 +161,13 @@ class Kinematics():
             Photometric inclination in degrees.
         maxr (:obj:`float`, optional):
             Maximum radius of useful data in effective radii.
+        pad_beam (:obj:`bool`, optional):
+            Zero-pad the images in the beam-smearing convolutions such that
+            they are linear instead of circular, using FFT-friendly padded
+            sizes; see :func:`~nirvana.models.beam.fft_pad_shape`.  This
+            applies to the construction of the beam from ``psf`` and
+            ``aperture`` and to the convolutions of the models fit to these
+            data by :class:`~nirvana.models.axisym.AxisymmetricDisk`.
 
     Raises:
         ValueError:
@@ -174,7 +182,7 @@ class Kinematics():
                  sig_mask=None, sig_covar=None, sig_corr=None, psf_name=None, psf=None,
                  aperture=None, binid=None, grid_x=None, grid_y=None, grid_sb=None, grid_wcs=None,
                  reff=None, fwhm=None, image=None, phot_inc=None, maxr=None,
-                 positive_definite=False, quiet=False):
+                 positive_definite=False, quiet=False, pad_beam=False):
 
         # Check shape of input arrays
         self.nimg = vel.shape[0]
@@ -199,7 +207,8 @@ class Kinematics():
         # Basic properties
         self.spatial_shape = vel.shape
         self.psf_name = 'unknown' if psf_name is None else psf_name
-        self._set_beam(psf, aperture)
+        self.pad_beam = pad_beam
+        self._set_beam(psf, aperture, pad=self.pad_beam)
         self.reff = reff
         self.fwhm = fwhm
         self.image = image
@@ -277,13 +286,17 @@ class Kinematics():
         # ivar and covar and they are not consistent
 
 
-    def _set_beam(self, psf, aperture):
+    def _set_beam(self, psf, aperture, pad=False):
         """
         Instantiate :attr:`beam` and :attr:`beam_fft`.
 
         If both ``psf`` and ``aperture`` are None, the convolution
         kernel for the data is assumed to be unknown.
 
+        Because the beam is real, :attr:`beam_fft` is kept as the half spectrum
+        of its FFT (see `numpy.fft.rfftn`_ and
+        :func:`~nirvana.models.beam.half_spectrum_shape`).
+
         Args:
             psf (`numpy.ndarray`_):
                 An image of the point-spread function of the
@@ -303,6 +316,10 @@ class Kinematics():
                 constructed as the convolution of this image with
                 ``psf``. If None, the kernel will be set to the
                 ``psf`` value (if provided) or None.
+            pad (:obj:`bool`, optional):
+                Zero-pad ``psf`` for its convolution with ``aperture`` such
+                that the convolution is linear; see
+                :func:`~nirvana.models.beam.construct_beam`.
         """
         if psf is None and aperture is None:
             self.beam = None
@@ -310,14 +327,15 @@ class Kinematics():
             return
         if psf is None:
             self.beam = aperture/np.sum(aperture)
-            self.beam_fft = np.fft.fftn(np.fft.ifftshift(aperture))
+            self.beam_fft = np.fft.rfftn(np.fft.ifftshift(aperture))
             return
         if aperture is None:
             self.beam = psf/np.sum(psf)
-            self.beam_fft = np.fft.fftn(np.fft.ifftshift(psf))
+            self.beam_fft = np.fft.rfftn(np.fft.ifftshift(psf))
             return
-        self.beam_fft = construct_beam(psf/np.sum(psf), aperture/np.sum(aperture), return_fft=True)
-        self.beam = np.fft.fftshift(np.fft.ifftn(self.beam_fft).real)
+        self.beam_fft = construct_beam(psf/np.sum(psf), aperture/np.sum(aperture), return_fft=True,
+                                       real=True, pad=pad)
+        self.beam = np.fft.fftshift(np.fft.irfftn(self.beam_fft, s=self.spatial_shape))
 
     def _ingest(self, data, ivar, mask):
         """
@@ -526,6 +544,7 @@ class Kinematics():
 
     # TODO: Include an optional weight map.  E.g., to mimic the luminosity
     # weighting of the kinematics in data.
+    @timed('bin')
     def bin(self, data):
         """
         Provided a set of mapped data, rebin it to match the internal vectors.
@@ -555,7 +574,48 @@ class Kinematics():
 
     # TODO: Include an optional weight map.  E.g., to mimic the luminosity
     # weighting of the kinematics in data.
-    def deriv_bin(self, data, deriv):
+    @timed('bin')
+    def bin_many(self, data, out=None):
+        """
+        Provided a stack of mapped data, rebin each map to match the internal
+        vectors.
+
+        This is identical to calling :func:`bin` for each map in the stack,
+        but all the maps are binned using a single sparse-dense matrix
+        product.
+
+        Args:
+            data (`numpy.ndarray`_):
+                Data to rebin.  The shape of the first two axes must match
+                :attr:`spatial_shape`; the last axis is the number of maps.
+            out (`numpy.ndarray`_, optional):
+                Array for the result.  Shape must be :math:`(N_{\rm bin},
+                N_{\rm map})`, where :math:`N_{\rm bin}` is the number of
+                unique measurements and :math:`N_{\rm map}` is the number of
+                maps.  If None, a new array is returned.
+
+        Returns:
+            `numpy.ndarray`_: A 2D array with the rebinned data for each map.
+            This is ``out``, if provided.
+
+        Raises:
+            ValueError:
+                Raised if the shape of the input array is incorrect.
+        """
+        if data.ndim != 3 or data.shape[:2] != self.spatial_shape:
+            raise ValueError('Data to rebin has incorrect shape; expected {0}, found {1}.'.format(
+                              self.spatial_shape, data.shape[:2]))
+        # The reshape does not copy the data if the array is contiguous
+        binned = self.bin_transform.dot(data.reshape(-1, data.shape[-1]))
+        if out is None:
+            return binned
+        if out.shape != binned.shape:
+            raise ValueError('Output array has incorrect shape; expected {0}, found {1}.'.format(
+                              binned.shape, out.shape))
+        out[...] = binned
+        return out
+
+    def deriv_bin(self, data, deriv, out=None):
         """
         Provided a set of mapped data, rebin it to match the internal vectors.
 
@@ -578,6 +638,8 @@ class Kinematics():
                 derivatives of model w.r.t. its parameters.  The first two axes
                 of the array must have a shape that matches
                 :attr:`spatial_shape`.
+            out (`numpy.ndarray`_, optional):
+                Array for the binned derivatives; see :func:`bin_many`.
 
         Returns:
             :obj:`tuple`: Two `numpy.ndarray`_ arrays.  The first provides the
@@ -595,9 +657,7 @@ class Kinematics():
         if deriv.shape[:2] != self.spatial_shape:
             raise ValueError('Derivative shape is incorrect; expected {0}, found {1}.'.format(
                               self.spatial_shape, deriv.shape[:2]))
-        return self.bin_transform.dot(data.ravel()), \
-                    np.stack(tuple([self.bin_transform.dot(deriv[...,i].ravel())
-                                    for i in range(deriv.shape[-1])]), axis=-1)
+        return self.bin_transform.dot(data.ravel()), self.bin_many(deriv, out=out)
 
     def unique(self, data):
         """
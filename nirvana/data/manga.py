@@ -714,22 +714,45 @@ def manga_map_covar(ivar, binid=None, rho_sig=1.92, rlim=3.2, min_ivar=1e-10, rh
     var = np.zeros(ivar.shape, dtype=float)
     var[gpm] = 1./ivar[gpm]
 
-    # Get the spaxel coordinates
-    nn = np.prod(var.shape)
-    i, j = map(lambda x : x.reshape(var.shape)[gpm],
-               np.unravel_index(np.arange(nn), shape=var.shape))
-    
-    # Get the correlation between the valid spaxels
-    d = np.square(i[:,None]-i[None,:]) + np.square(j[:,None]-j[None,:])
-    rho = np.exp(-d/np.square(rho_sig)/2)
-    rho[d > np.square(2*rlim)] = 0.
+    # Get the spaxel coordinates and the map with the index of each valid
+    # spaxel in the covariance matrix
+    ngood = np.sum(gpm)
+    i, j = np.where(gpm)
+    gindx = np.full(var.shape, -1, dtype=int)
+    gindx[gpm] = np.arange(ngood)
+
+    # Get the correlation between the valid spaxels.  Correlations are only
+    # non-zero for spaxels separated by no more than 2*rlim, so only the
+    # pixel offsets within this limit are considered.
+    m = int(np.floor(2*rlim))
+    di, dj = map(lambda x : x.ravel(), np.meshgrid(np.arange(-m,m+1), np.arange(-m,m+1),
+                                                    indexing='ij'))
+    d = np.square(di) + np.square(dj)
+    indx = d <= np.square(2*rlim)
+    di, dj, d = di[indx], dj[indx], d[indx]
+    rows = []
+    cols = []
+    rho = []
+    for _di, _dj, _d in zip(di, dj, d):
+        # Find the valid spaxels at this offset
+        _i = i + _di
+        _j = j + _dj
+        indx = (_i >= 0) & (_i < var.shape[0]) & (_j >= 0) & (_j < var.shape[1])
+        _col = gindx[_i[indx], _j[indx]]
+        _row = np.where(indx)[0][_col > -1]
+        rows += [_row]
+        cols += [_col[_col > -1]]
+        rho += [np.full(_row.size, np.exp(-_d/np.square(rho_sig)/2), dtype=float)]
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    rho = np.concatenate(rho)
+    # Impose the correlation tolerance
+    indx = rho > 0
     if rho_tol is not None:
-        # Impose the correlation tolerance
-        rho[rho < rho_tol] = 0.
+        indx &= rho >= rho_tol
     # Convert to a sparse matrix
-    indx = rho > 0
-    ngood = np.sum(gpm)
-    rho = sparse.csr_matrix((rho[indx], np.where(indx)), shape=(ngood,ngood))
+    rho = sparse.csr_matrix((rho[indx], (rows[indx], cols[indx])), shape=(ngood,ngood))
+    rho.sort_indices()
 
     if binid is not None:
         # Construct the binning matrices
@@ -750,17 +773,19 @@ def manga_map_covar(ivar, binid=None, rho_sig=1.92, rlim=3.2, min_ivar=1e-10, rh
             inv_transform[inv_transform > 0] = 1.
             rho = inv_transform.dot(rho.dot(inv_transform.T))
             # Renormalize
-            t = 1./np.sqrt(rho.diagonal())
-            rho = rho.multiply(np.outer(t,t))
+            t = sparse.diags(1./np.sqrt(rho.diagonal()))
+            rho = t.dot(rho.dot(t))
 
-    # Calculate the covariance matrix
-    cov = rho.multiply(np.sqrt(np.outer(var[gpm], var[gpm]))).tocsr()
+    # Calculate the covariance matrix (scaling by the diagonal matrices avoids
+    # constructing the dense outer product of the errors)
+    err = sparse.diags(np.sqrt(var[gpm]))
+    cov = err.dot(rho.dot(err)).tocsr()
 
     if positive_definite:
         # Force the matrix to be positive definite
         cov = impose_positive_definite(cov)
 
-    if not np.all(np.isfinite(cov.toarray())):
+    if not np.all(np.isfinite(cov.data)):
         raise ValueError('Covariance matrix includes non-finite values.')
 
     # TODO: Leaving this for the moment to make sure that the construction of
@@ -878,10 +903,13 @@ class MaNGAGasKinematics(MaNGAKinematics):
             chi-square/Gaussian likelihood calculations.
         quiet (:obj:`bool`, optional):
             Suppress printed output.
+        pad_beam (:obj:`bool`, optional):
+            Zero-pad the images in the beam-smearing convolutions; see
+            :class:`~nirvana.data.kinematics.Kinematics`.
     """
     def __init__(self, maps_file, cube_file=None, image_file=None, psf_ext='RPSF', line='Ha-6564',
                  mask_flags='any', flux_bound=None, sb_fill=None, covar=False,
-                 positive_definite=False, quiet=False, fwhm_only=False):
+                 positive_definite=False, quiet=False, fwhm_only=False, pad_beam=False):
 
         if not os.path.isfile(maps_file):
             raise FileNotFoundError(f'File does not exist: {maps_file}')
@@ -1006,7 +1034,7 @@ class MaNGAGasKinematics(MaNGAKinematics):
                          sig_corr=sig_corr, psf_name=psf_name, psf=psf, binid=binid, grid_x=grid_x, 
                          grid_y=grid_y, grid_sb=grid_sb, grid_wcs=wcs, reff=reff, fwhm=fwhm,
                          image=image, phot_inc=phot_inc, maxr=maxr,
-                         positive_definite=positive_definite)
+                         positive_definite=positive_definite, pad_beam=pad_beam)
 
 
 class MaNGAStellarKinematics(MaNGAKinematics):
@@ -1058,10 +1086,13 @@ class MaNGAStellarKinematics(MaNGAKinematics):
             chi-square/Gaussian likelihood calculations.
         quiet (:obj:`bool`, optional):
             Suppress printed output.
+        pad_beam (:obj:`bool`, optional):
+            Zero-pad the images in the beam-smearing convolutions; see
+            :class:`~nirvana.data.kinematics.Kinematics`.
     """
     def __init__(self, maps_file, cube_file=None, image_file=None, psf_ext='GPSF',
                  mask_flags='any', unbinned_sb=True, sb_fill=None, covar=False,
-                 positive_definite=False, quiet=False, fwhm_only=False):
+                 positive_definite=False, quiet=False, fwhm_only=False, pad_beam=False):
 
         if not os.path.isfile(maps_file):
             raise FileNotFoundError(f'File does not exist: {maps_file}')
@@ -1162,7 +1193,7 @@ class MaNGAStellarKinematics(MaNGAKinematics):
                          sig_corr=sig_corr, psf_name=psf_name, psf=psf, binid=binid, grid_x=grid_x, 
                          grid_y=grid_y, grid_sb=grid_sb, grid_wcs=wcs, reff=reff, fwhm=fwhm,
                          image=image, phot_inc=phot_inc, maxr=maxr,
-                         positive_definite=positive_definite)
+                         positive_definite=positive_definite, pad_beam=pad_beam)
 
 
 # TODO: 
@@ -8,13 +8,14 @@ import warnings
 from IPython import embed
 
 import numpy as np
-from scipy import sparse, stats, optimize
+from scipy import sparse, stats, optimize, linalg
 from matplotlib import pyplot, patches
 
 from astropy.stats import sigma_clip
 
 from . import util
 from ..util import plot
+from ..util.timing import timed
 
 #warnings.simplefilter('error', RuntimeWarning)
 
@@ -46,8 +47,19 @@ class IntrinsicScatter:
             matrix to :func:`~nirvana.data.util.impose_positive_definite` to
             ensure that the covariance matrix is positive-definite. Ignored
             if ``covar`` is not provided.
+        eigen (:obj:`bool`, optional):
+            If ``covar`` is provided, compute the merit function using the
+            eigendecomposition of the covariance matrix or, if the
+            correlation matrix of the intrinsic scatter is fixed to that of
+            the data (see ``fixed_rho`` in :func:`fit`), the correlation
+            matrix.  The decomposition is performed once and then reused for
+            all trial values of the intrinsic scatter and for any subsequent
+            subset of the good pixels that excludes only a few additional
+            points.  If False, the adjusted covariance matrix is inverted for
+            every trial value.
     """
-    def __init__(self, resid, err=None, covar=None, gpm=None, npar=0, assume_posdef_covar=True):
+    def __init__(self, resid, err=None, covar=None, gpm=None, npar=0, assume_posdef_covar=True,
+                 eigen=True):
 
         self.resid = resid
         self.size = self.resid.size
@@ -65,6 +77,10 @@ class IntrinsicScatter:
             raise ValueError('Size of the good-pixel mask must match the residual array.')
         self.inp_gpm = self.gpm.copy()
         self.npar = npar
+        self.eigen = eigen
+
+        # Eigendecomposition of the covariance matrix; see _eigen_init
+        self._eig = None
 
         # Work-space arrays
         self._x = None
@@ -73,6 +89,11 @@ class IntrinsicScatter:
         self._cov = None
         self._var = None
         self._rho = None
+        self._eig_val = None
+        self._eig_vec = None
+        self._eig_var = None
+        self._eig_res = None
+        self._eig_rej = None
         self.fixed_rho = False
         self.debug = False
 
@@ -105,7 +126,96 @@ class IntrinsicScatter:
         if self.debug:
             print('Par={0:7.3f}, Merit={1:9.3e}'.format(x[0], merit))
         return merit
-        
+
+    def _merit_eigen(self, x):
+        r"""
+        Calculate the merit function with covariance using the
+        eigendecomposition of the covariance matrix.
+
+        For covariance matrix :math:`{\bf C} = {\bf V}{\bf \Lambda}{\bf
+        V}^T`, the inverse of the adjusted covariance matrix is :math:`{\bf
+        P} = {\bf V}({\bf \Lambda} + \sigma^2{\bf I})^{-1}{\bf V}^T`.
+        If the correlation matrix of the intrinsic scatter is fixed to the
+        correlation matrix of the data, :math:`{\bf R} = {\bf V}{\bf
+        \Lambda}{\bf V}^T`, the adjusted covariance matrix is :math:`{\bf
+        D}{\bf R}{\bf D}`, where :math:`{\bf D}` is the diagonal matrix
+        with :math:`D_{ii} = (C_{ii} + \sigma^2)^{1/2}`, such that
+        :math:`\chi^2 = {\bf z}^T{\bf V}{\bf \Lambda}^{-1}{\bf
+        V}^T{\bf z}` with :math:`{\bf z} = {\bf D}^{-1}{\bf r}`.
+
+        If the decomposition was computed for a superset of the good pixels,
+        the residuals of the excluded pixels are set to 0 and the
+        :math:`\chi^2` is corrected using the block-matrix inversion
+        identity, which only requires the inversion of the :math:`k\times
+        k` block of :math:`{\bf P}` (or :math:`{\bf R}^{-1}`) for the
+        :math:`k` excluded pixels.
+        """
+        if self.fixed_rho:
+            d = 1/self._eig_val
+            res = np.dot(self._eig_res / np.sqrt(self._eig_var + x[0]**2), self._eig_vec)
+        else:
+            d = 1/(self._eig_val + x[0]**2)
+            res = self._eig_res
+        dres = d * res
+        chisqr = np.dot(res, dres)
+        if self._eig_rej is not None:
+            b = np.dot(self._eig_rej, dres)
+            chisqr -= np.dot(b, linalg.solve(np.dot(self._eig_rej * d[None,:], self._eig_rej.T),
+                                             b, assume_a='pos'))
+        merit = abs(chisqr - self._dof)
+        if self.debug:
+            print('Par={0:7.3f}, Merit={1:9.3e}'.format(x[0], merit))
+        return merit
+
+    def _eigen_init(self):
+        """
+        Initialize the workspace objects used by :func:`_merit_eigen`.
+
+        The eigendecomposition of the covariance (or correlation) matrix is
+        only recomputed if the current good-pixel mask is not a subset of the
+        mask used for the existing decomposition, if it excludes too many of
+        its pixels, or if ``fixed_rho`` has changed.
+        """
+        if self._eig is not None:
+            base_gpm, fixed_rho, evals, evecs = self._eig
+            rej = base_gpm & np.logical_not(self.gpm)
+            nrej = np.sum(rej)
+            # The cost of the correction in _merit_eigen scales as nrej^2 N,
+            # so limit the number of excluded pixels to sqrt(N).
+            if fixed_rho == self.fixed_rho and not np.any(self.gpm & np.logical_not(base_gpm)) \
+                    and nrej**2 <= evals.size:
+                self._eig_val = evals
+                self._eig_vec = evecs
+                res = self.resid[base_gpm] * self.gpm[base_gpm]
+                self._eig_var = np.diag(self.covar)[base_gpm]
+                self._eig_res = res if self.fixed_rho else np.dot(res, evecs)
+                self._eig_rej = None if nrej == 0 else evecs[rej[base_gpm]]
+                return
+        evals, evecs = linalg.eigh(self._rho if self.fixed_rho else self._cov)
+        self._eig = (self.gpm.copy(), self.fixed_rho, evals, evecs)
+        self._eig_val = evals
+        self._eig_vec = evecs
+        self._eig_var = self._var
+        self._eig_res = self._res if self.fixed_rho else np.dot(self._res, evecs)
+        self._eig_rej = None
+
+    @property
+    def _use_eigen(self):
+        """
+        Use the eigendecomposition of the covariance or correlation matrix to
+        compute the merit function.
+        """
+        return self.eigen and self.covar is not None
+
+    def _merit_functions(self):
+        """
+        Return the functions used to compute the normalized residuals and the
+        merit function, based on the availability of the covariance.
+        """
+        if self.covar is None:
+            return self._merit_vec_err, self._merit_err
+        return self._merit_vec_covar, self._merit_eigen if self._use_eigen else self._merit_covar
+
     def _fit_init(self, sig0=None, fixed_rho=False):
         """
         Initialize the fitting workspace objects.
@@ -124,9 +234,12 @@ class IntrinsicScatter:
             self._var = np.diag(self._cov)
             self._rho = self._cov / np.sqrt(self._var[:,None]*self._var[None,:]) \
                             if self.fixed_rho else np.identity(np.sum(self.gpm), dtype=float)
+            if self._use_eigen:
+                self._eigen_init()
         self._x = np.array([util.sigma_clip_stdfunc_mad(self._res/np.sqrt(self._var))
                                 if sig0 is None else sig0])
 
+    @timed('scatter_fit')
     def fit(self, sig0=None, sigma_rej=5, rejiter=None, fixed_rho=False, verbose=0):
         """
         Find the intrinsic scatter in the residuals.
@@ -209,16 +322,15 @@ class IntrinsicScatter:
             self.sig = np.std(self.resid[self.gpm])
             return self.sig, self.rej, self.gpm
 
-        # Assign the merit function to use based on the availability of the
-        # covariance
-        fom_vec = self._merit_vec_err if self.covar is None else self._merit_vec_covar
-        fom = self._merit_err if self.covar is None else self._merit_covar
-
         nrej = 1
         while nrej > 0:
             # Initialize the fit workspace objects
             self._fit_init(sig0=_sig0, fixed_rho=fixed_rho)
 
+            # Assign the merit function to use based on the availability of
+            # the covariance
+            fom_vec, fom = self._merit_functions()
+
             # Run the fit
             result = optimize.least_squares(fom, self._x, method='lm', diff_step=np.array([1e-5]),
                                             verbose=verbose)
@@ -233,6 +345,7 @@ class IntrinsicScatter:
 
         return self.sig, self.rej, self.gpm
 
+    @timed('scatter_iter_fit')
     def iter_fit(self, sig0=None, sigma_rej=5, rejiter=None, fixed_rho=False, verbose=0,
                  fititer=None, sticky=False):
         """
@@ -336,8 +449,7 @@ class IntrinsicScatter:
 
         # Assign the merit function to use based on the availability of the
         # covariance
-        fom_vec = self._merit_vec_err if self.covar is None else self._merit_vec_covar
-        fom = self._merit_err if self.covar is None else self._merit_covar
+        fom_vec, fom = self._merit_functions()
 
         # Number of rejected points, and number of points in the original input
         # vectors.
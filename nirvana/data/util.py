@@ -4,23 +4,38 @@ Provides a random set of utility methods.
 .. include:: ../include/links.rst
 """
 import warnings
+import hashlib
 
 from IPython import embed
 
 import numpy as np
 from scipy import sparse, linalg, stats, special, ndimage, spatial
+from scipy.sparse import csgraph
 # Only used for debugging...
 from matplotlib import pyplot
 
 from astropy.stats import sigma_clip
 
 from ..models import geometry
+from ..util.timing import timed
 
 
 # TODO: Build a Covariance class the pulls in all the covariance methods.  This
 # would make all the positive-definite + tracking easier.
 
 
+_bin_transformations = {}
+"""
+Cache of the binning transformations constructed by
+:func:`get_map_bin_transformations`, keyed by the bin ID array.
+"""
+
+_bin_transformations_size = 16
+"""
+Maximum number of binning transformations kept in the cache.
+"""
+
+
 # TODO: Add a set of weights?
 def get_map_bin_transformations(spatial_shape=None, binid=None):
     r"""
@@ -110,6 +125,15 @@ def get_map_bin_transformations(spatial_shape=None, binid=None):
 
             assert np.array_equal(ubinid, bin_transform.dot(binid.ravel()).astype(int))
 
+    .. note::
+
+        The results for a given ``binid`` array are cached, such that
+        repeated calls (e.g., when constructing the covariance matrices for
+        all the maps of a given galaxy) do not repeat the calculation.  To
+        allow for this, the returned `numpy.ndarray`_ objects are read-only,
+        and the returned ``bin_transform`` matrix should not be altered in
+        place.
+
     """
     if spatial_shape is None and binid is None:
         raise ValueError('Must provide spatial_shape or binid')
@@ -125,6 +149,11 @@ def get_map_bin_transformations(spatial_shape=None, binid=None):
         return None, np.ones(nspax, dtype=int), grid_indx.copy(), grid_indx, grid_indx.copy(), \
                 bin_transform
 
+    # Check if the transformations have already been constructed
+    key = (binid.shape, binid.dtype.str, binid.tobytes())
+    if key in _bin_transformations:
+        return _bin_transformations[key]
+
     # Get the indices of measurements with unique bin IDs, ignoring any
     # IDs set to -1
     binid_map = binid.ravel()
@@ -141,16 +170,35 @@ def get_map_bin_transformations(spatial_shape=None, binid=None):
     # exception is if the bin numbers are not sequential, i.e., the bin numbers
     # are not identical to np.arange(nbin).
 
-    # Construct the bin transform using a sparse matrix
-    d,i,j = np.array([[1/nbin[i],i,j] 
-                     for i,b in enumerate(ubinid)
-                     for j in np.where(binid_map == b)[0]]).T
-    bin_transform = sparse.coo_matrix((d,(i.astype(int),j.astype(int))),
+    # Construct the bin transform using a sparse matrix.  Each valid spaxel
+    # (grid_indx) contributes to the row of its bin (bin_inverse) with a
+    # weight of 1/(number of spaxels in the bin).
+    bin_transform = sparse.coo_matrix((1/nbin[bin_inverse], (bin_inverse, grid_indx)),
                                       shape=(ubinid.size, np.prod(_spatial_shape))).tocsr()
 
-    return ubinid, nbin, ubin_indx, grid_indx, bin_inverse, bin_transform
+    result = (ubinid, nbin, ubin_indx, grid_indx, bin_inverse, bin_transform)
+    for a in result[:-1]:
+        a.setflags(write=False)
+    if len(_bin_transformations) >= _bin_transformations_size:
+        # Remove the oldest entry
+        del _bin_transformations[next(iter(_bin_transformations))]
+    _bin_transformations[key] = result
+    return result
 
 
+_positive_definite = {}
+"""
+Cache of the matrices returned by :func:`impose_positive_definite`, keyed by
+a hash of the input matrix and the function arguments.
+"""
+
+_positive_definite_size = 8
+"""
+Maximum number of matrices kept in the positive-definite cache.
+"""
+
+
+@timed('covar_posdef')
 def impose_positive_definite(mat, min_eigenvalue=1e-10, renormalize=True):
     """
     Force a matrix to be positive definite.
@@ -167,6 +215,13 @@ def impose_positive_definite(mat, min_eigenvalue=1e-10, renormalize=True):
         - Renormalize the reconstructed matrix such its diagonal is identical
           to the input matrix, if requested.
 
+    The matrix is expected to be symmetric.  The steps above are performed
+    independently for each block of the matrix that is not coupled to the
+    rest of the matrix (i.e., each connected component of the graph defined
+    by the non-zero matrix elements), which is mathematically identical to
+    performing them for the full matrix.  Results are cached, such that
+    repeated calls with the same matrix do not repeat the calculation.
+
     Args:
         mat (`scipy.sparse.csr_matrix`_):
             The matrix to force to be positive definite.
@@ -176,32 +231,73 @@ def impose_positive_definite(mat, min_eigenvalue=1e-10, renormalize=True):
             Include the renormalization (last) step in the list above.
 
     Returns:
-        `scipy.sparse.csr_matrix`_: The modified matrix.
+        `scipy.sparse.csr_matrix`_: The modified matrix.  If the input matrix
+        is already positive definite, it is returned.
     """
     if not isinstance(mat, sparse.csr_matrix):
         raise TypeError('Must provide a scipy.sparse.csr_matrix to impose_positive_definite.')
-    # Get the eigenvalues/eigenvectors
+
+    # Check the cache
+    _mat = mat.copy()
+    _mat.sum_duplicates()
+    _mat.sort_indices()
+    key = hashlib.sha1()
+    for a in [np.array(_mat.shape), _mat.indptr, _mat.indices, _mat.data,
+              np.array([min_eigenvalue, float(renormalize)])]:
+        key.update(np.ascontiguousarray(a).tobytes())
+    key = key.hexdigest()
+    if key in _positive_definite:
+        pd_mat = _positive_definite[key]
+        return mat if pd_mat is None else pd_mat.copy()
+
+    # Find the independent blocks of the matrix
+    nblock, block = csgraph.connected_components(_mat != 0, directed=False)
+    srt = np.argsort(block, kind='stable')
+    edges = np.append(0, np.cumsum(np.bincount(block, minlength=nblock)))
+
+    # Get the eigenvalues/eigenvectors of each block
+    # NOTE: The blocks are symmetric, which allows the use of eigh instead of
+    # the general (and slower) eig.
     # WARNING: I didn't explore why too deeply, but scipy.sparse.linalg.eigs
     # provided *significantly* different results. They also seem to be worse in
     # the sense that the reconstructed matrix based on the adjusted eigenvalues
     # is more different than input matrix compared to the use of
     # numpy.linalg.eig.
-    # NOTE: This command can take a while, depending on the size of the
-    # array...
-    w, v = map(lambda x : np.real(x), np.linalg.eig(mat.toarray()))
-    if np.all(w > 0):
+    eig = []
+    for b in range(nblock):
+        indx = srt[edges[b]:edges[b+1]]
+        eig += [(indx, *np.linalg.eigh(_mat[np.ix_(indx,indx)].toarray()))]
+
+    if all([np.all(w > 0) for _, w, _ in eig]):
         # Already positive definite
+        _positive_definite[key] = None
         return mat
-    # Force a minimum eigenvalue
-    w = np.maximum(w, min_eigenvalue)
-    # Reconstruct with the new eigenvalues
-    _mat = np.dot(v, np.dot(np.diag(w), v.T))
-    if not renormalize:
-        return sparse.csr_matrix(_mat)
-    # Renormalize
-    d = mat.diagonal()
-    t = 1./np.sqrt(np.diag(_mat))
-    return sparse.csr_matrix(_mat * np.outer(t,t) * np.sqrt(np.outer(d,d)))
+
+    d = _mat.diagonal()
+    rows = []
+    cols = []
+    data = []
+    for indx, w, v in eig:
+        # Force a minimum eigenvalue
+        w = np.maximum(w, min_eigenvalue)
+        # Reconstruct with the new eigenvalues
+        _blk = np.dot(v * w[None,:], v.T)
+        if renormalize:
+            # Renormalize
+            t = 1./np.sqrt(np.diag(_blk))
+            _blk *= np.outer(t,t) * np.sqrt(np.outer(d[indx],d[indx]))
+        rows += [np.repeat(indx, indx.size)]
+        cols += [np.tile(indx, indx.size)]
+        data += [_blk.ravel()]
+    pd_mat = sparse.csr_matrix((np.concatenate(data), (np.concatenate(rows),
+                                np.concatenate(cols))), shape=_mat.shape)
+
+    # Cache the result
+    if len(_positive_definite) >= _positive_definite_size:
+        # Remove the oldest entry
+        del _positive_definite[next(iter(_positive_definite))]
+    _positive_definite[key] = pd_mat
+    return pd_mat.copy()
 
 
 def is_positive_definite(mat, quiet=True):
@@ -265,6 +361,85 @@ def cinv(mat, check_finite=False, upper=False):
     return cho if upper else np.dot(cho, cho.T)
 
 
+class CholeskyWhitener:
+    r"""
+    Whiten vectors using the Cholesky decomposition of a covariance matrix.
+
+    For covariance matrix :math:`\mathbf{C} = \mathbf{L}\mathbf{L}^T`, where
+    :math:`\mathbf{L}` is lower triangular, the whitened vector
+    :math:`\mathbf{z} = \mathbf{L}^{-1}\mathbf{r}` has
+    :math:`\mathbf{z}^T\mathbf{z} = \mathbf{r}^T\mathbf{C}^{-1}\mathbf{r}`.
+    This is identical to the product of :math:`\mathbf{r}` with the
+    upper-triangle matrix returned by :func:`cinv` (with ``upper=True``), but
+    the inverse is never constructed.  Instead, the whitening is performed by
+    solving the triangular system.
+
+    If the covariance matrix is sparse, its rows and columns are first
+    reordered to minimize its bandwidth (see
+    `scipy.sparse.csgraph.reverse_cuthill_mckee`_).  If the bandwidth of the
+    reordered matrix is sufficiently small, the decomposition and the
+    triangular solves use the banded form of the matrix, such that the cost of
+    whitening a vector scales as :math:`N\ b` instead of :math:`N^2`, where
+    :math:`N` is the size of the matrix and :math:`b` is its bandwidth.  Note
+    that the elements of the whitened vector are then ordered following the
+    reordered matrix; the sum of their squares (i.e., the chi-square) is
+    unchanged.
+
+    Args:
+        covar (`numpy.ndarray`_, `scipy.sparse.csr_matrix`_):
+            The (positive-definite) covariance matrix.
+        max_band_frac (:obj:`float`, optional):
+            The banded decomposition is used if the bandwidth of the
+            (reordered) sparse matrix is less than this fraction of its size.
+    """
+    @timed('covar_factor')
+    def __init__(self, covar, max_band_frac=0.25):
+        self.n = covar.shape[0]
+        self.perm = None
+        self.bandwidth = None
+        if sparse.issparse(covar):
+            _covar = sparse.csr_matrix(covar)
+            perm = csgraph.reverse_cuthill_mckee(_covar, symmetric_mode=True)
+            _covar = _covar[perm][:,perm].tocoo()
+            lower = _covar.row >= _covar.col
+            bandwidth = np.amax(_covar.row[lower] - _covar.col[lower])
+            if bandwidth < max_band_frac*self.n:
+                self.perm = perm
+                self.bandwidth = bandwidth
+                # Construct the lower banded form of the matrix
+                ab = np.zeros((bandwidth+1, self.n), dtype=float)
+                ab[_covar.row[lower] - _covar.col[lower], _covar.col[lower]] \
+                        = _covar.data[lower]
+                self.cho = linalg.cholesky_banded(ab, lower=True)
+                return
+            covar = covar.toarray()
+        self.cho = linalg.cholesky(np.asarray(covar), lower=True)
+
+    @timed('covar_whiten')
+    def __call__(self, vec):
+        """
+        Whiten the provided vector(s).
+
+        Args:
+            vec (`numpy.ndarray`_):
+                A vector of length :math:`N` or a 2D array with shape
+                :math:`(N,M)`; each column of the latter is whitened.
+
+        Returns:
+            `numpy.ndarray`_: The whitened vector(s) with the same shape as
+            ``vec``.
+        """
+        if vec.shape[0] != self.n:
+            raise ValueError('Length of vector does not match the covariance matrix.')
+        if self.bandwidth is None:
+            return linalg.solve_triangular(self.cho, vec, lower=True, check_finite=False)
+        _vec = vec[self.perm]
+        z, info = linalg.lapack.dtbtrs(self.cho, _vec.reshape(self.n,-1), uplo='L')
+        if info != 0:
+            raise ValueError(f'Triangular solve failed; error code {info}.')
+        return z.reshape(_vec.shape)
+
+
 def boxcar_replicate(arr, boxcar):
     """
     Boxcar replicate an array.
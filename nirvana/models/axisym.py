@@ -6,29 +6,35 @@ Module with classes and functions used to fit an axisymmetric disk to a set of k
 """
 
 import os
+import zlib
 import warnings
 
 from IPython import embed
 
 import numpy as np
-from scipy import optimize
+from scipy import optimize, sparse
 from matplotlib import pyplot, rc, patches, ticker, colors
 
 from astropy.io import fits
 
 from .oned import HyperbolicTangent, Exponential, ExpBase, Const, PolyEx
-from .geometry import projected_polar, deriv_projected_polar
-from .beam import ConvolveFFTW, smear, deriv_smear
+from .geometry import projected_polar, deriv_disk_polar
+from .beam import ConvolveFFTW, get_convolver, smear, deriv_smear, half_spectrum_shape, \
+                   kernel_fft_form, beam_support, crop_kernel, convolution_crop, SparseBeam, \
+                   sparse_beam_preferred, zeroth_moment
 from .util import cov_err
 from ..data.scatter import IntrinsicScatter
-from ..data.util import impose_positive_definite, cinv, inverse, find_largest_coherent_region
+from ..data.util import impose_positive_definite, CholeskyWhitener, inverse
+from ..data.util import find_largest_coherent_region
 from ..data.util import select_major_axis, bin_stats, growth_lim, atleast_one_decade
 from ..util.bitmask import BitMask
 from ..util import plot
 from ..util import fileio
+from ..util.timing import timed, timer
 
 #warnings.simplefilter('error', RuntimeWarning)
 
+@timed('fit_reject')
 def disk_fit_reject(kin, disk, disp=None, ignore_covar=True, vel_mask=None, vel_sigma_rej=5,
                     show_vel=False, vel_plot=None, sig_mask=None, sig_sigma_rej=5, show_sig=False,
                     sig_plot=None, rej_flag='REJ_RESID', verbose=False):
@@ -308,6 +314,24 @@ class AxisymmetricDiskGlobalBitMask(BitMask):
         super().__init__(mask_def[:,0], descr=mask_def[:,1])
 
 
+def _array_fingerprint(arr):
+    """
+    Return a cheap fingerprint of an array used to check if it has changed.
+
+    Args:
+        arr (`numpy.ndarray`_):
+            Array to fingerprint.  Can be None.
+
+    Returns:
+        :obj:`tuple`: The shape, data type, and CRC32 checksum of the array
+        data, or None if ``arr`` is None.
+    """
+    if arr is None:
+        return None
+    _arr = np.ascontiguousarray(np.ma.getdata(arr))
+    return _arr.shape, _arr.dtype.str, zlib.crc32(_arr.view(np.uint8))
+
+
 class AxisymmetricDisk:
     r"""
     Simple model for an axisymmetric disk.
@@ -409,6 +433,18 @@ class AxisymmetricDisk:
         self.vel_gpm = None
         self.sig_gpm = None
         self.cnvfftw = None
+        self.crop = None
+        self.crop_beam_fft = None
+        self.crop_cnvfftw = None
+        self.beam_matrix = None
+        self.mom0 = None
+        self._bmodel = None
+        self.fuse_deriv = False
+        # Workspace kept between fits; see _fit_prep and lsq_fit
+        self._fit_inp = None
+        self._crop_inp = None
+        self._fit_domain = None
+        self._fit_scale = None
         self.global_mask = 0
         self.fit_status = None
         self.fit_success = None
@@ -599,6 +635,12 @@ class AxisymmetricDisk:
             self.y = y.astype(float)
         if self.x.shape != self.y.shape:
             raise ValueError('Input coordinates must have the same shape.')
+        # Reset the convolution domain, the zeroth moment of the beam-smeared
+        # surface brightness, the cached model, and the workspace kept from
+        # previous fits
+        self._init_crop(None)
+        self._fit_inp = None
+        self._fit_domain = None
 
     def _init_sb(self, sb):
         """
@@ -631,8 +673,14 @@ class AxisymmetricDisk:
         self.sb = sb.astype(float)
         if self.sb.shape != self.x.shape:
             raise ValueError('Input coordinates must have the same shape.')
-
-    def _init_beam(self, beam, is_fft, cnvfftw):
+        # Reset the zeroth moment of the beam-smeared surface brightness, the
+        # cached model, and the workspace kept from previous fits
+        self.mom0 = None
+        self._bmodel = None
+        self._fit_inp = None
+        self._fit_domain = None
+
+    def _init_beam(self, beam, is_fft, cnvfftw, threads=None, pad=False):
         """
         Initialize the beam-smearing kernel and the convolution method.
 
@@ -641,18 +689,36 @@ class AxisymmetricDisk:
                 The 2D rendering of the beam-smearing kernel, or its Fast
                 Fourier Transform (FFT).  If not None, replace existing
                 :attr:`beam_fft` with this array (or its FFT, depending on the
-                provided ``is_fft``).
+                provided ``is_fft``).  The FFT can be provided as either the
+                full or half spectrum (see
+                :func:`~nirvana.models.beam.kernel_fft_form`); it is
+                converted to the form used by :attr:`cnvfftw`.
             is_fft (:obj:`bool`):
                 The provided ``beam`` object is already the FFT of the
                 beam-smearing kernel.
             cnvfftw (:class:`~nirvana.models.beam.ConvolveFFTW`):
                 An object that expedites the convolutions using FFTW/pyFFTW.  If
-                provided, the shape *must* match :attr:``beam_fft`` (after this
-                is potentially updated by the provided ``beam``).  If None, a
-                new :class:`~nirvana.models.beam.ConvolveFFTW` instance is
-                constructed to perform the convolutions.  If the class cannot be
-                constructed because the user doesn't have pyfftw installed, then
+                provided, the shape *must* match the coordinate arrays.  If
+                None, the shared instance provided by
+                :func:`~nirvana.models.beam.get_convolver` is used to perform
+                the convolutions using the real-to-complex FFTW algorithms.  If
+                the class cannot be constructed because the user doesn't have pyfftw installed, then
                 the convolutions fall back to the numpy routines.
+            threads (:obj:`int`, optional):
+                The number of threads used by the
+                :class:`~nirvana.models.beam.ConvolveFFTW` instance when
+                ``cnvfftw`` is None.  If None, any existing :attr:`cnvfftw`
+                with the correct shape is kept, regardless of the number of
+                threads it uses; a new instance uses a single thread.
+            pad (:obj:`bool`, optional):
+                Zero-pad the images such that the convolutions are linear
+                instead of circular; see
+                :class:`~nirvana.models.beam.ConvolveFFTW`.  The padded
+                shape is set by the support of the beam (see
+                :func:`~nirvana.models.beam.beam_support`), and
+                :attr:`beam_fft` is replaced by the FFT of the padded beam.
+                Ignored if ``cnvfftw`` is provided.  Padding requires
+                ConvolveFFTW; the numpy convolutions are never padded.
         """
         if beam is None:
             # Nothing to do
@@ -665,32 +731,283 @@ class AxisymmetricDisk:
             raise ValueError('To perform convolution, must provide 2d coordinate arrays.')
 
         # Assign the beam and check it
-        self.beam_fft = beam if is_fft else np.fft.fftn(np.fft.ifftshift(beam))
-        if self.beam_fft.shape != self.x.shape:
+        self.beam_fft = beam if is_fft else np.fft.rfftn(np.fft.ifftshift(beam))
+        if self.beam_fft.shape not in [self.x.shape, half_spectrum_shape(self.x.shape)]:
             raise ValueError('Currently, convolution requires the beam map to have the same '
                                 'shape as the coordinate maps.')
 
         # Convolutions will be performed, try to setup the ConvolveFFTW
         # object (self.cnvfftw).
-        if cnvfftw is None:
-            if self.cnvfftw is not None and self.cnvfftw.shape == self.beam_fft.shape:
-                # ConvolveFFTW is ready to go
-                return
-
+        if pad and cnvfftw is None:
+            # Direct image of the beam, used to set the padded shape
+            beam = np.fft.fftshift(np.fft.irfftn(kernel_fft_form(self.beam_fft, self.x.shape,
+                                                                 True), s=self.x.shape))
             try:
-                self.cnvfftw = ConvolveFFTW(self.beam_fft.shape)
+                self.cnvfftw = get_convolver(self.x.shape, real=True,
+                                             threads=1 if threads is None else threads, pad=True,
+                                             support=beam_support(beam))
             except:
                 warnings.warn('Could not instantiate ConvolveFFTW; proceeding with numpy '
-                              'FFT/convolution routines.')
+                              'FFT/convolution routines, without padding.')
                 self.cnvfftw = None
+        elif cnvfftw is None:
+            if self.cnvfftw is None or self.cnvfftw.shape != self.x.shape or self.cnvfftw.pad \
+                    or (threads is not None and self.cnvfftw.threads != threads):
+                try:
+                    self.cnvfftw = get_convolver(self.x.shape, real=True,
+                                                 threads=1 if threads is None else threads)
+                except:
+                    warnings.warn('Could not instantiate ConvolveFFTW; proceeding with numpy '
+                                  'FFT/convolution routines.')
+                    self.cnvfftw = None
         else:
             # A cnvfftw was provided, check it
             if not isinstance(cnvfftw, ConvolveFFTW):
                 raise TypeError('Provided cnvfftw must be a ConvolveFFTW instance.')
-            if cnvfftw.shape != self.beam_fft.shape:
+            if cnvfftw.shape != self.x.shape:
                 raise ValueError('cnvfftw shape does not match beam shape.')
             self.cnvfftw = cnvfftw
 
+        # Match the form of the beam FFT to the convolution engine.  Without
+        # ConvolveFFTW, the numpy convolutions use the half spectrum.
+        self.beam_fft = kernel_fft_form(self.beam_fft, self.x.shape,
+                                        self.cnvfftw is None or self.cnvfftw.real)
+        if self.cnvfftw is not None and self.cnvfftw.pad:
+            # Compute the padded beam FFT once
+            self.beam_fft = self.cnvfftw.fft_kernel(self.beam_fft, kernel_fft=True)
+        # Reset the convolution domain, the zeroth moment of the beam-smeared
+        # surface brightness, the cached model, and the workspace kept from
+        # previous fits
+        self._init_crop(None)
+        self._fit_inp = None
+        self._fit_domain = None
+
+    def _init_crop(self, gpm, crop=True, sparse=None):
+        """
+        Initialize the domain and method used for the beam-smearing
+        convolutions.
+
+        When fitting data, the beam-smeared model is only needed for the
+        spaxels included in the fit.  This method sets up one of two ways
+        to take advantage of this:
+
+            - :attr:`crop` is set to the (smaller) box of spaxels that
+              contains the fitted region and the margin needed to include the
+              full extent of the beam (see
+              :func:`~nirvana.models.beam.convolution_crop`), and the beam FFT
+              (:attr:`crop_beam_fft`) and convolution object
+              (:attr:`crop_cnvfftw`) are set up for this box.  Outside of
+              the fitted region, :func:`model` and :func:`deriv_model` return
+              the intrinsic model.
+
+            - :attr:`beam_matrix` is set to a
+              :class:`~nirvana.models.beam.SparseBeam` object that performs
+              the convolutions in direct space for the fitted spaxels only.
+              Outside of the fitted region, :func:`model` and
+              :func:`deriv_model` return 0.
+
+        In both cases, the result of the convolution within the fitted region
+        is identical to the (circular) convolution of the full map, to within
+        the truncation of the beam.  Neither is used if the convolutions are
+        padded (see :func:`_init_beam`).
+
+        Args:
+            gpm (`numpy.ndarray`_):
+                Boolean map selecting the spaxels included in the fit.  If
+                None, or if there is no beam, the full map is always
+                convolved using FFTs.
+            crop (:obj:`bool`, optional):
+                Allow the FFT convolutions to be limited to a cropped region.
+            sparse (:obj:`bool`, optional):
+                Use the sparse-matrix convolutions.  If None, the sparse
+                convolutions are used if they are expected to be faster than
+                the FFTs (see
+                :func:`~nirvana.models.beam.sparse_beam_preferred`).
+        """
+        self.crop = None
+        self.crop_beam_fft = None
+        self.crop_cnvfftw = None
+        self.beam_matrix = None
+        self.mom0 = None
+        self._bmodel = None
+        self._crop_inp = None
+        if gpm is None or self.beam_fft is None \
+                or (self.cnvfftw is not None and self.cnvfftw.pad):
+            return
+        self._crop_inp = (gpm, crop, sparse)
+
+        # Direct image of the beam
+        beam = np.fft.fftshift(np.fft.irfftn(kernel_fft_form(self.beam_fft, self.x.shape, True),
+                                             s=self.x.shape))
+        crop = convolution_crop(gpm, beam_support(beam)) if crop else None
+        if sparse is None:
+            sparse = sparse_beam_preferred(gpm, beam, shape=None if crop is None
+                                                        else tuple([c.size for c in crop]))
+        if sparse:
+            self.beam_matrix = SparseBeam(beam, gpm)
+            return
+        if crop is None:
+            # No reduction in the size of the convolution
+            return
+        self.crop = np.ix_(*crop)
+        shape = tuple([c.size for c in crop])
+        if self.cnvfftw is not None:
+            try:
+                self.crop_cnvfftw = get_convolver(shape, real=True, threads=self.cnvfftw.threads)
+            except:
+                warnings.warn('Could not instantiate ConvolveFFTW for cropped region; '
+                              'proceeding with numpy FFT/convolution routines.')
+                self.crop_cnvfftw = None
+        self.crop_beam_fft = np.fft.rfftn(np.fft.ifftshift(crop_kernel(beam, shape)))
+
+    def _restore_fit_domain(self, gpm, crop=True, sparse=None):
+        """
+        Restore the convolution domain kept from the previous fit.
+
+        The domain set up by :func:`_init_crop` for a given set of fitted
+        spaxels can be used for any subset of those spaxels: the
+        beam-smeared model for the fitted spaxels is identical, and only the
+        model for the additional spaxels is superfluous.  The domain from the
+        previous fit (see :func:`lsq_fit`) is restored if ``gpm`` only
+        deselects a few of the previously fitted spaxels and the other
+        arguments are the same as those used to construct it.  This avoids
+        rebuilding the sparse beam matrix or cropped convolution and
+        recomputing the zeroth moment when, e.g., a fit is repeated after
+        rejecting outliers.
+
+        Args:
+            gpm (`numpy.ndarray`_):
+                Boolean map selecting the spaxels included in the fit.
+            crop (:obj:`bool`, optional):
+                Allow the FFT convolutions to be limited to a cropped region.
+            sparse (:obj:`bool`, optional):
+                Use the sparse-matrix convolutions.
+
+        Returns:
+            :obj:`bool`: Flag that the domain was restored.  If False, the
+            domain is unchanged.
+        """
+        if gpm is None or self._fit_domain is None:
+            return False
+        (_gpm, _crop, _sparse), domain = self._fit_domain
+        if _crop != crop or _sparse != sparse or np.any(gpm & np.logical_not(_gpm)):
+            return False
+        # Rebuild the domain if many of the spaxels are no longer needed.
+        if np.sum(gpm) < 0.8*np.sum(_gpm):
+            return False
+        self.crop, self.crop_beam_fft, self.crop_cnvfftw, self.beam_matrix, self.mom0 = domain
+        self._crop_inp = (_gpm, _crop, _sparse)
+        self._bmodel = None
+        return True
+
+    def _get_mom0(self):
+        """
+        Return the zeroth moment of the beam-smeared surface brightness and
+        its inverse.
+
+        The zeroth moment does not depend on the model parameters.  It is
+        computed for the current convolution domain (see :func:`_init_crop`)
+        the first time it is needed and kept in :attr:`mom0` until the
+        coordinates, surface brightness, beam, or convolution domain change.
+
+        Returns:
+            :obj:`tuple`: The zeroth moment and its inverse; see
+            :func:`~nirvana.models.beam.zeroth_moment`.
+        """
+        if self.mom0 is not None:
+            return self.mom0
+        if self.crop is None:
+            self.mom0 = zeroth_moment(self.beam_fft, self.x.shape, beam_fft=True, sb=self.sb,
+                                      cnvfftw=self.cnvfftw if self.beam_matrix is None
+                                                else self.beam_matrix)
+        else:
+            self.mom0 = zeroth_moment(self.crop_beam_fft, self.x[self.crop].shape, beam_fft=True,
+                                      sb=None if self.sb is None else self.sb[self.crop],
+                                      cnvfftw=self.crop_cnvfftw)
+        return self.mom0
+
+    def _smear(self, v, sig=None):
+        """
+        Smear the intrinsic velocity (and dispersion) maps.
+
+        This is a wrapper for :func:`~nirvana.models.beam.smear` that only
+        performs the convolution within :attr:`crop`, or uses
+        :attr:`beam_matrix`, if either is defined (see :func:`_init_crop`).
+
+        Args:
+            v (`numpy.ndarray`_):
+                Intrinsic velocity map.
+            sig (`numpy.ndarray`_, optional):
+                Intrinsic velocity dispersion map.
+
+        Returns:
+            :obj:`tuple`: The beam-smeared velocity and velocity dispersion
+            maps; the latter is None if ``sig`` is None.
+        """
+        if self.crop is None:
+            return smear(v, self.beam_fft, beam_fft=True, sb=self.sb, sig=sig,
+                         cnvfftw=self.cnvfftw if self.beam_matrix is None
+                                    else self.beam_matrix, mom0=self._get_mom0())[1:]
+        _v, _sig = smear(v[self.crop], self.crop_beam_fft, beam_fft=True,
+                         sb=None if self.sb is None else self.sb[self.crop],
+                         sig=None if sig is None else sig[self.crop],
+                         cnvfftw=self.crop_cnvfftw, mom0=self._get_mom0())[1:]
+        v = v.copy()
+        v[self.crop] = _v
+        if sig is not None:
+            sig = sig.copy()
+            sig[self.crop] = _sig
+        return v, sig
+
+    def _deriv_smear(self, v, dv, sig=None, dsig=None):
+        """
+        Smear the intrinsic velocity (and dispersion) maps and propagate the
+        derivatives.
+
+        This is a wrapper for :func:`~nirvana.models.beam.deriv_smear` that
+        only performs the convolutions within :attr:`crop`, or uses
+        :attr:`beam_matrix`, if either is defined (see :func:`_init_crop`).
+
+        Args:
+            v (`numpy.ndarray`_):
+                Intrinsic velocity map.
+            dv (`numpy.ndarray`_):
+                Derivatives of the velocity map w.r.t. the model parameters.
+            sig (`numpy.ndarray`_, optional):
+                Intrinsic velocity dispersion map.
+            dsig (`numpy.ndarray`_, optional):
+                Derivatives of the velocity dispersion map w.r.t. the model
+                parameters.
+
+        Returns:
+            :obj:`tuple`: The beam-smeared velocity and velocity dispersion
+            maps and their derivatives; the dispersion arrays are None if
+            ``sig`` is None.
+        """
+        if self.crop is None:
+            _, v, sig, _, dv, dsig \
+                    = deriv_smear(v, dv, self.beam_fft, beam_fft=True, sb=self.sb, sig=sig,
+                                  dsig=dsig, cnvfftw=self.cnvfftw if self.beam_matrix is None
+                                                        else self.beam_matrix,
+                                  mom0=self._get_mom0())
+            return v, sig, dv, dsig
+        _, _v, _sig, _, _dv, _dsig \
+                = deriv_smear(v[self.crop], dv[self.crop], self.crop_beam_fft, beam_fft=True,
+                              sb=None if self.sb is None else self.sb[self.crop],
+                              sig=None if sig is None else sig[self.crop],
+                              dsig=None if dsig is None else dsig[self.crop],
+                              cnvfftw=self.crop_cnvfftw, mom0=self._get_mom0())
+        v = v.copy()
+        v[self.crop] = _v
+        dv = dv.copy()
+        dv[self.crop] = _dv
+        if sig is not None:
+            sig = sig.copy()
+            sig[self.crop] = _sig
+            dsig = dsig.copy()
+            dsig[self.crop] = _dsig
+        return v, sig, dv, dsig
+
     def _init_par(self, p0, fix):
         """
         Initialize the relevant parameter vectors that track the full set of
@@ -718,6 +1035,7 @@ class AxisymmetricDisk:
         self.free = _free
         self.nfree = np.sum(self.free)
 
+    @timed('model')
     def model(self, par=None, x=None, y=None, sb=None, beam=None, is_fft=False, cnvfftw=None,
               ignore_beam=False):
         """
@@ -805,20 +1123,17 @@ class AxisymmetricDisk:
         vel = self.rc.sample(r, par=self.par[ps:pe])*np.cos(theta) + self.par[4]
         if self.dc is None:
             # Only fitting the velocity field
-            return vel if self.beam_fft is None or ignore_beam \
-                        else smear(vel, self.beam_fft, beam_fft=True, sb=self.sb,
-                                   cnvfftw=self.cnvfftw)[1]
+            return vel if self.beam_fft is None or ignore_beam else self._smear(vel)[0]
 
         # Fitting both the velocity and velocity-dispersion field
         ps = pe
         pe = ps + self.dc.np
         sig = self.dc.sample(r, par=self.par[ps:pe])
-        return (vel, sig) if self.beam_fft is None or ignore_beam \
-                        else smear(vel, self.beam_fft, beam_fft=True, sb=self.sb, sig=sig,
-                                   cnvfftw=self.cnvfftw)[1:]
+        return (vel, sig) if self.beam_fft is None or ignore_beam else self._smear(vel, sig=sig)
 
+    @timed('deriv_model')
     def deriv_model(self, par=None, x=None, y=None, sb=None, beam=None, is_fft=False, cnvfftw=None,
-                    ignore_beam=False):
+                    ignore_beam=False, free=False):
         """
         Evaluate the derivative of the model w.r.t all input parameters.
 
@@ -872,6 +1187,12 @@ class AxisymmetricDisk:
             ignore_beam (:obj:`bool`, optional):
                 Ignore the beam-smearing when constructing the model. I.e.,
                 construct the *intrinsic* model.
+            free (:obj:`bool`, optional):
+                Only compute the derivatives w.r.t. the *free* parameters (see
+                :attr:`free`).  The length of the last axis of the returned
+                derivative arrays is then :attr:`nfree` instead of :attr:`np`,
+                and the construction and beam-smearing of the derivatives for
+                the fixed parameters are skipped.
 
         Returns:
             `numpy.ndarray`_, :obj:`tuple`: The velocity field model, and the
@@ -893,20 +1214,23 @@ class AxisymmetricDisk:
         if par is not None:
             self._set_par(par)
 
-        # Initialize the derivative arrays needed for the coordinate calculation
-        dx = np.zeros(self.x.shape+(self.np,), dtype=float)
-        dy = np.zeros(self.x.shape+(self.np,), dtype=float)
-        dpa = np.zeros(self.np, dtype=float)
-        dinc = np.zeros(self.np, dtype=float)
-
-        dx[...,0] = -1.
-        dy[...,1] = -1.
-        dpa[2] = np.radians(1.)
-        dinc[3] = np.radians(1.)
-
-        r, theta, dr, dtheta = deriv_projected_polar(self.x - self.par[0], self.y - self.par[1],
-                                                     *np.radians(self.par[2:4]), dxdp=dx, dydp=dy,
-                                                     dpadp=dpa, dincdp=dinc)
+        # Select the parameters for the derivative calculation.  The
+        # derivative w.r.t. parameter i is in column col[i] of the derivative
+        # arrays, which is -1 if the derivative is not computed.
+        _free = self.free if free else np.ones(self.np, dtype=bool)
+        nd = np.sum(_free)
+        col = np.full(self.np, -1, dtype=int)
+        col[_free] = np.arange(nd)
+
+        # Calculate the coordinates and their derivatives w.r.t. the geometric
+        # parameters.  These are only non-zero for the columns in gcol.
+        gcol = col[:4][_free[:4]]
+        r, theta, dr, dtheta = deriv_disk_polar(self.x, self.y, *self.par[:2],
+                                                *np.radians(self.par[2:4]), free=_free[:4])
+        # Position angle and inclination are in degrees
+        angle = np.where(_free[:4])[0] > 1
+        dr[...,angle] *= np.radians(1.)
+        dtheta[...,angle] *= np.radians(1.)
 
         # NOTE: The velocity-field construction does not include the
         # sin(inclination) term because this is absorbed into the
@@ -917,15 +1241,18 @@ class AxisymmetricDisk:
         pe = ps + self.rc.np
 
         # Calculate the rotation speed and its parameter derivatives
-        dvrot = np.zeros(self.x.shape+(self.np,), dtype=float)
-        vrot, dvrot[...,ps:pe] = self.rc.deriv_sample(r, par=self.par[ps:pe])
-        dvrot += self.rc.ddx(r, par=self.par[ps:pe])[...,None]*dr
+        dvrot = np.zeros(self.x.shape+(nd,), dtype=float)
+        vrot, _dvrot = self.rc.deriv_sample(r, par=self.par[ps:pe])
+        dvrot[...,col[ps:pe][_free[ps:pe]]] = _dvrot[...,_free[ps:pe]]
+        dvrot[...,gcol] += self.rc.ddx(r, par=self.par[ps:pe])[...,None]*dr
 
         # Calculate the line-of-sight velocity and its parameter derivatives
         cost = np.cos(theta)
         v = vrot*cost + self.par[4]
-        dv = dvrot*cost[...,None] - (vrot*np.sin(theta))[...,None]*dtheta
-        dv[...,4] = 1.
+        dv = dvrot*cost[...,None]
+        dv[...,gcol] -= (vrot*np.sin(theta))[...,None]*dtheta
+        if _free[4]:
+            dv[...,col[4]] = 1.
 
         if self.dc is None:
             # Only fitting the velocity field
@@ -933,8 +1260,7 @@ class AxisymmetricDisk:
                 # Not smearing
                 return v, dv
             # Smear and propagate through the derivatives
-            _, v, _, _, dv, _ = deriv_smear(v, dv, self.beam_fft, beam_fft=True, sb=self.sb,
-                                            cnvfftw=self.cnvfftw)
+            v, _, dv, _ = self._deriv_smear(v, dv)
             return v, dv
 
         # Fitting both the velocity and velocity-dispersion field
@@ -944,45 +1270,94 @@ class AxisymmetricDisk:
         pe = ps + self.dc.np
 
         # Calculate the dispersion profile and its parameter derivatives
-        dsig = np.zeros(self.x.shape+(self.np,), dtype=float)
-        sig, dsig[...,ps:pe] = self.dc.deriv_sample(r, par=self.par[ps:pe])
-        dsig += self.dc.ddx(r, par=self.par[ps:pe])[...,None]*dr
+        dsig = np.zeros(self.x.shape+(nd,), dtype=float)
+        sig, _dsig = self.dc.deriv_sample(r, par=self.par[ps:pe])
+        dsig[...,col[ps:pe][_free[ps:pe]]] = _dsig[...,_free[ps:pe]]
+        dsig[...,gcol] += self.dc.ddx(r, par=self.par[ps:pe])[...,None]*dr
 
         if self.beam_fft is None or ignore_beam:
             # Not smearing
             return v, sig, dv, dsig
 
         # Smear and propagate through the derivatives
-        _, v, sig, _, dv, dsig = deriv_smear(v, dv, self.beam_fft, beam_fft=True, sb=self.sb,
-                                             sig=sig, dsig=dsig, cnvfftw=self.cnvfftw)
-        return v, sig, dv, dsig
+        return self._deriv_smear(v, dv, sig=sig, dsig=dsig)
+
+    def _binned_model(self, par, deriv=False):
+        """
+        Construct the binned model and, if requested, its derivatives.
+
+        The result is cached for the last set of parameters, such that
+        repeated calls with the same parameters do not reconstruct the
+        model.  By default, the derivatives are only computed when they are
+        requested, meaning that the Jacobian computed by
+        `scipy.optimize.least_squares`_ at the same parameters as the
+        figure-of-merit reconstructs the model along with its derivatives,
+        but trial steps that are rejected by the optimizer never pay for the
+        derivatives.  If :attr:`fuse_deriv` is True, the derivatives are
+        always computed with the model, such that the Jacobian never
+        requires a new model evaluation.
+
+        Args:
+            par (`numpy.ndarray`_):
+                The list of parameters to use. Length should be either
+                :attr:`np` or :attr:`nfree`. If the latter, the values of the
+                fixed parameters in :attr:`par` are used.
+            deriv (:obj:`bool`, optional):
+                Return the model derivatives.
+
+        Returns:
+            :obj:`tuple`: The binned velocity and velocity dispersion models
+            and their derivatives w.r.t. the *free* model parameters.  The
+            dispersion arrays are None if the dispersion is not being
+            modeled; the derivatives are None if they were not computed.
+        """
+        self._set_par(par)
+        if self._bmodel is not None and np.array_equal(self._bmodel[0], self.par) \
+                and (not deriv or self._bmodel[3] is not None):
+            return self._bmodel[1:]
+
+        if deriv or self.fuse_deriv:
+            if self.dc is None:
+                vel, dvel = self.kin.deriv_bin(*self.deriv_model(free=True))
+                sig, dsig = None, None
+            else:
+                vel, sig, dvel, dsig = self.deriv_model(free=True)
+                vel, dvel = self.kin.deriv_bin(vel, dvel)
+                sig, dsig = self.kin.deriv_bin(sig, dsig)
+        else:
+            vel, sig = (self.kin.bin(self.model()), None) if self.dc is None \
+                            else map(lambda x : self.kin.bin(x), self.model())
+            dvel, dsig = None, None
+        self._bmodel = (self.par.copy(), vel, sig, dvel, dsig)
+        return self._bmodel[1:]
 
     def _v_resid(self, vel):
         return self.kin.vel[self.vel_gpm] - vel[self.vel_gpm]
     def _deriv_v_resid(self, dvel):
-        return -dvel[np.ix_(self.vel_gpm, self.free)]
+        return -dvel[self.vel_gpm]
     def _v_chisqr(self, vel):
         return self._v_resid(vel) / self._v_err[self.vel_gpm]
     def _deriv_v_chisqr(self, dvel):
         return self._deriv_v_resid(dvel) / self._v_err[self.vel_gpm, None]
     def _v_chisqr_covar(self, vel):
-        return np.dot(self._v_resid(vel), self._v_ucov)
+        return self._v_whiten(self._v_resid(vel))
     def _deriv_v_chisqr_covar(self, dvel):
-        return np.dot(self._deriv_v_resid(dvel).T, self._v_ucov).T
+        return self._v_whiten(self._deriv_v_resid(dvel))
 
     def _s_resid(self, sig):
         return self.kin.sig_phys2[self.sig_gpm] - sig[self.sig_gpm]**2
     def _deriv_s_resid(self, sig, dsig):
-        return -2 * sig[self.sig_gpm,None] * dsig[np.ix_(self.sig_gpm, self.free)]
+        return -2 * sig[self.sig_gpm,None] * dsig[self.sig_gpm]
     def _s_chisqr(self, sig):
         return self._s_resid(sig) / self._s_err[self.sig_gpm]
     def _deriv_s_chisqr(self, sig, dsig):
         return self._deriv_s_resid(sig, dsig) / self._s_err[self.sig_gpm, None]
     def _s_chisqr_covar(self, sig):
-        return np.dot(self._s_resid(sig), self._s_ucov)
+        return self._s_whiten(self._s_resid(sig))
     def _deriv_s_chisqr_covar(self, sig, dsig):
-        return np.dot(self._deriv_s_resid(sig, dsig).T, self._s_ucov).T
+        return self._s_whiten(self._deriv_s_resid(sig, dsig))
 
+    @timed('fom')
     def _resid(self, par, sep=False):
         """
         Calculate the residuals between the data and the current model.
@@ -1002,13 +1377,12 @@ class AxisymmetricDisk:
             all data or as separate vectors for the velocity and velocity
             dispersion data (based on ``sep``).
         """
-        self._set_par(par)
-        vel, sig = (self.kin.bin(self.model()), None) if self.dc is None \
-                        else map(lambda x : self.kin.bin(x), self.model())
+        vel, sig = self._binned_model(par)[:2]
         vfom = self._v_resid(vel)
         sfom = numpy.array([]) if self.dc is None else self._s_resid(sig)
         return (vfom, sfom) if sep else np.append(vfom, sfom)
 
+    @timed('jac')
     def _deriv_resid(self, par, sep=False):
         """
         Calculate the derivative of the fit residuals w.r.t. all the *free*
@@ -1029,18 +1403,15 @@ class AxisymmetricDisk:
             single array for all data or as separate arrays for the velocity and
             velocity dispersion data (based on ``sep``).
         """
-        self._set_par(par)
+        vel, sig, dvel, dsig = self._binned_model(par, deriv=True)
         if self.dc is None:
-            vel, dvel = self.kin.deriv_bin(*self.deriv_model())
             return (self._deriv_v_resid(dvel), numpy.array([])) \
                         if sep else self._deriv_v_resid(dvel)
 
-        vel, sig, dvel, dsig = self.deriv_model()
-        vel, dvel = self.kin.deriv_bin(vel, dvel)
-        sig, dsig = self.kin.deriv_bin(sig, dsig)
-        resid = (self._deriv_v_resid(vel), self._deriv_s_resid(sig, dsig))
+        resid = (self._deriv_v_resid(dvel), self._deriv_s_resid(sig, dsig))
         return resid if sep else np.vstack(resid)
 
+    @timed('fom')
     def _chisqr(self, par, sep=False):
         """
         Calculate the error-normalized residual (close to the signed
@@ -1061,9 +1432,7 @@ class AxisymmetricDisk:
             returned as a single vector for all data or as separate vectors for
             the velocity and velocity dispersion data (based on ``sep``).
         """
-        self._set_par(par)
-        vel, sig = (self.kin.bin(self.model()), None) if self.dc is None \
-                        else map(lambda x : self.kin.bin(x), self.model())
+        vel, sig = self._binned_model(par)[:2]
         if self.has_covar:
             vfom = self._v_chisqr_covar(vel)
             sfom = np.array([]) if self.dc is None else self._s_chisqr_covar(sig)
@@ -1072,6 +1441,7 @@ class AxisymmetricDisk:
             sfom = np.array([]) if self.dc is None else self._s_chisqr(sig)
         return (vfom, sfom) if sep else np.append(vfom, sfom)
 
+    @timed('jac')
     def _deriv_chisqr(self, par, sep=False):
         """
         Calculate the derivatives of the error-normalized residuals (close to
@@ -1093,16 +1463,12 @@ class AxisymmetricDisk:
             array for all data or as separate arrays for the velocity and
             velocity dispersion data (based on ``sep``).
         """
-        self._set_par(par)
+        vel, sig, dvel, dsig = self._binned_model(par, deriv=True)
         vf = self._deriv_v_chisqr_covar if self.has_covar else self._deriv_v_chisqr
         if self.dc is None:
-            vel, dvel = self.kin.deriv_bin(*self.deriv_model())
             return (vf(dvel), numpy.array([])) if sep else vf(dvel)
 
         sf = self._deriv_s_chisqr_covar if self.has_covar else self._deriv_s_chisqr
-        vel, sig, dvel, dsig = self.deriv_model()
-        vel, dvel = self.kin.deriv_bin(vel, dvel)
-        sig, dsig = self.kin.deriv_bin(sig, dsig)
 
 #        print(f'{np.all(np.isfinite(dvel)):>5} {np.amin(dvel):.1f} {np.amax(dvel):.1f}'
 #              f'{np.all(np.isfinite(dsig)):>5} {np.amin(dsig):.1f} {np.amax(dsig):.1f}')
@@ -1113,7 +1479,9 @@ class AxisymmetricDisk:
 
         return dchisqr if sep else np.vstack(dchisqr)
 
-    def _fit_prep(self, kin, p0, fix, scatter, sb_wgt, assume_posdef_covar, ignore_covar, cnvfftw):
+    @timed('fit_prep')
+    def _fit_prep(self, kin, p0, fix, scatter, sb_wgt, assume_posdef_covar, ignore_covar, cnvfftw,
+                  threads=1, crop=True, sparse_beam=None, fuse_deriv=False):
         """
         Prepare the object for fitting the provided kinematic data.
 
@@ -1152,21 +1520,58 @@ class AxisymmetricDisk:
             cnvfftw (:class:`~nirvana.models.beam.ConvolveFFTW`):
                 An object that expedites the convolutions using FFTW/pyFFTW.  If
                 provided, the shape *must* match ``kin.spatial_shape``.  If
-                None, a new :class:`~nirvana.models.beam.ConvolveFFTW` instance
-                is constructed to perform the convolutions.  If the class cannot
+                None, the shared instance provided by
+                :func:`~nirvana.models.beam.get_convolver` is used to perform
+                the convolutions.  If the class cannot
                 be constructed because the user doesn't have pyfftw installed,
                 then the convolutions fall back to the numpy routines.
+            threads (:obj:`int`, optional):
+                The number of threads used by the FFTW convolutions, if
+                ``cnvfftw`` is None.
+            crop (:obj:`bool`, optional):
+                Limit the beam-smearing convolutions to the smallest region
+                that includes the data being fit; see :func:`_init_crop`.
+            sparse_beam (:obj:`bool`, optional):
+                Perform the beam-smearing convolutions using a sparse matrix
+                in direct space, instead of FFTs.  If None, the choice is
+                made automatically; see :func:`_init_crop`.
+            fuse_deriv (:obj:`bool`, optional):
+                Always compute the model derivatives with the model; see
+                :func:`_binned_model`.
         """
         # Initialize the fit parameters
         self._init_par(p0, fix)
-        # Initialize the data to fit
+        self.fuse_deriv = fuse_deriv
+        self._bmodel = None
+        # Initialize the data to fit.  The coordinates, surface brightness,
+        # and beam kernel are only re-initialized if they are not the same
+        # as those used by the previous fit; e.g., when repeating the fit
+        # after rejecting data (see axisym_iter_fit).  The arrays are compared
+        # using their fingerprints so that changes made in-place are caught.
         self.kin = kin
-        self._init_coo(self.kin.grid_x, self.kin.grid_y)
-        self._init_sb(self.kin.grid_sb if sb_wgt else None)
+        fit_inp = tuple([_array_fingerprint(a) for a in
+                            [self.kin.grid_x, self.kin.grid_y,
+                             self.kin.grid_sb if sb_wgt else None, self.kin.beam_fft]]) \
+                    + (self.kin.pad_beam,)
+        if self._fit_inp is None or cnvfftw is not None or fit_inp != self._fit_inp \
+                or (self.cnvfftw is not None and self.cnvfftw.threads != threads):
+            self._init_coo(self.kin.grid_x, self.kin.grid_y)
+            self._init_sb(self.kin.grid_sb if sb_wgt else None)
+            # Initialize the beam kernel
+            self._init_beam(self.kin.beam_fft, True, cnvfftw, threads=threads,
+                            pad=self.kin.pad_beam)
+            self._fit_inp = fit_inp
         self.vel_gpm = np.logical_not(self.kin.vel_mask)
         self.sig_gpm = None if self.dc is None else np.logical_not(self.kin.sig_mask)
-        # Initialize the beam kernel
-        self._init_beam(self.kin.beam_fft, True, cnvfftw)
+        # Initialize the cropped convolution domain, reusing the domain from
+        # the previous fit if possible
+        gpm = None
+        if crop or sparse_beam is not False:
+            gpm = self.kin.remap(self.vel_gpm, masked=False)
+            if self.sig_gpm is not None:
+                gpm |= self.kin.remap(self.sig_gpm, masked=False)
+        if not self._restore_fit_domain(gpm, crop=crop, sparse=sparse_beam):
+            self._init_crop(gpm, crop=crop, sparse=sparse_beam)
 
         # Determine which errors were provided
         self.has_err = self.kin.vel_ivar is not None if self.dc is None \
@@ -1233,17 +1638,20 @@ class AxisymmetricDisk:
                 # A diagonal matrix with only positive values is, by definition,
                 # positive definite; and the sum of two positive-definite
                 # matrices is also positive definite.
-                vel_pd_covar += np.diag(np.full(vel_pd_covar.shape[0], self.scatter[0]**2,
-                                                dtype=float))
+                vel_pd_covar = vel_pd_covar \
+                        + sparse.diags(np.full(vel_pd_covar.shape[0], self.scatter[0]**2,
+                                               dtype=float), format='csr')
                 if self.dc is not None:
-                    sig_pd_covar += np.diag(np.full(sig_pd_covar.shape[0], self.scatter[1]**2,
-                                                    dtype=float))
+                    sig_pd_covar = sig_pd_covar \
+                            + sparse.diags(np.full(sig_pd_covar.shape[0], self.scatter[1]**2,
+                                                   dtype=float), format='csr')
 
-            self._v_ucov = cinv(vel_pd_covar, upper=True)
-            self._s_ucov = None if sig_pd_covar is None else cinv(sig_pd_covar, upper=True)
+            # Construct the objects used to whiten the residuals
+            self._v_whiten = CholeskyWhitener(vel_pd_covar)
+            self._s_whiten = None if sig_pd_covar is None else CholeskyWhitener(sig_pd_covar)
         else:
-            self._v_ucov = None
-            self._s_ucov = None
+            self._v_whiten = None
+            self._s_whiten = None
 
     def _get_fom(self):
         """
@@ -1261,9 +1669,11 @@ class AxisymmetricDisk:
     # TODO: Include an argument here that allows the PSF convolution to be
     # toggled, regardless of whether or not the `kin` object has the beam
     # defined.
+    @timed('lsq_fit')
     def lsq_fit(self, kin, sb_wgt=False, p0=None, fix=None, lb=None, ub=None, scatter=None,
                 verbose=0, assume_posdef_covar=False, ignore_covar=True, cnvfftw=None,
-                analytic_jac=True, maxiter=5):
+                analytic_jac=True, maxiter=5, threads=1, crop=True, sparse_beam=None,
+                warm_start=False, fuse_deriv=False):
         """
         Use `scipy.optimize.least_squares`_ to fit the model to the provided
         kinematics.
@@ -1333,8 +1743,9 @@ class AxisymmetricDisk:
             cnvfftw (:class:`~nirvana.models.beam.ConvolveFFTW`, optional):
                 An object that expedites the convolutions using FFTW/pyFFTW.  If
                 provided, the shape *must* match ``kin.spatial_shape``.  If
-                None, a new :class:`~nirvana.models.beam.ConvolveFFTW` instance
-                is constructed to perform the convolutions.  If the class cannot
+                None, the shared instance provided by
+                :func:`~nirvana.models.beam.get_convolver` is used to perform
+                the convolutions.  If the class cannot
                 be constructed because the user doesn't have pyfftw installed,
                 then the convolutions fall back to the numpy routines.
             analytic_jac (:obj:`bool`, optional):
@@ -1348,60 +1759,115 @@ class AxisymmetricDisk:
                 parameters.  This parameter sets the maximum number of times the
                 fit will be repeated.  Set this to 1 to ignore these occurences;
                 ``maxiter`` cannot be None.
+            threads (:obj:`int`, optional):
+                The number of threads used by the FFTW convolutions, if
+                ``cnvfftw`` is None.  Multiple threads are most useful for
+                large maps.
+            crop (:obj:`bool`, optional):
+                During the fit, limit the beam-smearing convolutions to the
+                smallest region that includes the data being fit; see
+                :func:`_init_crop`.  The cropping is removed when the fit
+                completes.
+            sparse_beam (:obj:`bool`, optional):
+                During the fit, perform the beam-smearing convolutions using a
+                sparse matrix in direct space, instead of FFTs.  If None, the
+                sparse matrix is used if it is expected to be faster; see
+                :func:`_init_crop`.
+            warm_start (:obj:`bool`, optional):
+                If the same parameters are free as in the previous fit, use
+                the column norms of the Jacobian matrix of the previous fit to
+                set the characteristic scale of each parameter (see
+                ``x_scale`` in `scipy.optimize.least_squares`_), instead of
+                re-deriving the scale from the Jacobian as the optimization
+                proceeds.  This is most useful when the fit is repeated,
+                starting from the previous result, after small changes to the
+                data being fit; see :func:`axisym_iter_fit`.  The criterion
+                used to decide if the fit should be repeated (see
+                ``maxiter``) is unchanged.
+            fuse_deriv (:obj:`bool`, optional):
+                When using the analytic Jacobian, compute the model
+                derivatives with every evaluation of the figure-of-merit,
+                such that the Jacobian never repeats the model evaluation;
+                see :func:`_binned_model`.  This is only faster if few of the
+                trial steps of the optimizer are rejected; otherwise, the
+                derivatives are only computed when the Jacobian is requested.
         """
         if maxiter is None:
             raise ValueError('Maximum number of iterations cannot be None.')
 
-        # Prepare to fit the data.
-        self._fit_prep(kin, p0, fix, scatter, sb_wgt, assume_posdef_covar, ignore_covar,
-                       cnvfftw)
-        
-        # Get the method used to generate the figure-of-merit and the Jacobian
-        # matrix.
-        fom = self._get_fom()
-        # If the analytic Jacobian matrix is not used, the derivative of the
-        # merit function wrt each parameter is determined by a 1% change in each
-        # parameter.
-        jac_kwargs = {'jac': self._get_jac()} if analytic_jac \
-                        else {'diff_step': np.full(self.np, 0.01, dtype=float)[self.free]}
-
-        # Parameter boundaries
-        _lb, _ub = self.par_bounds()
-        if lb is None:
-            lb = _lb
-        if ub is None:
-            ub = _ub
-        if len(lb) != self.np or len(ub) != self.np:
-            raise ValueError('Length of one or both of the bound vectors is incorrect.')
-
-        # Set the random number generator with a fixed seed so that the result
-        # is deterministic.
-        rng = np.random.default_rng(seed=909)
-        _p0 = self.par[self.free]
-        p = _p0.copy()
-        pe = None
-        niter = 0
-        while niter < maxiter:
-            # Run the optimization
-            result = optimize.least_squares(fom, p, # method='lm', #xtol=None,
-                                            x_scale='jac', method='trf', xtol=1e-12,
-                                            bounds=(lb[self.free], ub[self.free]), 
-                                            verbose=verbose, **jac_kwargs)
-            try:
-                pe = np.sqrt(np.diag(cov_err(result.jac)))
-            except:
-                warnings.warn('Unable to compute parameter errors from precision matrix.')
-                pe = None
-
-            # The fit should change the input parameters.
-            if np.all(np.absolute(p-result.x) > 1e-3):
-                break
-
-            # If it doesn't, something likely went wrong with the fit.  Perturb
-            # the input guesses a bit and retry.
-            p = _p0 + rng.normal(size=self.nfree)*(pe if pe is not None else 0.1*p0)
-            p = np.clip(p, lb[self.free], ub[self.free])
-            niter += 1
+        # The cropped convolution domain and fused derivatives set up by
+        # _fit_prep are only used during the fit.  They are always removed,
+        # even if the fit fails, so that subsequent calls to model() use
+        # the full map.
+        try:
+            # Prepare to fit the data.
+            self._fit_prep(kin, p0, fix, scatter, sb_wgt, assume_posdef_covar, ignore_covar,
+                           cnvfftw, threads=threads, crop=crop, sparse_beam=sparse_beam,
+                           fuse_deriv=analytic_jac and fuse_deriv)
+
+            # Get the method used to generate the figure-of-merit and the Jacobian
+            # matrix.
+            fom = self._get_fom()
+            # If the analytic Jacobian matrix is not used, the derivative of the
+            # merit function wrt each parameter is determined by a 1% change in each
+            # parameter.
+            jac_kwargs = {'jac': self._get_jac()} if analytic_jac \
+                            else {'diff_step': np.full(self.np, 0.01, dtype=float)[self.free]}
+
+            # Parameter boundaries
+            _lb, _ub = self.par_bounds()
+            if lb is None:
+                lb = _lb
+            if ub is None:
+                ub = _ub
+            if len(lb) != self.np or len(ub) != self.np:
+                raise ValueError('Length of one or both of the bound vectors is incorrect.')
+
+            # Parameter scaling
+            x_scale = 'jac'
+            if warm_start and self._fit_scale is not None \
+                    and np.array_equal(self._fit_scale[0], self.free):
+                x_scale = self._fit_scale[1]
+
+            # Set the random number generator with a fixed seed so that the result
+            # is deterministic.
+            rng = np.random.default_rng(seed=909)
+            _p0 = self.par[self.free]
+            p = _p0.copy()
+            pe = None
+            niter = 0
+            while niter < maxiter:
+                # Run the optimization
+                result = optimize.least_squares(fom, p, # method='lm', #xtol=None,
+                                                x_scale=x_scale, method='trf', xtol=1e-12,
+                                                bounds=(lb[self.free], ub[self.free]), 
+                                                verbose=verbose, **jac_kwargs)
+                try:
+                    pe = np.sqrt(np.diag(cov_err(result.jac)))
+                except:
+                    warnings.warn('Unable to compute parameter errors from precision matrix.')
+                    pe = None
+
+                # The fit should change the input parameters.
+                if np.all(np.absolute(p-result.x) > 1e-3):
+                    break
+
+                # If it doesn't, something likely went wrong with the fit.  Perturb
+                # the input guesses a bit and retry.
+                p = _p0 + rng.normal(size=self.nfree)*(pe if pe is not None else 0.1*p0)
+                p = np.clip(p, lb[self.free], ub[self.free])
+                niter += 1
+
+            # Keep the convolution domain for the next fit (see
+            # _restore_fit_domain)
+            self._fit_domain = None if self._crop_inp is None \
+                    else (self._crop_inp, (self.crop, self.crop_beam_fft, self.crop_cnvfftw,
+                                           self.beam_matrix, self.mom0))
+        finally:
+            # Revert to convolving the full map and computing the model
+            # without derivatives
+            self._init_crop(None)
+            self.fuse_deriv = False
 
         # TODO: Add something to the fit status/success flags that tests if
         # niter == maxiter and/or if the input parameters are identical to the
@@ -1412,6 +1878,11 @@ class AxisymmetricDisk:
         # Save the fit status
         self.fit_status = result.status
         self.fit_success = result.success
+        # Keep the parameter scaling, following the definition used by
+        # scipy.optimize.least_squares when x_scale='jac'
+        scale = np.sqrt(np.sum(result.jac**2, axis=0))
+        scale[scale == 0] = 1.
+        self._fit_scale = (self.free.copy(), 1/scale)
 
         # Save the best-fitting parameters
         self._set_par(result.x)
@@ -1428,6 +1899,10 @@ class AxisymmetricDisk:
         """
         Report the current parameters of the model to the screen.
 
+        If the timing instrumentation is enabled (see
+        :mod:`~nirvana.util.timing`), this also reports the wall time and
+        number of calls recorded for each step of the fit.
+
         Args:
             fit_message (:obj:`str`, optional):
                 The status message returned by the fit optimization.
@@ -1471,6 +1946,8 @@ class AxisymmetricDisk:
             print(f'Velocity chi-square: {vchisqr}')
             print(f'Reduced chi-square: {vchisqr/(len(vfom)-self.nfree)}')
             print('-'*70)
+            if timer.enabled:
+                timer.report()
             return
         print('-'*10)
         ps = self.nbp+self.rc.np
@@ -1492,6 +1969,8 @@ class AxisymmetricDisk:
         print(f'Dispersion chi-square: {schisqr}')
         print(f'Reduced chi-square: {(vchisqr + schisqr)/(len(vfom) + len(sfom) - self.nfree)}')
         print('-'*70)
+        if timer.enabled:
+            timer.report()
 
 # TODO:
 #   - This is MaNGA-specific and needs to be abstracted
@@ -1580,6 +2059,12 @@ def axisym_fit_data(galmeta, kin, p0, disk, ofile, vmask, smask):
     """
     Construct a fits file with the best-fit results.
 
+    If the timing instrumentation is enabled (see
+    :mod:`~nirvana.util.timing`), the recorded wall time and number of calls
+    for each step are written to the ``TIMING`` extension, and the total
+    time for :func:`axisym_iter_fit` is written to the ``FITTIME`` header
+    keyword.
+
     Args:
         galmeta (:class:`~nirvana.data.meta.GlobalPar`):
             Object with metadata for the galaxy to be fit.
@@ -1733,6 +2218,9 @@ def axisym_fit_data(galmeta, kin, p0, disk, ofile, vmask, smask):
     if disk.dc is not None:
         prihdr['DCMODEL'] = (disk.dc.__class__.__name__, 'Dispersion profile parameterization')
     prihdr['QUAL'] = (disk.global_mask, 'Global fit-quality bit')
+    #   - Add the total fit time, if recorded
+    if 'iter_fit' in timer.time:
+        prihdr['FITTIME'] = (timer.time['iter_fit'], 'Wall time for axisym_iter_fit (s)')
     #   - Data map header
     maphdr = fileio.add_wcs(prihdr, kin)
     #   - PSF header
@@ -1812,6 +2300,18 @@ def axisym_fit_data(galmeta, kin, p0, disk, ofile, vmask, smask):
                                              for n in metadata.dtype.names],
                                            name='FITMETA', header=tblhdr)]
 
+    # Add the timing data, if recorded
+    if len(timer.time) > 0:
+        steps, ncalls, t = timer.summary()
+        hdus += [fits.BinTableHDU.from_columns(
+                    [fits.Column(name='STEP', format=fileio.rec_to_fits_type(steps),
+                                 array=steps),
+                     fits.Column(name='NCALL', format=fileio.rec_to_fits_type(ncalls),
+                                 array=ncalls),
+                     fits.Column(name='TIME', format=fileio.rec_to_fits_type(t), array=t,
+                                 unit='s')],
+                    name='TIMING', header=prihdr.copy())]
+
     if ofile.split('.')[-1] == 'gz':
         _ofile = ofile[:ofile.rfind('.')]
         compress = True
@@ -2515,12 +3015,13 @@ def axisym_fit_plot(galmeta, kin, disk, par=None, par_err=None, fix=None, ofile=
     pyplot.rcdefaults()
 
 
+@timed('iter_fit')
 def axisym_iter_fit(galmeta, kin, rctype='HyperbolicTangent', dctype='Exponential', fitdisp=True,
                     ignore_covar=True, assume_posdef_covar=True, max_vel_err=None,
                     max_sig_err=None, min_vel_snr=None, min_sig_snr=None,
                     vel_sigma_rej=[15,10,10,10], sig_sigma_rej=[15,10,10,10], fix_cen=False,
                     fix_inc=False, low_inc=None, min_unmasked=None, select_coherent=False,
-                    analytic_jac=True, fit_scatter=True, verbose=0):
+                    analytic_jac=True, fit_scatter=True, verbose=0, threads=1):
     r"""
     Iteratively fit kinematic data with an axisymmetric disk model.
 
@@ -2585,6 +3086,12 @@ def axisym_iter_fit(galmeta, kin, rctype='HyperbolicTangent', dctype='Exponentia
            :func:`~nirvana.data.meta.GlobalPar.guess_inclination`.  The code
            issues a warning, and the global fit-quality bit is set to include
            the ``LOWINC`` bit.
+
+    The same :class:`AxisymmetricDisk` instance is used for all iterations,
+    such that the beam-smearing setup is reused between fits (see
+    :func:`AxisymmetricDisk._restore_fit_domain`), and fits that start from
+    the previous result with the same free parameters are warm-started (see
+    ``warm_start`` in :func:`AxisymmetricDisk.lsq_fit`).
         
     .. todo::
         - Enable more rotation curve and dispersion profile functions.
@@ -2671,6 +3178,8 @@ def axisym_iter_fit(galmeta, kin, rctype='HyperbolicTangent', dctype='Exponentia
         verbose (:obj:`int`, optional):
             Verbosity level: 0=only status output written to terminal; 1=show 
             fit result QA plot; 2=full output
+        threads (:obj:`int`, optional):
+            The number of threads used by the FFTW convolutions.
 
     Returns:
         :obj:`tuple`: Returns 5 objects: (1) the
@@ -2845,7 +3354,7 @@ def axisym_iter_fit(galmeta, kin, rctype='HyperbolicTangent', dctype='Exponentia
     # parameter?
     disk.lsq_fit(kin, sb_wgt=True, p0=p0, fix=fix, lb=lb, ub=ub, ignore_covar=True,
                  assume_posdef_covar=assume_posdef_covar, analytic_jac=analytic_jac,
-                 verbose=verbose)
+                 verbose=verbose, threads=threads)
     # Show
     if verbose > 0:
         axisym_fit_plot(galmeta, kin, disk, fix=fix) 
@@ -2872,7 +3381,7 @@ def axisym_iter_fit(galmeta, kin, rctype='HyperbolicTangent', dctype='Exponentia
     print('Running fit iteration 2')
     disk.lsq_fit(kin, sb_wgt=True, p0=p0, fix=fix, lb=lb, ub=ub, ignore_covar=True,
                  assume_posdef_covar=assume_posdef_covar, analytic_jac=analytic_jac,
-                 verbose=verbose)
+                 verbose=verbose, threads=threads)
     # Show
     if verbose > 0:
         axisym_fit_plot(galmeta, kin, disk, fix=fix)
@@ -2898,7 +3407,8 @@ def axisym_iter_fit(galmeta, kin, rctype='HyperbolicTangent', dctype='Exponentia
     scatter = np.array([vel_sig, sig_sig]) if fit_scatter else None
     disk.lsq_fit(kin, sb_wgt=True, p0=disk.par, fix=fix, lb=lb, ub=ub, ignore_covar=True,
                  assume_posdef_covar=assume_posdef_covar, scatter=scatter,
-                 analytic_jac=analytic_jac, verbose=verbose)
+                 analytic_jac=analytic_jac, verbose=verbose, threads=threads,
+                 warm_start=True)
     # Show
     if verbose > 0:
         axisym_fit_plot(galmeta, kin, disk, fix=fix)
@@ -2926,7 +3436,8 @@ def axisym_iter_fit(galmeta, kin, rctype='HyperbolicTangent', dctype='Exponentia
     scatter = np.array([vel_sig, sig_sig]) if fit_scatter else None
     disk.lsq_fit(kin, sb_wgt=True, p0=disk.par, fix=fix, lb=lb, ub=ub, ignore_covar=True,
                  assume_posdef_covar=assume_posdef_covar, scatter=scatter,
-                 analytic_jac=analytic_jac, verbose=verbose)
+                 analytic_jac=analytic_jac, verbose=verbose, threads=threads,
+                 warm_start=True)
     # Show
     if verbose > 0:
         axisym_fit_plot(galmeta, kin, disk, fix=fix)
@@ -2961,7 +3472,7 @@ def axisym_iter_fit(galmeta, kin, rctype='HyperbolicTangent', dctype='Exponentia
     scatter = np.array([vel_sig, sig_sig]) if fit_scatter else None
     disk.lsq_fit(kin, sb_wgt=True, p0=disk.par, fix=fix, lb=lb, ub=ub, ignore_covar=ignore_covar,
                  assume_posdef_covar=assume_posdef_covar, scatter=scatter,
-                 analytic_jac=analytic_jac, verbose=verbose)
+                 analytic_jac=analytic_jac, verbose=verbose, threads=threads)
     # Show
     if verbose > 0:
         axisym_fit_plot(galmeta, kin, disk, fix=fix)
@@ -2989,7 +3500,8 @@ def axisym_iter_fit(galmeta, kin, rctype='HyperbolicTangent', dctype='Exponentia
     scatter = np.array([vel_sig, sig_sig]) if fit_scatter else None
     disk.lsq_fit(kin, sb_wgt=True, p0=disk.par, fix=fix, lb=lb, ub=ub, ignore_covar=ignore_covar,
                  assume_posdef_covar=assume_posdef_covar, scatter=scatter, 
-                 analytic_jac=analytic_jac, verbose=verbose)
+                 analytic_jac=analytic_jac, verbose=verbose, threads=threads,
+                 warm_start=True)
     # Show
     if verbose > 0:
         axisym_fit_plot(galmeta, kin, disk, fix=fix)
@@ -3015,7 +3527,7 @@ def axisym_iter_fit(galmeta, kin, rctype='HyperbolicTangent', dctype='Exponentia
     print('Running fit iteration 7')
     disk.lsq_fit(kin, sb_wgt=True, p0=disk.par, fix=fix, lb=lb, ub=ub, ignore_covar=ignore_covar,
                  assume_posdef_covar=assume_posdef_covar, scatter=scatter,
-                 analytic_jac=analytic_jac, verbose=verbose)
+                 analytic_jac=analytic_jac, verbose=verbose, threads=threads)
     # Show
     if verbose > 0:
         axisym_fit_plot(galmeta, kin, disk, fix=fix)
@@ -3,9 +3,16 @@
 .. include:: ../include/links.rst
 """
 
+import os
+import tempfile
+import threading
+
 from IPython import embed
 
 import numpy as np
+from scipy import sparse
+
+from ..util.timing import timed
 
 try:
     import pyfftw
@@ -13,6 +20,169 @@ except:
     pyfftw = None
 
 
+#: Names of the wisdom files (see :func:`fftw_wisdom_key`) already available
+#: to (loaded into or saved from) the FFTW planner in this process.
+_fftw_wisdom_keys = set()
+
+#: Directory used to cache FFTW wisdom on disk, if set by
+#: :func:`set_fftw_wisdom_path`.
+_fftw_wisdom_dir = None
+
+
+def fftw_wisdom_path():
+    """
+    Return the directory used to cache FFTW wisdom on disk.
+
+    The cache is only used if requested.  The directory is either set
+    explicitly using :func:`set_fftw_wisdom_path` or by the
+    ``NIRVANA_FFTW_WISDOM`` environmental variable, in that order of
+    precedence.  If neither is set (or the variable is an empty string), the
+    cache is disabled.
+
+    Returns:
+        :obj:`str`: The path to the wisdom directory, or None if the cache is
+        disabled.
+    """
+    if _fftw_wisdom_dir is not None:
+        return _fftw_wisdom_dir
+    path = os.getenv('NIRVANA_FFTW_WISDOM')
+    return None if path is None or len(path) == 0 else path
+
+
+def set_fftw_wisdom_path(path):
+    """
+    Set the directory used to cache FFTW wisdom on disk and import any
+    wisdom already cached there.
+
+    Args:
+        path (:obj:`str`):
+            Directory for the cached wisdom files.  If None, revert to the
+            directory set by the ``NIRVANA_FFTW_WISDOM`` environmental
+            variable, if any (see :func:`fftw_wisdom_path`).
+
+    Returns:
+        :obj:`list`: The names of the wisdom files that were imported.
+    """
+    global _fftw_wisdom_dir
+    _fftw_wisdom_dir = path
+    return load_fftw_wisdom()
+
+
+def fftw_wisdom_key(shape, dtype, flags, threads=1):
+    """
+    Construct the name of the wisdom file for a set of FFTW plans.
+
+    Args:
+        shape (:obj:`tuple`):
+            Shape of the transformed arrays.
+        dtype (:obj:`str`):
+            Data type of the direct-space arrays.
+        flags (:obj:`tuple`):
+            The flags used to construct the FFTW plans.
+        threads (:obj:`int`, optional):
+            The number of threads used by the FFTW plans.
+
+    Returns:
+        :obj:`str`: The file name, e.g., ``74x74_float64_FFTW_MEASURE.wisdom``.
+        If more than one thread is used, the number of threads is appended to
+        the root of the file name (e.g.,
+        ``74x74_float64_FFTW_MEASURE_t4.wisdom``).
+    """
+    root = '{0}_{1}_{2}'.format('x'.join([str(n) for n in shape]), np.dtype(dtype).name,
+                                '-'.join(flags))
+    return f'{root}.wisdom' if threads == 1 else f'{root}_t{threads}.wisdom'
+
+
+def load_fftw_wisdom(path=None):
+    """
+    Import all the FFTW wisdom cached on disk.
+
+    If the ``NIRVANA_FFTW_WISDOM`` environmental variable is set, this is
+    done when this module is imported, meaning that FFTW plans constructed
+    for array shapes used in previous sessions (see :class:`ConvolveFFTW`)
+    are recovered immediately instead of requiring the FFTW planner to
+    repeat its (potentially expensive) performance measurements.  Files that
+    cannot be read or imported are ignored.
+
+    Args:
+        path (:obj:`str`, optional):
+            Directory with the cached wisdom files.  If None, use
+            :func:`fftw_wisdom_path`.
+
+    Returns:
+        :obj:`list`: The names of the wisdom files that were imported.  The
+        list is empty if the cache is disabled.
+    """
+    _path = fftw_wisdom_path() if path is None else path
+    if pyfftw is None or _path is None or not os.path.isdir(_path):
+        return []
+    loaded = []
+    for f in sorted(os.listdir(_path)):
+        if not f.endswith('.wisdom'):
+            continue
+        try:
+            with open(os.path.join(_path, f), 'rb') as wfile:
+                wisdom = wfile.read()
+            # Only the double-precision wisdom is cached
+            success = pyfftw.import_wisdom((wisdom, b'', b''))[0]
+        except Exception:
+            continue
+        if success:
+            loaded += [f]
+    _fftw_wisdom_keys.update(loaded)
+    return loaded
+
+
+def save_fftw_wisdom(shape, dtype, flags, threads=1, path=None):
+    """
+    Cache the current FFTW wisdom on disk.
+
+    Nothing is done if wisdom for the provided set of plans has already been
+    loaded or saved.  The file is written atomically (by writing to a
+    temporary file and then replacing the target file), so concurrent
+    processes never read a partially written file.  Any failure to write the
+    file is silently ignored.
+
+    Args:
+        shape (:obj:`tuple`):
+            Shape of the transformed arrays.
+        dtype (:obj:`str`):
+            Data type of the direct-space arrays.
+        flags (:obj:`tuple`):
+            The flags used to construct the FFTW plans.
+        threads (:obj:`int`, optional):
+            The number of threads used by the FFTW plans.
+        path (:obj:`str`, optional):
+            Directory for the cached wisdom files.  If None, use
+            :func:`fftw_wisdom_path`.
+
+    Returns:
+        :obj:`str`: The full path to the written file, or None if no file was
+        written (including if the cache is disabled).
+    """
+    _path = fftw_wisdom_path() if path is None else path
+    key = fftw_wisdom_key(shape, dtype, flags, threads=threads)
+    if pyfftw is None or _path is None or key in _fftw_wisdom_keys:
+        return None
+    ofile = os.path.join(_path, key)
+    tmp = None
+    try:
+        os.makedirs(_path, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=_path, prefix='.tmp_', delete=False) as wfile:
+            tmp = wfile.name
+            wfile.write(pyfftw.export_wisdom()[0])
+        os.replace(tmp, ofile)
+    except OSError:
+        if tmp is not None and os.path.isfile(tmp):
+            os.remove(tmp)
+        return None
+    _fftw_wisdom_keys.add(key)
+    return ofile
+
+
+load_fftw_wisdom()
+
+
 def gauss2d_kernel(n, sigma):
     """
     Return a circular 2D Gaussian.
@@ -36,7 +206,156 @@ def gauss2d_kernel(n, sigma):
     return g / np.sum(g)
 
 
-def convolve_fft(data, kernel, kernel_fft=False, return_fft=False):
+def half_spectrum_shape(shape):
+    """
+    Return the shape of the half-spectrum FFT of a real array.
+
+    For real input data, the FFT is Hermitian-symmetric, meaning that only
+    the non-negative frequency components along the last axis are required to
+    recover the full spectrum; see `numpy.fft.rfftn`_.
+
+    Args:
+        shape (:obj:`tuple`):
+            Shape of the (real) array that is transformed.
+
+    Returns:
+        :obj:`tuple`: The shape of the half-spectrum FFT.
+    """
+    return tuple(shape[:-1]) + (shape[-1]//2 + 1,)
+
+
+def kernel_fft_form(kernel_fft, shape, real):
+    """
+    Return the FFT of a (real) convolution kernel in the requested form.
+
+    Args:
+        kernel_fft (`numpy.ndarray`_):
+            The FFT of the kernel, provided either as the full spectrum (with
+            shape ``shape``) or the half spectrum (see
+            :func:`half_spectrum_shape`).
+        shape (:obj:`tuple`):
+            The shape of the direct kernel image.
+        real (:obj:`bool`):
+            If True, return the half spectrum; otherwise, return the full
+            spectrum.
+
+    Returns:
+        `numpy.ndarray`_: The FFT of the kernel in the requested form.  If the
+        provided FFT is already in the requested form, the returned array is
+        the input object (not a copy).
+
+    Raises:
+        ValueError:
+            Raised if the shape of ``kernel_fft`` is not consistent with
+            ``shape``.
+    """
+    _shape = tuple(shape)
+    half_shape = half_spectrum_shape(_shape)
+    if kernel_fft.shape == (half_shape if real else _shape):
+        return kernel_fft
+    if real and kernel_fft.shape == _shape:
+        # Select the non-negative frequencies
+        return kernel_fft[...,:half_shape[-1]].copy()
+    if not real and kernel_fft.shape == half_shape:
+        # Reconstruct the full spectrum
+        return np.fft.fftn(np.fft.irfftn(kernel_fft, s=_shape))
+    raise ValueError('Kernel FFT has incorrect shape.')
+
+
+def smooth_fft_size(n, primes=(2,3,5,7)):
+    """
+    Return the smallest integer that is at least ``n`` and has no prime
+    factors other than those provided.
+
+    FFT algorithms (and FFTW in particular) are fastest for array sizes that
+    can be factored into small prime numbers.
+
+    Args:
+        n (:obj:`int`):
+            The minimum size.
+        primes (:obj:`tuple`, optional):
+            The allowed prime factors.
+
+    Returns:
+        :obj:`int`: The FFT-friendly size.
+    """
+    m = max(int(n), 1)
+    while True:
+        _m = m
+        for p in primes:
+            while _m % p == 0:
+                _m //= p
+        if _m == 1:
+            return m
+        m += 1
+
+
+def fft_pad_shape(shape, support=None, primes=(2,3,5,7)):
+    """
+    Return the padded shape used for FFT-based convolutions.
+
+    The images to convolve, with shape :math:`n` along each axis, are placed at
+    the start of the padded array, and the convolution kernel, cropped to
+    :math:`s` pixels from its center along each axis (see
+    :func:`beam_support`), is placed at the center of the padded array (see
+    :func:`pad_kernel`).  For the circular convolution of the padded arrays to
+    be identical to the linear convolution within the image region, none of
+    the kernel can wrap around onto the image; i.e., the padded size must be
+    at least :math:`n + s`.  Each axis is then increased to the nearest
+    FFT-friendly size.
+
+    Args:
+        shape (:obj:`tuple`):
+            Shape of the image to convolve.
+        support (array-like, optional):
+            The extent of the kernel from its center along each axis; see
+            :func:`beam_support`.  If None, the kernel is assumed to fill the
+            image; i.e., :math:`s = n//2`.
+        primes (:obj:`tuple`, optional):
+            The allowed prime factors; see :func:`smooth_fft_size`.
+
+    Returns:
+        :obj:`tuple`: The padded shape.
+    """
+    _support = [n//2 for n in shape] if support is None else support
+    return tuple([smooth_fft_size(n + min(int(s), n//2), primes=primes)
+                    for n, s in zip(shape, _support)])
+
+
+def pad_kernel(kernel, shape, support=None):
+    """
+    Embed a convolution kernel in a larger, zero-padded array.
+
+    The center of the kernel (pixel ``n//2`` along each axis) is placed at
+    the center of the padded array (pixel ``m//2`` along each axis).
+
+    Args:
+        kernel (`numpy.ndarray`_):
+            Direct image of the kernel.
+        shape (:obj:`tuple`):
+            Shape of the padded array.  Must be at least as large as the
+            (cropped) kernel along all axes.
+        support (array-like, optional):
+            The extent of the kernel from its center along each axis; see
+            :func:`beam_support`.  If provided, the kernel is cropped to this
+            extent (see :func:`crop_kernel`) before it is padded.
+
+    Returns:
+        `numpy.ndarray`_: The padded kernel image.
+    """
+    if support is not None:
+        kernel = crop_kernel(kernel, [min(2*int(s)+1, n) for n, s in zip(kernel.shape, support)])
+    if any([m < n for n, m in zip(kernel.shape, shape)]):
+        raise ValueError('Padded shape must be at least as large as the kernel.')
+    padded = np.zeros(shape, dtype=kernel.dtype)
+    padded[tuple([slice(m//2 - n//2, m//2 - n//2 + n) for n, m in zip(kernel.shape, shape)])] \
+            = kernel
+    return padded
+
+
+@timed('convolve')
+def convolve_fft(data, kernel, kernel_fft=False, return_fft=False, real=None, pad=False,
+                 support=None):
     """
     Convolve data with a kernel.
 
@@ -46,26 +365,52 @@ def convolve_fft(data, kernel, kernel_fft=False, return_fft=False):
     its use.
 
     Beware:
-        - ``data`` and ``kernel`` must have the same shape.
+        - ``data`` and ``kernel`` must have the same shape, unless ``data``
+          is a stack of images (see below).
         - For the sum of all pixels in the convolved image to be the
           same as the input data, the kernel must sum to unity.
-        - Padding is never added by default.
+        - Padding is never added by default (see ``pad``).
 
     Args:
         data (`numpy.ndarray`_):
-            Data to convolve.
+            Data to convolve.  This can also be a stack of images to convolve
+            with the same kernel, in which case ``data`` must have one more
+            dimension than ``kernel`` and the images are organized along the
+            last axis; i.e., the shape must be ``kernel.shape + (nimg,)``.
         kernel (`numpy.ndarray`_):
             The convolution kernel, which must have the same shape as
-            ``data``. If ``kernel_fft`` is True, this is the FFT of
-            the kernel image; otherwise, this is the direct kernel
-            image with the center of the kernel at the center of the
-            array.
+            ``data`` (or the shape of each image in the stack). If
+            ``kernel_fft`` is True, this is the FFT of the kernel image,
+            provided as either the full or half spectrum (see
+            :func:`kernel_fft_form`); otherwise, this is the direct kernel
+            image with the center of the kernel at the center of the array.
         kernel_fft (:obj:`bool`, optional):
             Flag that the provided ``kernel`` array is actually the
             FFT of the kernel, not its direct image.
         return_fft (:obj:`bool`, optional):
             Flag to return the FFT of the convolved image, instead of
             the direct image.
+        real (:obj:`bool`, optional):
+            Use the real-to-complex FFTs (`numpy.fft.rfftn`_ and
+            `numpy.fft.irfftn`_), which take advantage of the Hermitian
+            symmetry of the FFT of real data to roughly halve the computation.
+            If None, the real-to-complex FFTs are used only if the kernel is
+            provided as its half-spectrum FFT.  If ``return_fft`` is True,
+            the returned FFT is the half spectrum when this is True.
+        pad (:obj:`bool`, optional):
+            Zero-pad the images (see :func:`fft_pad_shape`) before computing
+            the convolution, such that the result is the linear convolution of
+            the image with the kernel; i.e., the kernel does not wrap around
+            the image edges.  The kernel is cropped to its support (see
+            ``support``), such that the padding is only as large as needed.
+            The result is cropped back to the shape of the input image, and,
+            if ``return_fft`` is True, the returned FFT is that of the cropped
+            image.
+        support (array-like, optional):
+            The extent of the kernel from its center along each axis used
+            when ``pad`` is True.  If None, this is determined by
+            :func:`beam_support`, meaning that the convolution is linear to
+            within the truncation of the kernel.  Ignored if ``pad`` is False.
 
     Returns:
         `numpy.ndarray`_: The convolved image, or its FFT, with the
@@ -76,18 +421,84 @@ def convolve_fft(data, kernel, kernel_fft=False, return_fft=False):
             Raised if ``data`` and ``kernel`` do not have the same
             shape or if any of their values are not finite.
     """
-    if data.shape != kernel.shape:
+    stack = data.ndim == kernel.ndim + 1
+    shape = data.shape[:-1] if stack else data.shape
+    if real is None:
+        real = kernel_fft and kernel.shape != shape \
+                    and kernel.shape == half_spectrum_shape(shape)
+    if data.ndim > kernel.ndim + 1 \
+            or (not kernel_fft and kernel.shape != shape) \
+            or (kernel_fft and kernel.shape not in [shape, half_spectrum_shape(shape)]):
         raise ValueError('Data and kernel must have the same shape.')
     if not np.all(np.isfinite(data)) or not np.all(np.isfinite(kernel)):
         print('**********************************')
         print(f'nans in data: {(~np.isfinite(data)).sum()}, nans in kernel: {(~np.isfinite(kernel)).sum()}')
         raise ValueError('Data and kernel must both have valid values.')
 
-    datafft = np.fft.fftn(data)
-    kernfft = kernel if kernel_fft else np.fft.fftn(np.fft.ifftshift(kernel))
-    fftmult = datafft * kernfft
+    # Only transform over the image axes
+    axes = tuple(range(len(shape)))
+
+    if pad:
+        # Embed the data in the padded array and the kernel, cropped to its
+        # support, in the center of the padded array
+        _kernel = np.fft.fftshift(np.fft.irfftn(kernel_fft_form(kernel, shape, True), s=shape)) \
+                    if kernel_fft else kernel
+        _support = beam_support(_kernel) if support is None else support
+        pad_shape = fft_pad_shape(shape, support=_support)
+        inner = tuple([slice(0,n) for n in shape])
+        _data = np.zeros(pad_shape + data.shape[len(shape):], dtype=float)
+        _data[inner] = data
+        cnv = _convolve_fft(_data, pad_kernel(_kernel, pad_shape, support=_support), pad_shape,
+                            stack, False, False, real)[inner]
+        if not return_fft:
+            return cnv
+        return np.fft.rfftn(cnv, axes=axes) if real else np.fft.fftn(cnv, axes=axes)
+    return _convolve_fft(data, kernel, shape, stack, kernel_fft, return_fft, real)
+
+
+def _convolve_fft(data, kernel, shape, stack, kernel_fft, return_fft, real):
+    """
+    Compute the (circular) convolution for :func:`convolve_fft`.
 
-    return fftmult if return_fft else np.fft.ifftn(fftmult).real
+    The input is expected to have already been checked and padded, if
+    requested.  This is kept separate from :func:`convolve_fft` so that the
+    padded convolutions are only timed once (see
+    :func:`~nirvana.util.timing.timed`).
+
+    Args:
+        data (`numpy.ndarray`_):
+            Data (or stack of images) to convolve.
+        kernel (`numpy.ndarray`_):
+            The convolution kernel or its FFT.
+        shape (:obj:`tuple`):
+            The shape of each image.
+        stack (:obj:`bool`):
+            Flag that ``data`` is a stack of images.
+        kernel_fft (:obj:`bool`):
+            Flag that ``kernel`` is the FFT of the kernel.
+        return_fft (:obj:`bool`):
+            Flag to return the FFT of the convolved image.
+        real (:obj:`bool`):
+            Use the real-to-complex FFTs.
+
+    Returns:
+        `numpy.ndarray`_: The convolved image, or its FFT.
+    """
+    axes = tuple(range(len(shape)))
+    if real:
+        datafft = np.fft.rfftn(data, axes=axes)
+        kernfft = kernel_fft_form(kernel, shape, True) if kernel_fft \
+                    else np.fft.rfftn(np.fft.ifftshift(kernel))
+    else:
+        datafft = np.fft.fftn(data, axes=axes)
+        kernfft = kernel_fft_form(kernel, shape, False) if kernel_fft \
+                    else np.fft.fftn(np.fft.ifftshift(kernel))
+    fftmult = datafft * (kernfft[...,None] if stack else kernfft)
+
+    if return_fft:
+        return fftmult
+    return np.fft.irfftn(fftmult, s=shape, axes=axes) if real \
+                else np.fft.ifftn(fftmult, axes=axes).real
 
 
 class ConvolveFFTW:
@@ -107,6 +518,32 @@ class ConvolveFFTW:
     convolved and the convolution kernel are made up of 64-bit floats.  The
     methods check the data type and raise an exception if this is not true.
 
+    Because all the images that we convolve are real, the FFTs can instead be
+    computed using the real-to-complex (and complex-to-real) FFTW algorithms
+    (see ``real``).  These only compute and store the half spectrum of each
+    FFT (see :func:`half_spectrum_shape`), which roughly halves both the
+    computation time and the size of the memory workspace.  When ``real`` is
+    True, all FFTs returned by the object (e.g., by :func:`fft`) are the half
+    spectra; however, kernel FFTs can be provided in either form (see
+    :func:`kernel_fft_form`).
+
+    By default, the convolutions are circular; i.e., the kernel wraps around
+    the edges of the image.  If ``pad`` is True, the workspace arrays are
+    padded such that the convolutions are linear instead (see
+    :func:`fft_pad_shape`): the images to convolve are zero-padded and the
+    convolution kernel, cropped to ``support``, is placed at the center of
+    the padded array (see :func:`pad_kernel`).  This is transparent to the
+    user, in the sense that input images and direct kernel images must still
+    have shape :attr:`shape` and the convolved images are cropped back to
+    this shape.  However, all FFTs are computed for the padded shape
+    (:attr:`grid_shape`).  Kernel FFTs can be provided for either the padded
+    or unpadded shape, but unpadded kernel FFTs must be converted for every
+    convolution; use :func:`fft_kernel` to compute the padded kernel FFT
+    once.  The padded size is FFT-friendly, which makes the padded
+    convolutions faster than the unpadded ones for image sizes with large
+    prime factors (e.g., the 74-pixel MaNGA grid, :math:`74 = 2\times37`),
+    but slower for sizes that are already FFT-friendly (e.g., 54 or 64).
+
     Args:
         shape (:obj:`tuple`):
             Shape of the arrays to be convolved. Any arrays passed to
@@ -115,25 +552,54 @@ class ConvolveFFTW:
             Flags passed to pyFFTW when setting up the FFTW
             instances, describing how the FFTW performance
             optimization is determined. The default is FFTW_MEASURE.
+            If requested (see :func:`fftw_wisdom_path`), the wisdom
+            accumulated by the FFTW planner is cached on disk (see
+            :func:`save_fftw_wisdom`) so that the planning is fast for any
+            subsequent instance with the same shape.
+        real (:obj:`bool`, optional):
+            Use the real-to-complex FFTW algorithms.
+        threads (:obj:`int`, optional):
+            The number of threads used to compute each FFT.  Using multiple
+            threads is most useful for large images and stacks of images
+            (see :func:`stack_workspace`); for small images, the overhead of
+            the threading can make the FFTs slower.
+        pad (:obj:`bool`, optional):
+            Zero-pad the arrays such that the convolutions are linear instead
+            of circular; see :func:`fft_pad_shape`.
+        support (array-like, optional):
+            The extent of the convolution kernels from their center along
+            each axis (see :func:`beam_support`), used to set the padded
+            shape when ``pad`` is True.  Direct kernel images are cropped to
+            this extent.  If None, the kernels are assumed to fill the image.
+            Ignored if ``pad`` is False.
     """
-    def __init__(self, shape, flags=None):
+    def __init__(self, shape, flags=None, real=False, threads=1, pad=False, support=None):
         if pyfftw is None:
             raise ImportError('pyfftw package must be available to use ConvolveFFTW.  Ensure '
                               'that both the FFTW library and the PyFFTW interface are installed.')
         # Dimensionality
-        self.shape = shape
+        self.shape = tuple(shape)
         self.ndim = len(self.shape)
+        self.real = real
+        if not isinstance(threads, (int, np.integer)) or threads < 1:
+            raise ValueError('Number of threads must be a positive integer.')
+        self.threads = int(threads)
+        # Shape of the (padded) workspace and the region with the images
+        self.pad = pad
+        self.support = None if support is None or not self.pad \
+                            else tuple([min(int(s), n//2) for n, s in zip(self.shape, support)])
+        self.grid_shape = fft_pad_shape(self.shape, support=self.support) if self.pad \
+                            else self.shape
+        self.inner = tuple([slice(0,n) for n in self.shape])
+        # Shape of the FFTs
+        self.fft_shape = half_spectrum_shape(self.grid_shape) if self.real else self.grid_shape
         # Array workspace
-        self.data = pyfftw.empty_aligned(shape, dtype='complex128')
-        self.data.imag[...] = 0.
-        self.kern = pyfftw.empty_aligned(shape, dtype='complex128')
-        self.kern.imag[...] = 0.
-
-        self.data_fft = pyfftw.empty_aligned(shape, dtype='complex128')
-        self.kern_fft = pyfftw.empty_aligned(shape, dtype='complex128')
-
-        self.dcnv = pyfftw.empty_aligned(shape, dtype='complex128')
-        self.dcnv.imag[...] = 0.
+        dtype = 'float64' if self.real else 'complex128'
+        self.data = pyfftw.empty_aligned(self.grid_shape, dtype=dtype)
+        self.kern = pyfftw.empty_aligned(self.grid_shape, dtype=dtype)
+        self.data_fft = pyfftw.empty_aligned(self.fft_shape, dtype='complex128')
+        self.kern_fft = pyfftw.empty_aligned(self.fft_shape, dtype='complex128')
+        self.dcnv = pyfftw.empty_aligned(self.grid_shape, dtype=dtype)
 
         # FFTW algorithms
         self.flags = ('FFTW_MEASURE',) if flags is None else flags
@@ -141,14 +607,127 @@ class ConvolveFFTW:
             raise TypeError('Provided flags must be strings in a tuple instance.')
         self.dfft = pyfftw.FFTW(self.data, self.data_fft,
                                 axes=tuple(np.arange(self.ndim).tolist()),
-                                direction='FFTW_FORWARD', flags=self.flags)
+                                direction='FFTW_FORWARD', flags=self.flags,
+                                threads=self.threads)
         self.kfft = pyfftw.FFTW(self.kern, self.kern_fft,
                                 axes=tuple(np.arange(self.ndim).tolist()),
-                                direction='FFTW_FORWARD', flags=self.flags)
+                                direction='FFTW_FORWARD', flags=self.flags,
+                                threads=self.threads)
         self.ifft = pyfftw.FFTW(self.data_fft, self.dcnv,
                                 axes=tuple(np.arange(self.ndim).tolist()),
-                                direction='FFTW_BACKWARD', flags=self.flags)
+                                direction='FFTW_BACKWARD', flags=self.flags,
+                                threads=self.threads)
+        # NOTE: Planning with FFTW_MEASURE can overwrite the arrays, so the
+        # input arrays are zeroed after the plans are constructed.  This sets
+        # the imaginary components (when not using the real-to-complex
+        # algorithms) and the padding (if any) to 0; only the real component
+        # within the image region is changed by subsequent computations.
+        self.data[...] = 0.
+        self.kern[...] = 0.
+        save_fftw_wisdom(self.grid_shape, dtype, self.flags, threads=self.threads)
+
+        # Workspace and FFTW algorithms used to convolve stacks of images; see
+        # :func:`stack_workspace`.  These are only constructed when needed.
+        self.stack = {}
+
+    def stack_workspace(self, nimg):
+        """
+        Return the workspace used to convolve a stack of images.
 
+        The workspace is constructed the first time a stack with ``nimg``
+        images is requested and then kept for any subsequent convolution of a
+        stack with the same number of images.  The FFTs are only performed
+        along the image axes, such that all the images in the stack are
+        transformed by a single call to the FFTW algorithm.
+
+        Args:
+            nimg (:obj:`int`):
+                The number of images in the stack; i.e., the length of the last
+                axis of the stacked array.
+
+        Returns:
+            :obj:`dict`: Dictionary with the aligned arrays (``data``,
+            ``data_fft``, ``dcnv``) and the forward and backward FFTW
+            algorithms (``dfft``, ``ifft``) for the stack.
+        """
+        if nimg in self.stack:
+            return self.stack[nimg]
+
+        shape = self.grid_shape + (nimg,)
+        axes = tuple(np.arange(self.ndim).tolist())
+        dtype = 'float64' if self.real else 'complex128'
+        ws = {}
+        ws['data'] = pyfftw.empty_aligned(shape, dtype=dtype)
+        ws['data_fft'] = pyfftw.empty_aligned(self.fft_shape + (nimg,), dtype='complex128')
+        ws['dcnv'] = pyfftw.empty_aligned(shape, dtype=dtype)
+        ws['dfft'] = pyfftw.FFTW(ws['data'], ws['data_fft'], axes=axes,
+                                 direction='FFTW_FORWARD', flags=self.flags,
+                                 threads=self.threads)
+        ws['ifft'] = pyfftw.FFTW(ws['data_fft'], ws['dcnv'], axes=axes,
+                                 direction='FFTW_BACKWARD', flags=self.flags,
+                                 threads=self.threads)
+        # See __init__
+        ws['data'][...] = 0.
+        save_fftw_wisdom(shape, dtype, self.flags, threads=self.threads)
+        self.stack[nimg] = ws
+        return ws
+
+    def _set_kernel_fft(self, kernel, kernel_fft):
+        """
+        Set :attr:`kern_fft` using the provided kernel.
+
+        Args:
+            kernel (`numpy.ndarray`_):
+                The convolution kernel or its FFT.  See :func:`__call__`.
+            kernel_fft (:obj:`bool`):
+                Flag that the provided ``kernel`` array is actually the FFT of
+                the kernel, not its direct image.
+        """
+        if kernel_fft:
+            if kernel.dtype.type is not np.complex128:
+                raise TypeError('Kernel FFT must be of type numpy.complex128.')
+            if kernel.shape in [self.grid_shape, half_spectrum_shape(self.grid_shape)]:
+                self.kern_fft[...] = kernel_fft_form(kernel, self.grid_shape, self.real)
+                return
+            if not self.pad \
+                    or kernel.shape not in [self.shape, half_spectrum_shape(self.shape)]:
+                raise ValueError('Kernel has incorrect shape for this instance of ConvolveFFTW.')
+            # Convert the unpadded FFT to the direct kernel image
+            kernel = np.fft.fftshift(np.fft.irfftn(kernel_fft_form(kernel, self.shape, True),
+                                                   s=self.shape))
+        if kernel.shape != self.shape:
+            raise ValueError('Kernel has incorrect shape for this instance of ConvolveFFTW.')
+        if kernel.dtype.type is not np.float64:
+            raise TypeError('Kernel must be of type numpy.float64.')
+        self.kern.real[...] = np.fft.ifftshift(pad_kernel(kernel, self.grid_shape,
+                                                          support=self.support)
+                                               if self.pad else kernel)
+        self.kfft()
+
+    def fft_kernel(self, kernel, kernel_fft=False):
+        """
+        Compute the FFT of a convolution kernel in the form used by this
+        instance.
+
+        This is most useful when :attr:`pad` is True; passing the result of
+        this function to :func:`__call__` avoids recomputing the FFT of the
+        padded kernel for every convolution.
+
+        Args:
+            kernel (`numpy.ndarray`_):
+                The convolution kernel or its FFT.  See :func:`__call__`.
+            kernel_fft (:obj:`bool`, optional):
+                Flag that the provided ``kernel`` array is actually the FFT of
+                the kernel, not its direct image.
+
+        Returns:
+            `numpy.ndarray`_: The FFT of the (padded) kernel, with shape
+            :attr:`fft_shape`.
+        """
+        self._set_kernel_fft(kernel, kernel_fft)
+        return self.kern_fft.copy()
+
+    @timed('convolve')
     def __call__(self, data, kernel, kernel_fft=False, return_fft=False):
         """
         Convolve data with a kernel using FFTW.
@@ -158,7 +737,8 @@ class ConvolveFFTW:
         instantiation of the object.
 
         Beware:
-            - ``data`` and ``kernel`` must have the same shape.
+            - ``data`` and ``kernel`` must have the same shape, unless
+              ``data`` is a stack of images (see below).
             - For the sum of all pixels in the convolved image to be the
               same as the input data, the kernel must sum to unity.
             - Padding is never added by default.
@@ -166,11 +746,17 @@ class ConvolveFFTW:
         Args:
             data (`numpy.ndarray`_):
                 Data to convolve.  Data type must be `numpy.float64` and shape
-                must match :attr:`shape`.
+                must match :attr:`shape`.  This can also be a stack of images
+                to convolve with the same kernel, in which case the shape must
+                be ``shape + (nimg,)``; all images in the stack are convolved
+                using a single multi-dimensional FFT (see
+                :func:`stack_workspace`).
             kernel (`numpy.ndarray`_):
                 The convolution kernel, which must have the same shape as
                 ``data``. If ``kernel_fft`` is True, this is the FFT of the
-                kernel image and must have type `numpy.complex128`_; otherwise,
+                kernel image (either the full or half spectrum; see
+                :func:`kernel_fft_form`) and must have type
+                `numpy.complex128`_; otherwise,
                 this is the direct kernel image with the center of the kernel at
                 the center of the array and must have type `numpy.float64`_.
             kernel_fft (:obj:`bool`, optional):
@@ -182,7 +768,9 @@ class ConvolveFFTW:
 
         Returns:
             `numpy.ndarray`_: The convolved image, or its FFT, with the
-            same shape as the provided ``data`` array.
+            same shape as the provided ``data`` array.  If :attr:`real` is
+            True, the returned FFT is the half spectrum.  If :attr:`pad` is
+            True, the returned FFT is for the padded array.
 
         Raises:
             ValueError:
@@ -195,24 +783,40 @@ class ConvolveFFTW:
         """
         if not np.all(np.isfinite(data)) or not np.all(np.isfinite(kernel)):
             raise ValueError('Data and kernel must both have valid values.')
-        self.fft(data)
+        if data.ndim == self.ndim + 1:
+            return self._convolve_stack(data, kernel, kernel_fft=kernel_fft,
+                                        return_fft=return_fft)
 
-        if kernel.shape != self.shape:
-            raise ValueError('Kernel has incorrect shape for this instance of ConvolveFFTW.')
-        if kernel_fft:
-            if kernel.dtype.type is not np.complex128:
-                raise TypeError('Kernel FFT must be of type numpy.complex128.')
-            self.kern_fft[...] = kernel
-        else:
-            if kernel.dtype.type is not np.float64:
-                raise TypeError('Kernel must be of type numpy.float64.')
-            self.kern.real[...] = np.fft.ifftshift(kernel)
-            self.kfft()
+        self.fft(data)
+        self._set_kernel_fft(kernel, kernel_fft)
         if return_fft:
             return self.data_fft * self.kern_fft
         self.data_fft *= self.kern_fft
         self.ifft()
-        return self.dcnv.real.copy()
+        return self.dcnv.real[self.inner].copy()
+
+    def _convolve_stack(self, data, kernel, kernel_fft=False, return_fft=False):
+        """
+        Convolve a stack of images with a single kernel.
+
+        See :func:`__call__` for the argument descriptions.  The only
+        difference is that the shape of ``data`` must be ``shape + (nimg,)``.
+        """
+        if data.shape[:-1] != self.shape:
+            raise ValueError('Data has incorrect shape for this instance of ConvolveFFTW.')
+        if data.dtype.type is not np.float64:
+            raise TypeError('Data must be of type numpy.float64.')
+
+        ws = self.stack_workspace(data.shape[-1])
+        ws['data'].real[self.inner] = data
+        ws['dfft']()
+
+        self._set_kernel_fft(kernel, kernel_fft)
+        if return_fft:
+            return ws['data_fft'] * self.kern_fft[...,None]
+        ws['data_fft'] *= self.kern_fft[...,None]
+        ws['ifft']()
+        return ws['dcnv'].real[self.inner].copy()
 
     def fft(self, data, copy=True, shift=False):
         """
@@ -231,10 +835,15 @@ class ConvolveFFTW:
                 Before computing, use ``numpy.fft.iffshift`` to shift
                 the spatial coordinates of the image such that the 0
                 frequency component of the FFT is shifted to the
-                center of the image.
+                center of the image.  If :attr:`pad` is True, this also
+                crops the image to :attr:`support` and places it at the
+                center of the padded array (see :func:`pad_kernel`), as is
+                appropriate for a convolution kernel.
 
         Returns:
-            `numpy.ndarray`_: The FFT of the provided data.
+            `numpy.ndarray`_: The FFT of the provided data.  If :attr:`real`
+            is True, this is the half spectrum.  If :attr:`pad` is True, this
+            is the FFT of the padded array.
 
         Raises:
             ValueError:
@@ -248,12 +857,199 @@ class ConvolveFFTW:
         if data.dtype.type is not np.float64:
             raise TypeError('Data must be of type numpy.float64.')
 
-        self.data.real[...] = np.fft.ifftshift(data) if shift else data
+        if shift:
+            self.data.real[...] = np.fft.ifftshift(pad_kernel(data, self.grid_shape,
+                                                              support=self.support)
+                                                   if self.pad else data)
+        else:
+            if self.pad:
+                # Reset the padding
+                self.data[...] = 0.
+            self.data.real[self.inner] = data
         self.dfft()
         return self.data_fft.copy() if copy else self.data_fft
-        
 
-def construct_beam(psf, aperture, return_fft=False):
+
+#: Thread-local registry of :class:`ConvolveFFTW` instances; see
+#: :func:`get_convolver`.
+_convolvers = threading.local()
+
+
+def get_convolver(shape, flags=None, real=False, threads=1, pad=False, support=None):
+    """
+    Return a shared :class:`ConvolveFFTW` instance.
+
+    Constructing a :class:`ConvolveFFTW` instance requires allocating its
+    memory workspace and planning its FFTW algorithms.  Because the number of
+    unique array shapes is typically small (e.g., there is one map size per
+    MaNGA IFU bundle), this function keeps a registry of instances keyed by
+    the array shape, the FFTW flags, the FFT type, the number of threads, and
+    the padding (and kernel support), such that the same
+    workspace is reused by all convolutions with that shape.  The registry is
+    specific to each thread (and each process) because the workspace of a
+    :class:`ConvolveFFTW` instance cannot be used concurrently.
+
+    Args:
+        shape (:obj:`tuple`):
+            Shape of the arrays to be convolved.
+        flags (:obj:`tuple`, optional):
+            Flags passed to pyFFTW; see :class:`ConvolveFFTW`.
+        real (:obj:`bool`, optional):
+            Use the real-to-complex FFTW algorithms; see
+            :class:`ConvolveFFTW`.
+        threads (:obj:`int`, optional):
+            The number of threads used to compute each FFT; see
+            :class:`ConvolveFFTW`.
+        pad (:obj:`bool`, optional):
+            Zero-pad the arrays such that the convolutions are linear; see
+            :class:`ConvolveFFTW`.
+        support (array-like, optional):
+            The extent of the convolution kernels from their center; see
+            :class:`ConvolveFFTW`.
+
+    Returns:
+        :class:`ConvolveFFTW`: The convolver for arrays with the provided
+        shape.
+    """
+    if not hasattr(_convolvers, 'registry'):
+        _convolvers.registry = {}
+    _support = None if support is None or not pad else tuple([int(s) for s in support])
+    key = (tuple(shape), ('FFTW_MEASURE',) if flags is None else flags, real, threads, pad,
+           _support)
+    if key not in _convolvers.registry:
+        _convolvers.registry[key] = ConvolveFFTW(shape, flags=flags, real=real, threads=threads,
+                                                 pad=pad, support=_support)
+    return _convolvers.registry[key]
+
+
+def clear_convolvers():
+    """
+    Remove all :class:`ConvolveFFTW` instances from the registry of the
+    calling thread; see :func:`get_convolver`.
+    """
+    _convolvers.registry = {}
+
+
+class SparseBeam:
+    """
+    Perform beam-smearing convolutions using a sparse matrix in direct space.
+
+    The FFT-based convolutions (see :func:`convolve_fft` and
+    :class:`ConvolveFFTW`) compute the convolved image for all pixels.  When
+    the beam is compact and the convolved values are only needed for a small
+    subset of the pixels (``gpm``), it can be faster to construct the
+    convolution as a sparse matrix that maps the full image to the convolved
+    values in the selected pixels.  The beam is truncated at a fraction
+    (``threshold``) of its peak value.  The image is treated as periodic so
+    that the result matches the (circular) FFT-based convolution, to within
+    the truncation of the beam.
+
+    Instances of this class can be used in place of a :class:`ConvolveFFTW`
+    instance when calling :func:`smear` and :func:`deriv_smear`; see
+    :func:`__call__`.  Use :func:`sparse_beam_preferred` to determine if the
+    sparse matrix is expected to be faster than the FFT.
+
+    Args:
+        beam (`numpy.ndarray`_):
+            Direct image of the beam profile, with the center of the beam at
+            the center of the array (i.e., the center pixel is ``n//2`` along
+            each axis).  This sets the shape of the images to be convolved.
+        gpm (`numpy.ndarray`_):
+            Boolean array selecting the pixels for which to compute the
+            convolved values.  Must have the same shape as ``beam``.
+        threshold (:obj:`float`, optional):
+            The fraction of the peak used to truncate the beam.
+    """
+    def __init__(self, beam, gpm, threshold=1e-8):
+        if gpm.shape != beam.shape:
+            raise ValueError('Beam and good-pixel mask must have the same shape.')
+        self.shape = beam.shape
+        self.ndim = len(self.shape)
+        self.npix = np.prod(self.shape)
+        self.threshold = threshold
+        # Indices of the output pixels
+        self.indx = np.where(gpm.ravel())[0]
+        # Offsets and values of the truncated beam
+        bindx = np.where(beam >= threshold * np.amax(beam))
+        offsets = [i - n//2 for i, n in zip(bindx, self.shape)]
+        # Construct the matrix
+        out = np.unravel_index(self.indx, self.shape)
+        cols = np.ravel_multi_index(tuple([o[:,None] - d[None,:] for o, d in zip(out, offsets)]),
+                                    self.shape, mode='wrap').ravel()
+        rows = np.repeat(np.arange(self.indx.size), bindx[0].size)
+        self.matrix = sparse.csr_matrix((np.tile(beam[bindx], self.indx.size), (rows, cols)),
+                                        shape=(self.indx.size, self.npix))
+
+    @timed('convolve')
+    def __call__(self, data, kernel=None, kernel_fft=False):
+        """
+        Convolve data with the beam.
+
+        The call signature mimics :func:`ConvolveFFTW.__call__` so that this
+        object can be used in its place, but the convolution kernel is always
+        the beam used to instantiate the object.
+
+        Args:
+            data (`numpy.ndarray`_):
+                Data to convolve.  Shape must match :attr:`shape`.  This can
+                also be a stack of images, in which case the shape must be
+                ``shape + (nimg,)``; the stack is convolved with a single
+                sparse-dense matrix product.
+            kernel (`numpy.ndarray`_, optional):
+                Ignored.
+            kernel_fft (:obj:`bool`, optional):
+                Ignored.
+
+        Returns:
+            `numpy.ndarray`_: The convolved image with the same shape as
+            ``data``.  Only the pixels selected when instantiating the object
+            are filled; all other pixels are 0.
+        """
+        if data.shape[:self.ndim] != self.shape or data.ndim > self.ndim + 1:
+            raise ValueError('Data has incorrect shape for this instance of SparseBeam.')
+        cnv = np.zeros((self.npix,) + data.shape[self.ndim:], dtype=float)
+        cnv[self.indx] = self.matrix.dot(data.reshape((self.npix,) + data.shape[self.ndim:]))
+        return cnv.reshape(data.shape)
+
+
+def sparse_beam_preferred(gpm, beam, shape=None, threshold=1e-8, factor=4.):
+    r"""
+    Determine if the convolution is expected to be faster using
+    :class:`SparseBeam` than using FFTs.
+
+    The number of operations for the sparse-matrix multiplication scales as
+    the number of non-zero matrix elements (the number of selected pixels
+    times the number of pixels in the truncated beam), whereas the FFT scales
+    as :math:`N \log_2 N` for :math:`N` pixels.  The sparse-matrix approach is
+    preferred if the former is less than ``factor`` times the latter.  The
+    default ``factor`` is based on timing tests using `scipy.sparse.csr_matrix`_ and
+    :class:`ConvolveFFTW`.
+
+    Args:
+        gpm (`numpy.ndarray`_):
+            Boolean array selecting the pixels for which to compute the
+            convolved values.
+        beam (`numpy.ndarray`_):
+            Direct image of the beam profile.
+        shape (:obj:`tuple`, optional):
+            The shape of the images used for the FFTs, if different from the
+            shape of ``gpm`` (e.g., see :func:`convolution_crop`).
+        threshold (:obj:`float`, optional):
+            The fraction of the peak used to truncate the beam; see
+            :class:`SparseBeam`.
+        factor (:obj:`float`, optional):
+            The relative speed of the sparse-matrix multiplication and the
+            FFT per operation.
+
+    Returns:
+        :obj:`bool`: Flag that the sparse-matrix approach is faster.
+    """
+    nnz = np.sum(gpm) * np.sum(beam >= threshold * np.amax(beam))
+    npix = np.prod(gpm.shape if shape is None else shape)
+    return nnz < factor * npix * np.log2(npix)
+
+
+def construct_beam(psf, aperture, return_fft=False, real=False, pad=False):
     """
     Construct the beam profile.
 
@@ -270,17 +1066,188 @@ def construct_beam(psf, aperture, return_fft=False):
         return_fft (:obj:`bool`, optional):
             Flag to return the FFT of the beam profile, instead of
             its the direct image.
+        real (:obj:`bool`, optional):
+            Use the real-to-complex FFTs.  If ``return_fft`` is True, this
+            means the half spectrum of the beam profile is returned (see
+            :func:`half_spectrum_shape`).
+        pad (:obj:`bool`, optional):
+            Zero-pad the images such that the convolution is linear instead of
+            circular; see :func:`convolve_fft`.
 
     Returns:
         `numpy.ndarray`_: The 2D image of the beam profile, or its
         FFT, with the same shape as the provided ``psf`` and
-        ``aperture`` arrays.
+        ``aperture`` arrays (unless the half spectrum is returned).
+    """
+    return convolve_fft(psf, aperture, return_fft=return_fft, real=real, pad=pad)
+
+
+def beam_support(beam, threshold=1e-8):
+    """
+    Determine the extent of the beam profile along each axis.
+
+    The support is defined as the region with values above a fraction
+    (``threshold``) of the beam peak.
+
+    Args:
+        beam (`numpy.ndarray`_):
+            Direct image of the beam profile, with the center of the beam at
+            the center of the array (i.e., the center pixel is ``n//2`` along
+            each axis).
+        threshold (:obj:`float`, optional):
+            The fraction of the peak used to define the beam support.
+
+    Returns:
+        `numpy.ndarray`_: The maximum distance in pixels from the center of
+        the array to any pixel above the threshold, separately for each
+        axis.
+    """
+    indx = np.where(beam >= threshold * np.amax(beam))
+    return np.array([np.amax(np.absolute(i - n//2)) for i, n in zip(indx, beam.shape)])
+
+
+def crop_kernel(kernel, shape):
+    """
+    Extract a subimage of a convolution kernel.
+
+    The subimage is centered on the center of the kernel array (see
+    :func:`beam_support`).  The array is treated as periodic, meaning that
+    the requested shape can be larger than the shape of the kernel.
+
+    Args:
+        kernel (`numpy.ndarray`_):
+            Direct image of the kernel.
+        shape (:obj:`tuple`):
+            Shape for the subimage.
+
+    Returns:
+        `numpy.ndarray`_: The cropped kernel image.
+    """
+    indx = [(n//2 - m//2 + np.arange(m)) % n for n, m in zip(kernel.shape, shape)]
+    return kernel[np.ix_(*indx)]
+
+
+def convolution_crop(gpm, support, primes=(2,3,5,7)):
+    """
+    Construct a reduced domain for the convolution of an image.
+
+    The convolution of an image with a kernel using FFTs is circular, meaning
+    the image is treated as periodic.  For a kernel that is confined to
+    ``support`` pixels from its center, the convolved values in a region of
+    interest (``gpm``) only depend on the image pixels within ``support``
+    pixels of that region.  This function selects the smallest box, with an
+    FFT-friendly size (see :func:`smooth_fft_size`), that contains the region
+    of interest and this margin.  Along each axis, the box is selected as a
+    contiguous set of pixels, wrapping around the edge of the image if
+    necessary, such that the convolution within the region of interest is
+    identical to the convolution of the full image (to within the fraction of
+    the kernel beyond its support).  Any axis where the box would not be
+    smaller than the image is not cropped.
+
+    Args:
+        gpm (`numpy.ndarray`_):
+            Boolean array selecting the region of interest in the image.
+        support (array-like):
+            The extent of the kernel along each axis; see
+            :func:`beam_support`.
+        primes (:obj:`tuple`, optional):
+            The allowed prime factors for the size of the box; see
+            :func:`smooth_fft_size`.
+
+    Returns:
+        :obj:`tuple`: The vectors with the indices of the pixels in the box
+        along each axis.  The box is extracted from an image using
+        ``image[numpy.ix_(*indx)]``.  If the box is not smaller than the full
+        image or if there are no pixels in the region of interest, None is
+        returned.
     """
-    return convolve_fft(psf, aperture, return_fft=return_fft)
+    if not np.any(gpm):
+        return None
+    indx = []
+    for axis, (n, s) in enumerate(zip(gpm.shape, support)):
+        valid = np.where(np.any(gpm, axis=tuple([i for i in range(gpm.ndim) if i != axis])))[0]
+        # Number of pixels needed
+        nreq = valid[-1] - valid[0] + 1 + 2*int(s)
+        m = smooth_fft_size(nreq, primes=primes)
+        if m >= n:
+            indx += [np.arange(n)]
+            continue
+        start = valid[0] - int(s) - (m - nreq)//2
+        indx += [(start + np.arange(m)) % n]
+    return None if all([i.size == n for i, n in zip(indx, gpm.shape)]) else tuple(indx)
 
 
 # TODO: Include higher moments?
-def smear(v, beam, beam_fft=False, sb=None, sig=None, cnvfftw=None, verbose=False):
+def zeroth_moment(beam, shape, beam_fft=False, sb=None, cnvfftw=None):
+    """
+    Compute the zeroth moment of the beam-smeared intensity distribution and
+    its inverse.
+
+    The zeroth moment only depends on the surface brightness and the beam, not
+    on the kinematic fields.  When these are fixed (e.g., during a fit), the
+    result can be computed once and passed to :func:`smear` and
+    :func:`deriv_smear` using their ``mom0`` keyword.
+
+    Args:
+        beam (`numpy.ndarray`_):
+            An image of the beam profile or its precomputed FFT.  See
+            :func:`smear`.  Ignored if ``cnvfftw`` is a
+            :class:`~nirvana.models.beam.SparseBeam` object.
+        shape (:obj:`tuple`):
+            Shape of the (2D) maps to convolve.
+        beam_fft (:obj:`bool`, optional):
+            Flag that the provided data for ``beam`` is actually the
+            precomputed FFT of the beam profile.
+        sb (`numpy.ndarray`_, optional):
+            2D array with the surface brightness of the object.  If None, the
+            zeroth moment is the convolution of a unity map.
+        cnvfftw (:class:`~nirvana.models.beam.ConvolveFFTW`, :class:`~nirvana.models.beam.SparseBeam`, optional):
+            An object that expedites the convolutions.  See :func:`smear`.
+
+    Returns:
+        :obj:`tuple`: The zeroth moment map and its inverse.  The inverse is
+        set to unity where the zeroth moment is 0.
+    """
+    if sb is not None and sb.shape != tuple(shape):
+        raise ValueError('Surface-brightness array does not have the expected shape.')
+    _cnv = convolve_fft if cnvfftw is None else cnvfftw
+    bfft = None if isinstance(cnvfftw, SparseBeam) \
+                else (beam if beam_fft else (np.fft.rfftn(np.fft.ifftshift(beam))
+                                             if cnvfftw is None else cnvfftw.fft(beam, shift=True)))
+    mom0 = _cnv(np.ones(shape, dtype=float) if sb is None else sb, bfft, kernel_fft=True)
+    return mom0, 1./(mom0 + (mom0 == 0.0))
+
+
+@timed('smear')
+def _valid_beam_shape(beam, shape, beam_fft, cnvfftw):
+    """
+    Check the shape of the beam provided to :func:`smear` and
+    :func:`deriv_smear`.
+
+    Args:
+        beam (`numpy.ndarray`_):
+            An image of the beam profile or its FFT.
+        shape (:obj:`tuple`):
+            Shape of the images to convolve.
+        beam_fft (:obj:`bool`):
+            Flag that ``beam`` is the FFT of the beam profile.
+        cnvfftw (:class:`ConvolveFFTW`, :class:`SparseBeam`):
+            Object used to perform the convolutions.  Can be None.
+
+    Returns:
+        :obj:`bool`: Flag that the shape of ``beam`` is valid.
+    """
+    if beam.shape == tuple(shape):
+        return True
+    if not beam_fft:
+        return False
+    shapes = [half_spectrum_shape(shape)]
+    if isinstance(cnvfftw, ConvolveFFTW) and cnvfftw.pad:
+        shapes += [cnvfftw.grid_shape, half_spectrum_shape(cnvfftw.grid_shape)]
+    return beam.shape in shapes
+
+
+def smear(v, beam, beam_fft=False, sb=None, sig=None, cnvfftw=None, verbose=False, mom0=None):
     """
     Get the beam-smeared surface brightness, velocity, and velocity
     dispersion fields.
@@ -291,7 +1258,10 @@ def smear(v, beam, beam_fft=False, sb=None, sig=None, cnvfftw=None, verbose=Fals
             be square.
         beam (`numpy.ndarray`_):
             An image of the beam profile or its precomputed FFT. Must
-            be the same shape as ``v``. If the beam profile is
+            be the same shape as ``v``, except that the FFT can also be
+            provided as its half spectrum (see :func:`kernel_fft_form`) or,
+            if ``cnvfftw`` pads the convolutions, for the padded shape (see
+            :func:`ConvolveFFTW.fft_kernel`). If the beam profile is
             provided, it is expected to be normalized to unity.
         beam_fft (:obj:`bool`, optional):
             Flag that the provided data for ``beam`` is actually the
@@ -305,10 +1275,18 @@ def smear(v, beam, beam_fft=False, sb=None, sig=None, cnvfftw=None, verbose=Fals
         sig (`numpy.ndarray`_, optional):
             2D array with the velocity dispersion measurements. Must
             have the same shape as ``v``.
-        cnvfftw (:class:`~nirvana.models.beam.ConvolveFFTW`, optional):
+        cnvfftw (:class:`~nirvana.models.beam.ConvolveFFTW`, :class:`~nirvana.models.beam.SparseBeam`, optional):
             An object that expedites the convolutions using
-            FFTW/pyFFTW. If None, the convolution is done using numpy
-            FFT routines.
+            FFTW/pyFFTW or a sparse matrix.  If None, the convolution is
+            done using numpy FFT routines.
+        verbose (:obj:`bool`, optional):
+            Print progress messages.
+        mom0 (:obj:`tuple`, optional):
+            The precomputed zeroth moment of the beam-smeared intensity
+            distribution and its inverse, as returned by
+            :func:`zeroth_moment`.  These must have been computed using the
+            same ``beam``, ``sb``, and ``cnvfftw``.  If None, the zeroth
+            moment is computed.
 
     Returns:
         :obj:`tuple`: Tuple of three objects, which are nominally the
@@ -325,7 +1303,7 @@ def smear(v, beam, beam_fft=False, sb=None, sig=None, cnvfftw=None, verbose=Fals
     """
     if v.ndim != 2:
         raise ValueError('Can only accept 2D images.')
-    if beam.shape != v.shape:
+    if not _valid_beam_shape(beam, v.shape, beam_fft, cnvfftw):
         raise ValueError('Input beam and velocity field array sizes must match.')
     if sb is not None and sb.shape != v.shape:
         raise ValueError('Input surface-brightness and velocity field array sizes must match.')
@@ -334,20 +1312,21 @@ def smear(v, beam, beam_fft=False, sb=None, sig=None, cnvfftw=None, verbose=Fals
 
     _cnv = convolve_fft if cnvfftw is None else cnvfftw
 
-    # Pre-compute the beam FFT
-    bfft = beam if beam_fft else (np.fft.fftn(np.fft.ifftshift(beam))
-                                    if cnvfftw is None else cnvfftw.fft(beam, shift=True))
+    # Pre-compute the beam FFT (not needed by SparseBeam)
+    bfft = None if isinstance(cnvfftw, SparseBeam) \
+                else (beam if beam_fft else (np.fft.rfftn(np.fft.ifftshift(beam))
+                                             if cnvfftw is None else cnvfftw.fft(beam, shift=True)))
 
     # Get the first moment of the beam-smeared intensity distribution
-    if verbose: print('Convolving surface brightness...')
-    mom0 = _cnv(np.ones(v.shape, dtype=float) if sb is None else sb, bfft, kernel_fft=True)
-#    mom0 = None if sb is None else _cnv(sb, bfft, kernel_fft=True)
+    if mom0 is None:
+        if verbose: print('Convolving surface brightness...')
+        mom0 = zeroth_moment(bfft, v.shape, beam_fft=True, sb=sb, cnvfftw=cnvfftw)
+    mom0, inv_mom0 = mom0
 
     # First moment
     if verbose: print('Convolving velocity field...',sb,v)
     mom1 = _cnv(v if sb is None else sb*v, bfft, kernel_fft=True)
-    if mom0 is not None:
-        mom1 /= (mom0 + (mom0 == 0.0))
+    mom1 *= inv_mom0
 
     if sig is None:
         # Sigma not provided so we're done
@@ -357,14 +1336,15 @@ def smear(v, beam, beam_fft=False, sb=None, sig=None, cnvfftw=None, verbose=Fals
     _sig = np.square(v) + np.square(sig)
     if verbose: print('Convolving velocity dispersion...')
     mom2 = _cnv(_sig if sb is None else sb*_sig, bfft, kernel_fft=True)
-    if mom0 is not None:
-        mom2 /= (mom0 + (mom0 == 0.0))
+    mom2 *= inv_mom0
     mom2 -= mom1**2
     mom2[mom2 < 0] = 0.0
     return mom0, mom1, np.sqrt(mom2)
 
 
-def deriv_smear(v, dv, beam, beam_fft=False, sb=None, dsb=None, sig=None, dsig=None, cnvfftw=None):
+@timed('deriv_smear')
+def deriv_smear(v, dv, beam, beam_fft=False, sb=None, dsb=None, sig=None, dsig=None, cnvfftw=None,
+                mom0=None):
     """
     Get the beam-smeared surface brightness, velocity, and velocity
     dispersion fields and their derivatives.
@@ -380,8 +1360,11 @@ def deriv_smear(v, dv, beam, beam_fft=False, sb=None, dsb=None, sig=None, dsig=N
             single parameter.
         beam (`numpy.ndarray`_):
             An image of the beam profile or its precomputed FFT. Must be the
-            same shape as ``v``. If the beam profile is provided, it is expected
-            to be normalized to unity.
+            same shape as ``v``, except that the FFT can also be provided as its
+            half spectrum (see :func:`kernel_fft_form`) or, if ``cnvfftw`` pads
+            the convolutions, for the padded shape (see
+            :func:`ConvolveFFTW.fft_kernel`). If the beam profile is provided,
+            it is expected to be normalized to unity.
         beam_fft (:obj:`bool`, optional):
             Flag that the provided data for ``beam`` is actually the precomputed
             FFT of the beam profile.
@@ -402,9 +1385,18 @@ def deriv_smear(v, dv, beam, beam_fft=False, sb=None, dsb=None, sig=None, dsig=N
             2D arrays with the derivative of the velocity dispersion
             measurements with respect to a set of model parameters. Must have
             the same shape as ``dv``.
-        cnvfftw (:class:`~nirvana.models.beam.ConvolveFFTW`, optional):
-            An object that expedites the convolutions using FFTW/pyFFTW. If
-            None, the convolution is done using numpy FFT routines.
+        cnvfftw (:class:`~nirvana.models.beam.ConvolveFFTW`, :class:`~nirvana.models.beam.SparseBeam`, optional):
+            An object that expedites the convolutions using FFTW/pyFFTW or a
+            sparse matrix.  If None, the convolution is done using numpy FFT
+            routines.  When using a :class:`~nirvana.models.beam.SparseBeam`,
+            all the derivative images are convolved using a single
+            sparse-dense matrix product.
+        mom0 (:obj:`tuple`, optional):
+            The precomputed zeroth moment of the beam-smeared intensity
+            distribution and its inverse, as returned by
+            :func:`zeroth_moment`.  These must have been computed using the
+            same ``beam``, ``sb``, and ``cnvfftw``.  If None, the zeroth
+            moment is computed.
 
     Returns:
         :obj:`tuple`: Tuple of six `numpy.ndarray`_ objects, which are nominally
@@ -422,7 +1414,7 @@ def deriv_smear(v, dv, beam, beam_fft=False, sb=None, dsb=None, sig=None, dsig=N
         raise ValueError('Velocity-field derivative array must be 3D.')
     if v.shape != dv.shape[:2]:
         raise ValueError('Shape of first two axes of dv must match shape of v.')
-    if beam.shape != v.shape:
+    if not _valid_beam_shape(beam, v.shape, beam_fft, cnvfftw):
         raise ValueError('Input beam and velocity field array sizes must match.')
     if sb is not None and sb.shape != v.shape:
         raise ValueError('Input surface-brightness and velocity field array sizes must match.')
@@ -439,59 +1431,80 @@ def deriv_smear(v, dv, beam, beam_fft=False, sb=None, dsb=None, sig=None, dsig=N
 
     _cnv = convolve_fft if cnvfftw is None else cnvfftw
 
-    # Pre-compute the beam FFT
-    bfft = beam if beam_fft else (np.fft.fftn(np.fft.ifftshift(beam))
-                                    if cnvfftw is None else cnvfftw.fft(beam, shift=True))
+    # Pre-compute the beam FFT (not needed by SparseBeam)
+    bfft = None if isinstance(cnvfftw, SparseBeam) \
+                else (beam if beam_fft else (np.fft.rfftn(np.fft.ifftshift(beam))
+                                             if cnvfftw is None else cnvfftw.fft(beam, shift=True)))
 
     # Number of parameters is the length of the last axis of 'dv'
     npar = dv.shape[-1]
 
     # Get the zeroth moment of the beam-smeared intensity distribution
     _sb = np.ones(v.shape, dtype=float) if sb is None else sb
-    mom0 = _cnv(_sb, bfft, kernel_fft=True)
-
-    # Get the zeroth moment derivatives, if possible
-    dmom0 = None 
-    if dsb is not None:
-        dmom0 = dsb.copy()
-        for i in range(npar):
-            dmom0[...,i] = _cnv(dsb[...,i], bfft, kernel_fft=True)
-
-    inv_mom0 = 1./(mom0 + (mom0 == 0.0))
+    mom0, inv_mom0 = zeroth_moment(bfft, v.shape, beam_fft=True, sb=sb, cnvfftw=cnvfftw) \
+                        if mom0 is None else mom0
 
     # First moment
     mom1 = _cnv(_sb*v, bfft, kernel_fft=True) * inv_mom0
-    dmom1 = dv.copy()
-    for i in range(npar):
-        dmom1[...,i] = _cnv(_sb*dv[...,i], bfft, kernel_fft=True) * inv_mom0
-        if dsb is not None:
-            dmom1[...,i] += _cnv(v*dsb[...,i], bfft, kernel_fft=True) * inv_mom0
-            dmom1[...,i] -= mom1 * inv_mom0 * dmom0[...,i]
-
-    if sig is None:
-        # Sigma not provided so we're done
-        return mom0, mom1, None, dmom0, dmom1, None
 
     # Second moment
-    _sig = np.square(v) + np.square(sig)
-    mom2 = _cnv(_sb*_sig, bfft, kernel_fft=True) * inv_mom0 - mom1**2
-    mom2[mom2 < 0] = 0.0
-    _mom2 = np.sqrt(mom2)
-    _inv_mom2 = 1./(_mom2 + (_mom2 == 0.0))
-    dmom2 = dv.copy()
-    for i in range(npar):
+    if sig is not None:
+        _sig = np.square(v) + np.square(sig)
+        mom2 = _cnv(_sb*_sig, bfft, kernel_fft=True) * inv_mom0 - mom1**2
+        mom2[mom2 < 0] = 0.0
+        _mom2 = np.sqrt(mom2)
+        _inv_mom2 = 1./(_mom2 + (_mom2 == 0.0))
+
+    # Construct the stack of derivative images to convolve.  Because the
+    # convolution is linear, all the terms contributing to the derivative of a
+    # given moment are summed before being convolved.  All the derivative
+    # images are then convolved using a single (multi-plane) FFT.
+    stack = []
+    # - Zeroth moment derivatives
+    if dsb is not None:
+        stack += [dsb]
+    # - First moment derivatives
+    _dmom1 = _sb[...,None]*dv
+    if dsb is not None:
+        _dmom1 += v[...,None]*dsb
+    stack += [_dmom1]
+    # - Second moment derivatives
+    if sig is not None:
         # dv terms
-        dmom2[...,i] = _cnv(2*_sb*v*dv[...,i], bfft, kernel_fft=True) * inv_mom0 \
-                            - 2 * mom1 * dmom1[...,i]
+        _dmom2 = 2*(_sb*v)[...,None]*dv
         # dsb terms
         if dsb is not None:
-            dmom2[...,i] += _cnv(_sig*dsb[...,i], bfft, kernel_fft=True) * inv_mom0
-            dmom2[...,i] -= mom2 * inv_mom0 * dmom0[...,i]
+            _dmom2 += _sig[...,None]*dsb
         # dsig terms
         if dsig is not None:
-            dmom2[...,i] += _cnv(2*_sb*sig*dsig[...,i], bfft, kernel_fft=True) * inv_mom0
-        # sqrt operation
-        dmom2[...,i] *= _inv_mom2 / 2
+            _dmom2 += 2*(_sb*sig)[...,None]*dsig
+        stack += [_dmom2]
+    cnv_stack = _cnv(stack[0] if len(stack) == 1 else np.concatenate(stack, axis=-1), bfft,
+                     kernel_fft=True)
+
+    # Get the zeroth moment derivatives, if possible
+    dmom0 = None
+    s = 0
+    if dsb is not None:
+        dmom0 = cnv_stack[...,:npar]
+        s += npar
+
+    # First moment derivatives
+    dmom1 = cnv_stack[...,s:s+npar] * inv_mom0[...,None]
+    if dsb is not None:
+        dmom1 -= (mom1 * inv_mom0)[...,None] * dmom0
+    s += npar
+
+    if sig is None:
+        # Sigma not provided so we're done
+        return mom0, mom1, None, dmom0, dmom1, None
+
+    # Second moment derivatives
+    dmom2 = cnv_stack[...,s:s+npar] * inv_mom0[...,None] - 2 * mom1[...,None] * dmom1
+    if dsb is not None:
+        dmom2 -= (mom2 * inv_mom0)[...,None] * dmom0
+    # sqrt operation
+    dmom2 *= (_inv_mom2 / 2)[...,None]
 
     return mom0, mom1, _mom2, dmom0, dmom1, dmom2
 
@@ -3,6 +3,7 @@
 .. include:: ../include/links.rst
 """
 
+import os
 import multiprocessing as mp
 
 import numpy as np
@@ -17,12 +18,12 @@ except:
 
 import dynesty
 
-from .beam import smear, ConvolveFFTW
+from .beam import smear, zeroth_moment
 from .geometry import projected_polar
 from ..data.manga import MaNGAGasKinematics, MaNGAStellarKinematics
 from ..data.util import trim_shape, unpack
 from ..data.fitargs import FitArgs
-from ..models.higher_order import bisym_model
+from ..models.higher_order import bisym_model, bisym_convolver
 
 
 def smoothing(array, weight=1):
@@ -250,11 +251,281 @@ def loglike(params, args, squared=False):
 
     return llike
 
+class BisymLikelihood:
+    """
+    Precomputed log likelihood for the :class:`dynesty.NestedSampler` fit.
+
+    Calling an instance of this class is identical to calling :func:`loglike`
+    with the same ``args`` and ``squared``, except that everything that does
+    not depend on the model parameters is computed once when the object is
+    instantiated.  This includes the parameter layout, the good-pixel masks,
+    the remapped surface brightness and its beam-smeared zeroth moment, the
+    binning matrices (limited to the unmasked measurements), the data and
+    noise-floor-adjusted inverse variances of the unmasked measurements, and
+    the normalization of the likelihood.  The model is evaluated using plain
+    arrays instead of masked arrays.
+
+    .. warning::
+
+        The object must be reconstructed if any of the data, masks, or fit
+        settings in ``args`` change.
+
+    Args:
+        args (:class:`~nirvana.data.fitargs.FitArgs`):
+            Object containing all of the data and settings needed for the
+            galaxy.  The bin edges must be defined.
+        squared (:obj:`bool`, optional):
+            Whether to compute the chi squared against the square of the
+            dispersion profile or not.
+        cnvfftw (:class:`~nirvana.models.beam.ConvolveFFTW`, optional):
+            An object that expedites the convolutions using FFTW/pyFFTW.  If
+            None, the convolutions are done using the numpy FFT routines.
+            The object cannot be pickled; when the likelihood is pickled
+            (e.g., to send it to the processes of a
+            :class:`multiprocessing.Pool`), each process instead uses its own
+            convolver (see
+            :func:`~nirvana.models.higher_order.bisym_convolver`).
+    """
+    def __init__(self, args, squared=False, cnvfftw=None):
+        self.args = args
+        self.squared = squared
+        self.cnvfftw = cnvfftw
+        kin = args.kin
+
+        # Parameter layout; see unpack
+        self.nglobs = args.nglobs
+        self.fixcent = int(args.fixcent)
+        self.disp = args.disp
+        self.edges = np.asarray(args.edges, dtype=float)
+        self.jump = self.edges.size - self.fixcent
+        self.weight = args.weight
+        self.penalty = args.penalty if hasattr(args, 'penalty') else None
+        # Work-space arrays for the velocity profiles, including the
+        # (fixed) central bin
+        self._vt = np.zeros(self.edges.size, dtype=float)
+        self._v2t = np.zeros(self.edges.size, dtype=float)
+        self._v2r = np.zeros(self.edges.size, dtype=float)
+
+        # Coordinates and beam
+        self.x = np.ascontiguousarray(kin.grid_x, dtype=float)
+        self.y = np.ascontiguousarray(kin.grid_y, dtype=float)
+        self.beam_fft = None if not getattr(args, 'smearing', True) else kin.beam_fft
+        self.sb = kin.remap('sb', masked=False) if self.disp else None
+        self.mom0 = None if self.beam_fft is None \
+                        else zeroth_moment(self.beam_fft, self.x.shape, beam_fft=True, sb=self.sb,
+                                           cnvfftw=self.cnvfftw)
+
+        # Velocity data.  In loglike, the masked-array arithmetic also masks
+        # any measurement with a non-finite contribution to the likelihood;
+        # e.g., those with an inverse variance of 0.
+        vel = np.ma.getdata(kin.vel).astype(float)
+        if kin.vel_ivar is None:
+            vel_ivar = np.ones(vel.size, dtype=float)
+        else:
+            with np.errstate(divide='ignore'):
+                vel_ivar = 1/(1/np.ma.getdata(kin.vel_ivar) + args.noise_floor**2)
+        gpm = np.isfinite(vel) & (vel_ivar > 0) & np.isfinite(vel_ivar)
+        if kin.vel_mask is not None:
+            gpm &= np.logical_not(kin.vel_mask)
+        self.vel_bin = kin.bin_transform[gpm]
+        self.vel = vel[gpm]
+        self.vel_ivar = vel_ivar[gpm]
+        self.vel_norm = 0. if kin.vel_ivar is None \
+                            else .25 * np.sum(np.log(2*np.pi * self.vel_ivar))
+        self._vel_res = np.empty(self.vel.size, dtype=float)
+
+        if not self.disp:
+            self.sig_bin = None
+            return
+
+        # Dispersion data
+        sig = np.ma.getdata(kin.sig_phys2).astype(float)
+        sig_ivar = np.ones_like(sig) if kin.sig_phys2_ivar is None \
+                        else np.ma.getdata(kin.sig_phys2_ivar)
+        if not squared:
+            with np.errstate(invalid='ignore'):
+                sig = np.sqrt(sig)
+                sig_ivar = np.sqrt(sig_ivar)
+        with np.errstate(divide='ignore'):
+            sig_ivar = 1/(1/sig_ivar + args.noise_floor**2)
+        gpm = np.isfinite(sig) & (sig_ivar > 0) & np.isfinite(sig_ivar)
+        if kin.sig_mask is not None:
+            gpm &= np.logical_not(kin.sig_mask)
+        self.sig_bin = kin.bin_transform[gpm]
+        self.sig = sig[gpm]
+        self.sig_ivar = sig_ivar[gpm]
+        self.sig_norm = .25 * np.sum(np.log(2*np.pi * self.sig_ivar))
+        self._sig_res = np.empty(self.sig.size, dtype=float)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Replace the convolver with a flag to use the convolver of the
+        # unpickling process
+        state['cnvfftw'] = self.cnvfftw is not None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.cnvfftw = bisym_convolver(self.x.shape) if self.cnvfftw else None
+
+    def model(self, params):
+        """
+        Construct the beam-smeared velocity and dispersion maps.
+
+        This is identical to :func:`~nirvana.models.higher_order.bisym_model`
+        before any masking or binning.
+
+        Args:
+            params (array-like):
+                Parameters being fit, in the standard order (see
+                :func:`~nirvana.data.util.unpack`).
+
+        Returns:
+            :obj:`tuple`: The 2D velocity and velocity dispersion maps.  The
+            latter is None if the dispersion is not being fit.
+        """
+        params = np.asarray(params, dtype=float)
+        inc, pa, pab, vsys = params[:4]
+        xc, yc = params[4:6] if self.nglobs == 6 else (0., 0.)
+        start = self.nglobs
+        jump = self.jump
+        self._vt[self.fixcent:] = params[start:start+jump]
+        self._v2t[self.fixcent:] = params[start+jump:start+2*jump]
+        self._v2r[self.fixcent:] = params[start+2*jump:start+3*jump]
+
+        # Convert the angles and get the disk-plane coordinates; see unpack
+        # and bisym_model
+        inc, pa, pab = np.radians([inc, pa, (pab + pa) % 360])
+        pab = (pab - pa) % (2*np.pi)
+        r, th = projected_polar(self.x - xc, self.y - yc, pa, inc)
+
+        # Spekkens and Sellwood 2nd order velocity field model
+        vel = vsys + np.sin(inc) * (np.interp(r, self.edges, self._vt) * np.cos(th)
+                    - np.interp(r, self.edges, self._v2t) * np.cos(2 * (th - pab)) * np.cos(th)
+                    - np.interp(r, self.edges, self._v2r) * np.sin(2 * (th - pab)) * np.sin(th))
+        sig = np.interp(r, self.edges, params[start+3*jump:start+4*jump+self.fixcent]) \
+                if self.disp else None
+        if self.beam_fft is None:
+            return vel, sig
+        _, vel, sig = smear(vel, self.beam_fft, beam_fft=True, sb=self.sb, sig=sig,
+                            cnvfftw=self.cnvfftw, mom0=self.mom0)
+        return vel, sig
+
+    def __call__(self, params):
+        """
+        Compute the log likelihood.
+
+        Args:
+            params (array-like):
+                Parameters being fit, in the standard order (see
+                :func:`~nirvana.data.util.unpack`).
+
+        Returns:
+            :obj:`float`: Log likelihood value associated with parameters.
+        """
+        vel, sig = self.model(params)
+
+        # Velocity likelihood
+        res = self.vel_bin.dot(vel.ravel())
+        np.subtract(res, self.vel, out=self._vel_res)
+        np.square(self._vel_res, out=self._vel_res)
+        llike = self.vel_norm - .5 * np.dot(self._vel_res, self.vel_ivar)
+
+        # Penalty for non-smooth rotation curves
+        if self.weight != -1:
+            llike = llike - smoothing(self._vt, self.weight) \
+                          - smoothing(self._v2t, self.weight) \
+                          - smoothing(self._v2r, self.weight)
+
+        # Dispersion likelihood
+        if self.disp:
+            res = self.sig_bin.dot(sig.ravel())
+            if self.squared:
+                np.square(res, out=res)
+            np.subtract(res, self.sig, out=self._sig_res)
+            np.square(self._sig_res, out=self._sig_res)
+            llike += self.sig_norm - .5 * np.dot(self._sig_res, self.sig_ivar)
+            if self.weight != -1:
+                start = self.nglobs + 3*self.jump
+                llike -= smoothing(np.asarray(params[start:start+self.jump+self.fixcent]),
+                                   self.weight*.1)
+
+        # Penalty if 2nd order terms are too large
+        if self.penalty:
+            vtm = self._vt.mean()
+            llike -= self.penalty * (self._v2t.mean() - vtm)/vtm
+            llike -= self.penalty * (self._v2r.mean() - vtm)/vtm
+
+        return llike
+
+#: The fit state installed in each process of the :func:`fit` multiprocessing
+#: pool; see :func:`init_worker`.
+_worker = {}
+
+
+def init_worker(args, squared=False):
+    """
+    Initialize a process used to fit the bisymmetric model.
+
+    This is used as the ``initializer`` of the :class:`multiprocessing.Pool`
+    in :func:`fit`.  The fit arguments and the precomputed likelihood (see
+    :class:`BisymLikelihood`) are installed in the process globals once, when
+    the process is started, such that the likelihood and prior calls
+    distributed to the process (see :func:`worker_loglike` and
+    :func:`worker_ptform`) only need to send the parameters.  This also
+    constructs (and plans) the FFTW convolver used by the process; see
+    :func:`~nirvana.models.higher_order.bisym_convolver`.
+
+    Args:
+        args (:class:`~nirvana.data.fitargs.FitArgs`):
+            Object containing all of the data and settings needed for the
+            galaxy.  The bin edges and parameter bounds must be defined.
+        squared (:obj:`bool`, optional):
+            Whether to compute the chi squared against the square of the
+            dispersion profile or not.
+    """
+    _worker['args'] = args
+    _worker['like'] = BisymLikelihood(args, squared=squared,
+                                      cnvfftw=bisym_convolver(args.kin.spatial_shape))
+
+
+def worker_loglike(params):
+    """
+    Compute the log likelihood using the state installed by
+    :func:`init_worker`.
+
+    Args:
+        params (array-like):
+            Parameters being fit, in the standard order (see
+            :func:`~nirvana.data.util.unpack`).
+
+    Returns:
+        :obj:`float`: Log likelihood value associated with parameters.
+    """
+    return _worker['like'](params)
+
+
+def worker_ptform(params):
+    """
+    Compute the prior transform using the state installed by
+    :func:`init_worker`; see :func:`ptform`.
+
+    Args:
+        params (array-like):
+            Parameters being fit, in the standard order (see
+            :func:`~nirvana.data.util.unpack`).
+
+    Returns:
+        :obj:`list`: Parameter values transformed into the prior volume.
+    """
+    return ptform(params, _worker['args'])
+
+
 def fit(plate, ifu, galmeta = None, daptype='HYB10-MILESHC-MASTARHC2', dr='MPL-11', nbins=None,
         cores=10, maxr=None, cen=True, weight=10, smearing=True, points=500,
         stellar=False, root=None, verbose=False, disp=True, 
         fixcent=True, method='dynesty', remotedir=None, floor=5, penalty=100,
-        mock=None):
+        mock=None, checkpoint=None, checkpoint_every=600., resume=False):
     '''
     Main function for fitting a MaNGA galaxy with a nonaxisymmetric model.
 
@@ -318,6 +589,19 @@ def fit(plate, ifu, galmeta = None, daptype='HYB10-MILESHC-MASTARHC2', dr='MPL-1
             A tuple of the `params` and `args` objects output by
             :func:`nirvana.plotting.fileprep` to fit instead of real data. Can
             be used to fit a galaxy with known parameters for testing purposes.
+        checkpoint (:obj:`str`, optional):
+            File used to periodically save the state of the
+            :class:`dynesty.NestedSampler`, such that an interrupted fit can
+            be continued (see ``resume``).  If None, the state is not saved.
+        checkpoint_every (:obj:`float`, optional):
+            Wall time in seconds between saving the sampler state to the
+            ``checkpoint`` file.  The state is also saved at the end of the
+            run.
+        resume (:obj:`bool`, optional):
+            If the ``checkpoint`` file exists, restore the sampler from it and
+            continue the fit.  The fit arguments (i.e., the galaxy and the
+            fit settings) must be the same as those used for the interrupted
+            fit.  If the file does not exist, a new fit is started.
 
     Returns:
         :class:`dynesty.NestedSampler`: Sampler from `dynesty` containing
@@ -370,11 +654,6 @@ def fit(plate, ifu, galmeta = None, daptype='HYB10-MILESHC-MASTARHC2', dr='MPL-1
     if len(args.edges) - fixcent < 3:
         raise ValueError('Galaxy unsuitable: too few radial bins')
 
-    #define a variable for speeding up convolutions
-    #has to be a global because multiprocessing can't pickle cython
-    global conv
-    conv = ConvolveFFTW(args.kin.spatial_shape)
-
     #starting positions for all parameters based on a quick fit
     #not used in dynesty
     args.clip()
@@ -394,7 +673,7 @@ def fit(plate, ifu, galmeta = None, daptype='HYB10-MILESHC-MASTARHC2', dr='MPL-1
 
     #open up multiprocessing pool if needed
     if cores > 1 and method == 'dynesty':
-        pool = mp.Pool(cores)
+        pool = mp.Pool(cores, initializer=init_worker, initargs=(args,))
         pool.size = cores
     else: pool = None
 
@@ -412,11 +691,27 @@ def fit(plate, ifu, galmeta = None, daptype='HYB10-MILESHC-MASTARHC2', dr='MPL-1
         args.guess = lsqguess
 
     elif method == 'dynesty':
+        #install the fit arguments and the precomputed likelihood in this
+        #process; the pool processes install their own when they start, so
+        #only the parameters are sent with each likelihood and prior call
+        init_worker(args)
+
         #dynesty sampler with periodic pa and pab
-        sampler = dynesty.NestedSampler(loglike, ptform, ndim, nlive=points,
-                periodic=[1,2], pool=pool,
-                ptform_args = [args], logl_args = [args], verbose=verbose)
-        sampler.run_nested()
+        _resume = resume and checkpoint is not None and os.path.isfile(checkpoint)
+        if _resume:
+            #continue an interrupted fit; the checkpoint only includes the
+            #sampler state, not the fit arguments
+            print(f'Resuming fit from {checkpoint}')
+            sampler = dynesty.NestedSampler.restore(checkpoint, pool=pool)
+            if sampler.ndim != ndim:
+                if pool is not None: pool.close()
+                raise ValueError(f'Checkpoint file {checkpoint} is for a fit with {sampler.ndim} '
+                                 f'parameters, not {ndim}.')
+        else:
+            sampler = dynesty.NestedSampler(worker_loglike, worker_ptform, ndim, nlive=points,
+                    periodic=[1,2], pool=pool)
+        sampler.run_nested(print_progress=verbose, checkpoint_file=checkpoint,
+                           checkpoint_every=checkpoint_every, resume=_resume)
 
         if pool is not None: pool.close()
 
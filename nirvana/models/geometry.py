@@ -281,6 +281,91 @@ def deriv_projected_polar(x, y, pa, inc, dxdp=None, dydp=None, dpadp=None, dincd
     return r, t, dr, dt
 
 
+def deriv_disk_polar(x, y, xc, yc, pa, inc, free=None):
+    r"""
+    Calculate the in-plane polar coordinates of an inclined plane centered at
+    :math:`(x_c,y_c)` and their derivatives with respect to the geometric
+    parameters :math:`(x_c, y_c, \phi_0, i)`.
+
+    The result is identical to calling :func:`deriv_projected_polar` with
+    ``x-xc`` and ``y-yc`` and the derivatives set to select these four
+    parameters.  However, this function exploits the known structure of the
+    parameter dependence (e.g., the offset coordinates only depend on the
+    center and their derivatives are constant) to avoid constructing the
+    dense derivative arrays of the input coordinates.  Only the derivatives
+    with respect to the parameters selected by ``free`` are computed.
+
+    See additional documentation of the :func:`projected_polar` method.  The
+    same warning there about the calculation when :math:`i = \pi/2` holds for
+    the derivatives, as well.
+
+    Args:
+        x (array-like):
+            Cartesian x coordinates.
+        y (array-like):
+            Cartesian y coordinates.  Shape must match ``x``, but this is not
+            checked.
+        xc (:obj:`float`):
+            Cartesian x coordinate of the center.
+        yc (:obj:`float`):
+            Cartesian y coordinate of the center.
+        pa (:obj:`float`)
+            Position angle in radians; see :func:`projected_polar`.
+        inc (:obj:`float`)
+            Inclination in radians; see :func:`projected_polar`.
+        free (array-like, optional):
+            Boolean vector with four elements selecting the parameters
+            :math:`(x_c, y_c, \phi_0, i)` for which to compute the
+            derivatives.  If None, derivatives are computed for all four
+            parameters.
+
+    Returns:
+        :obj:`tuple`: Returns four arrays with the projected radius and in-plane
+        azimuth and their derivatives (order is radius, aziumth, radius
+        derivative, azimuth derivative).  The last axis of the derivative
+        arrays has one element for each selected parameter, ordered as listed
+        above; the derivatives with respect to :math:`\phi_0` and :math:`i`
+        are per radian.
+    """
+    _free = np.ones(4, dtype=bool) if free is None else np.atleast_1d(free).astype(bool)
+    if _free.size != 4:
+        raise ValueError('Must provide a flag for each of the four geometric parameters.')
+
+    # Rotate the coordinates.  The clockwise rotation by pi/2-pa used by
+    # projected_polar is a counter-clockwise rotation by pa-pi/2.
+    cosr = np.cos(pa - np.pi/2)
+    sinr = np.sin(pa - np.pi/2)
+    xd, yr = rotate(np.atleast_1d(x) - xc, np.atleast_1d(y) - yc, pa - np.pi/2)
+
+    # Project the y axis
+    cosi = np.cos(inc)
+    yd = yr / cosi
+
+    # Calculate the polar coordinates
+    r = np.sqrt(xd**2 + yd**2)
+    t = np.arctan2(-yd,xd) % (2*np.pi)
+
+    # Derivatives of the polar coordinates w.r.t. the deprojected coordinates
+    drdxd = drdx(xd, yd, r=r)
+    drdyd = drdy(xd, yd, r=r)
+    dtdxd = dthetadx(xd, -yd, r=r)
+    dtdyd = -dthetady(xd, -yd, r=r)
+
+    # Derivatives of the deprojected coordinates w.r.t. each parameter: the
+    # center offsets are constant, the position angle rotates the
+    # coordinates, and the inclination only affects the projected y axis.
+    dxd = [-cosr, sinr, -yr, 0.]
+    dyd = [-sinr/cosi, -cosr/cosi, xd/cosi, yd*np.tan(inc)]
+
+    nfree = np.sum(_free)
+    dr = np.empty(r.shape+(nfree,), dtype=float)
+    dt = np.empty(r.shape+(nfree,), dtype=float)
+    for j, i in enumerate(np.where(_free)[0]):
+        dr[...,j] = drdxd*dxd[i] + drdyd*dyd[i]
+        dt[...,j] = dtdxd*dxd[i] + dtdyd*dyd[i]
+    return r, t, dr, dt
+
+
 def drdx(x, y, r=None):
     r"""
     Compute the derivative of :math:`r=\sqrt{x^2+y^2}` w.r.t. :math:`x`.
@@ -1,10 +1,40 @@
 import numpy as np
 
-from .beam import smear, ConvolveFFTW
+from .beam import smear, get_convolver
 from ..data.util import unpack
 from .geometry import projected_polar
 
-def bisym_model(args, paramdict, plot=False, relative_pab=False):
+try:
+    import pyfftw
+except:
+    pyfftw = None
+
+
+def bisym_convolver(shape):
+    '''
+    Return the convolver used by :func:`bisym_model` in the calling process.
+
+    The convolver is a :class:`~nirvana.models.beam.ConvolveFFTW` instance
+    that uses the real-to-complex FFTW algorithms.  It is constructed the
+    first time it is requested by each process (see
+    :func:`~nirvana.models.beam.get_convolver`) and reused for all subsequent
+    model evaluations.  Because the instance cannot be pickled, processes in a
+    :class:`multiprocessing.Pool` must construct their own; see
+    :func:`nirvana.models.bisym.init_worker`.
+
+    Args:
+        shape (:obj:`tuple`):
+            Shape of the maps to be convolved.
+
+    Returns:
+        :class:`~nirvana.models.beam.ConvolveFFTW`: The convolver, or None if
+        pyfftw is not available, in which case the convolutions use the numpy
+        FFT routines.
+    '''
+    return None if pyfftw is None else get_convolver(shape, real=True)
+
+
+def bisym_model(args, paramdict, plot=False, relative_pab=False, cnvfftw=None):
     '''
     Evaluate a bisymmetric velocity field model for given parameters.
 
@@ -26,6 +56,10 @@ def bisym_model(args, paramdict, plot=False, relative_pab=False):
             Whether to define the second order position angle relative to the
             first order position angle (better for fitting) or absolutely
             (better for output).
+        cnvfftw (:class:`~nirvana.models.beam.ConvolveFFTW`, optional):
+            An object that expedites the beam-smearing convolutions using
+            FFTW/pyFFTW.  If None, the convolver for the calling process is
+            used; see :func:`bisym_convolver`.
 
     Returns:
         :obj:`tuple`: Tuple of two objects that are the model velocity field and
@@ -62,12 +96,12 @@ def bisym_model(args, paramdict, plot=False, relative_pab=False):
         sb = None
 
     #apply beam smearing if beam is given
-    try: conv
-    except: conv = None
     if args.kin.beam_fft is not None:
         if hasattr(args, 'smearing') and not args.smearing: pass
-        else: sbmodel, velmodel, sigmodel = smear(velmodel, args.kin.beam_fft, sb=sb, 
-                sig=sigmodel, beam_fft=True, cnvfftw=conv, verbose=False)
+        else:
+            if cnvfftw is None: cnvfftw = bisym_convolver(args.kin.spatial_shape)
+            sbmodel, velmodel, sigmodel = smear(velmodel, args.kin.beam_fft, sb=sb, 
+                sig=sigmodel, beam_fft=True, cnvfftw=cnvfftw, verbose=False)
 
     #remasking after convolution
     if args.kin.vel_mask is not None: velmodel = np.ma.array(velmodel, mask=args.kin.remap('vel_mask'))
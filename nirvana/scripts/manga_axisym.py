@@ -10,6 +10,7 @@ from matplotlib import pyplot
 
 from ..data import manga
 from ..models import axisym
+from ..util import timing
 
 # TODO: Setup a logger
 # TODO: Need to test different modes.
@@ -113,6 +114,13 @@ def parse_args(options=None):
                         help='After the initial rejection of S/N and error limits, find the '
                              'largest coherent region of adjacent spaxels and only fit that '
                              'region.')
+    parser.add_argument('--threads', default=1, type=int,
+                        help='Number of threads used by the FFTW convolutions.  Using more '
+                             'threads is most useful for the largest IFUs.')
+    parser.add_argument('--timing', default=False, action='store_true',
+                        help='Record the wall time and number of calls for each step of the fit.  '
+                             'The result is reported after each fit iteration and written to '
+                             'the TIMING extension of the output file.')
     parser.add_argument('--screen', default=False, action='store_true',
                         help='Indicate that the script is being run behind a screen (used to set '
                              'matplotlib backend).') 
@@ -176,6 +184,8 @@ def main(args):
     #---------------------------------------------------------------------------
 
     # Run the iterative fit
+    if args.timing:
+        timing.enable()
     disk, p0, fix, vel_mask, sig_mask \
             = axisym.axisym_iter_fit(galmeta, kin, rctype=args.rc, dctype=args.dc,
                                      fitdisp=args.disp, ignore_covar=not args.covar,
@@ -185,7 +195,7 @@ def main(args):
                                      fix_cen=args.fix_cen, fix_inc=args.fix_inc,
                                      low_inc=args.low_inc, min_unmasked=args.min_unmasked,
                                      select_coherent=args.coherent, fit_scatter=args.fit_scatter,
-                                     verbose=args.verbose)
+                                     verbose=args.verbose, threads=args.threads)
 
     # Plot the final residuals
     dv_plot = os.path.join(args.odir, f'{oroot}-vdist.png')
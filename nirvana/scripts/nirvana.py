@@ -74,6 +74,14 @@ def parse_args(options=None):
                         help='change the inclination of the mock galaxy')
     parser.add_argument('--resid', type=str, default='',
                         help='Resuidual from residlib to add on top of vel')
+    parser.add_argument('--resume', default=False, action='store_true',
+                        help='Continue an interrupted fit from its checkpoint file, if it '
+                             'exists.  The fit arguments must be the same as those used for the '
+                             'interrupted fit.')
+    parser.add_argument('--checkpoint', type=float, default=10.,
+                        help='Wall time in minutes between saving the state of the sampler to '
+                             'a checkpoint file in the output directory.  The file is removed '
+                             'once the fit is complete.  Set to 0 to turn off checkpointing.')
 
     return parser.parse_args() if options is None else parser.parse_args(options)
 
@@ -117,6 +125,7 @@ def main(args):
 
     fname = args.dir + args.outfile + '.nirv'
     galname = args.dir + args.outfile + '.gal'
+    ckptname = None if args.checkpoint <= 0 else args.dir + args.outfile + '.ckpt'
     fitsname = f"{args.dir}nirvana_{plate}-{ifu}_{vftype}"
     if args.mock:
         fitsname += '_mock'
@@ -151,11 +160,14 @@ def main(args):
                   weight=args.weight, maxr=args.maxr, smearing=args.smearing, root=args.root,
                   verbose=args.verbose, disp=args.disp, points=args.points, 
                   stellar=args.stellar, cen=args.cen, fixcent=args.fixcent,
-                  remotedir=args.remote, mock=mock, penalty=args.penalty)
+                  remotedir=args.remote, mock=mock, penalty=args.penalty,
+                  checkpoint=ckptname, checkpoint_every=60*args.checkpoint, resume=args.resume)
 
     #write out with sampler results or just FITS table
     pickle.dump(samp.results, open(fname, 'wb'))
     pickle.dump(gal, open(galname, 'wb'))
+    if ckptname is not None and os.path.isfile(ckptname):
+        os.remove(ckptname)
     if args.fits: 
         try:
             imagefits(fname, galmeta, gal, outfile=fitsname, remotedir=args.remote) 
@@ -7,7 +7,8 @@ from scipy import stats, special
 from nirvana.data import manga
 from nirvana.data import util
 from nirvana.data import scatter
-from nirvana.tests.util import remote_data_file, requires_remote
+from nirvana.data.kinematics import Kinematics
+from nirvana.tests.util import remote_data_file, requires_remote, requires_pyfftw
 from nirvana.models.oned import HyperbolicTangent, Exponential
 from nirvana.models.axisym import AxisymmetricDisk
 from nirvana.models.beam import gauss2d_kernel, ConvolveFFTW
@@ -155,6 +156,221 @@ def test_disk_derivative():
                 f'Finite difference produced different sigma derivative for parameter {i+1}!'
 
 
+def _synthetic_kin(n=51, radius=8):
+    """
+    Construct a synthetic, beam-smeared velocity field, only selecting a small
+    region to fit.
+    """
+    x = numpy.arange(n, dtype=float)[::-1] - n//2
+    y = numpy.arange(n, dtype=float) - n//2
+    x, y = numpy.meshgrid(x, y)
+    sb = numpy.exp(-numpy.sqrt(x**2 + y**2)/8)
+    psf = gauss2d_kernel(n, 2.)
+    disk = AxisymmetricDisk(rc=HyperbolicTangent(), dc=Exponential())
+    p0 = numpy.array([0.5, -0.3, 45., 50., 10., 200., 5., 100., 20.])
+    v, s = disk.model(p0, x=x, y=y, sb=sb, beam=psf)
+    mask = numpy.sqrt((x - 4)**2 + y**2) > radius
+    return p0, Kinematics(v, vel_ivar=numpy.ones_like(v), vel_mask=mask, sig=s,
+                          sig_ivar=numpy.ones_like(v), sig_mask=mask, sb=sb, x=x, y=y,
+                          grid_x=x, grid_y=y, psf=psf)
+
+
+def test_disk_fit_crop():
+    n = 51
+    p0, kin = _synthetic_kin(n=n)
+    p = p0*1.02
+    disk = AxisymmetricDisk(rc=HyperbolicTangent(), dc=Exponential())
+    disk._fit_prep(kin, p, None, None, True, True, True, None, crop=False, sparse_beam=False)
+    assert disk.crop is None and disk.beam_matrix is None, 'Should convolve the full map'
+    chi = disk._get_fom()(p)
+    dchi = disk._get_jac()(p)
+    disk._fit_prep(kin, p, None, None, True, True, True, None, sparse_beam=False)
+    assert disk.crop is not None and disk.crop[0].size < n, 'Should crop'
+    assert numpy.allclose(chi, disk._get_fom()(p), rtol=0., atol=1e-6), \
+            'Cropping changed the figure-of-merit'
+    assert numpy.allclose(dchi, disk._get_jac()(p), rtol=0., atol=1e-6), \
+            'Cropping changed the Jacobian'
+    disk._fit_prep(kin, p, None, None, True, True, True, None, sparse_beam=True)
+    assert disk.crop is None and disk.beam_matrix is not None, 'Should use sparse matrix'
+    assert numpy.allclose(chi, disk._get_fom()(p), rtol=0., atol=1e-5), \
+            'Sparse convolution changed the figure-of-merit'
+    assert numpy.allclose(dchi, disk._get_jac()(p), rtol=0., atol=1e-5), \
+            'Sparse convolution changed the Jacobian'
+
+
+def test_disk_fit_failure():
+    p0, kin = _synthetic_kin()
+    p = p0*1.02
+    disk = AxisymmetricDisk(rc=HyperbolicTangent(), dc=Exponential())
+    v, s = disk.model(p, x=kin.grid_x, y=kin.grid_y, sb=kin.grid_sb, beam=kin.beam_fft,
+                      is_fft=True)
+
+    # Force the fit to fail after the convolution domain is cropped
+    def fom(par):
+        assert disk.crop is not None, 'Should crop'
+        raise ValueError('Fit failed')
+    disk._get_fom = lambda: fom
+    try:
+        disk.lsq_fit(kin, sb_wgt=True, p0=p, sparse_beam=False)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('Fit should have failed')
+    assert disk.crop is None and disk.beam_matrix is None, 'Should revert to the full map'
+    assert not disk.fuse_deriv, 'Should revert to computing the model without derivatives'
+    _v, _s = disk.model(p)
+    assert numpy.allclose(v, _v) and numpy.allclose(s, _s), 'Model should not change'
+
+    # Resetting the coordinates should also reset the convolution domain
+    del disk._get_fom
+    disk._fit_prep(kin, p, None, None, True, True, True, None, sparse_beam=False)
+    assert disk.crop is not None, 'Should crop'
+    _v, _s = disk.model(p, x=kin.grid_x, y=kin.grid_y)
+    assert disk.crop is None, 'Should revert to the full map'
+    assert numpy.allclose(v, _v) and numpy.allclose(s, _s), 'Model should not change'
+
+
+@requires_pyfftw
+def test_disk_fit_pad():
+    p0, kin = _synthetic_kin()
+    p = p0*1.02
+    disk = AxisymmetricDisk(rc=HyperbolicTangent(), dc=Exponential())
+    disk._fit_prep(kin, p, None, None, True, True, True, None, crop=False, sparse_beam=False)
+    chi = disk._get_fom()(p)
+    dchi = disk._get_jac()(p)
+    # The fitted region is far enough from the map edges that the linear
+    # convolutions are identical to the circular ones
+    kin.pad_beam = True
+    disk._fit_prep(kin, p, None, None, True, True, True, None)
+    assert disk.cnvfftw.pad and disk.cnvfftw.grid_shape == (63,63), 'Should pad'
+    assert disk.crop is None and disk.beam_matrix is None, 'Should convolve the full map'
+    assert numpy.allclose(chi, disk._get_fom()(p), rtol=0., atol=1e-6), \
+            'Padding changed the figure-of-merit'
+    assert numpy.allclose(dchi, disk._get_jac()(p), rtol=0., atol=1e-6), \
+            'Padding changed the Jacobian'
+    kin.pad_beam = False
+    disk._fit_prep(kin, p, None, None, True, True, True, None)
+    assert not disk.cnvfftw.pad, 'Should not pad'
+
+
+def test_disk_fused_model():
+    p0, kin = _synthetic_kin()
+    p = p0*1.02
+    disk = AxisymmetricDisk(rc=HyperbolicTangent(), dc=Exponential())
+    disk._fit_prep(kin, p, None, None, True, True, True, None)
+    ncalls = {'model': 0, 'deriv_model': 0}
+    def count(f):
+        def wrapper(*args, **kwargs):
+            ncalls[f.__name__] += 1
+            return f(*args, **kwargs)
+        return wrapper
+    disk.model = count(disk.model)
+    disk.deriv_model = count(disk.deriv_model)
+    chi = disk._get_fom()(p)
+    assert ncalls['model'] == 1 and ncalls['deriv_model'] == 0, \
+            'Derivatives should only be computed when requested'
+    dchi = disk._get_jac()(p)
+    disk._get_jac()(p)
+    disk._get_fom()(p)
+    assert ncalls['model'] == 1 and ncalls['deriv_model'] == 1, \
+            'Should use the cached model and derivatives'
+
+    disk._fit_prep(kin, p, None, None, True, True, True, None, fuse_deriv=True)
+    ncalls = {'model': 0, 'deriv_model': 0}
+    assert numpy.allclose(chi, disk._get_fom()(p)), 'Fused model changed the figure-of-merit'
+    assert numpy.allclose(dchi, disk._get_jac()(p)), 'Fused model changed the Jacobian'
+    assert ncalls['model'] == 0 and ncalls['deriv_model'] == 1, \
+            'Jacobian should use the cached model'
+    disk._get_fom()(p*1.01)
+    disk._get_fom()(p*1.01)
+    assert ncalls['deriv_model'] == 2, 'Model should only be recomputed for new parameters'
+
+
+def test_disk_deriv_free():
+    n = 51
+    x = numpy.arange(n, dtype=float)[::-1] - n//2
+    y = numpy.arange(n, dtype=float) - n//2
+    x, y = numpy.meshgrid(x, y)
+    sb = numpy.exp(-numpy.sqrt(x**2 + y**2)/8)
+    psf = gauss2d_kernel(n, 2.)
+    p0 = numpy.array([0.5, -0.3, 45., 50., 10., 200., 5., 100., 20.])
+    disk = AxisymmetricDisk(rc=HyperbolicTangent(), dc=Exponential())
+    v, s, dv, ds = disk.deriv_model(p0, x=x, y=y, sb=sb, beam=psf)
+
+    # Fix the center, inclination, and one parameter of each radial profile
+    fix = numpy.zeros(disk.np, dtype=bool)
+    fix[[0,1,3,6,8]] = True
+    disk._init_par(p0, fix)
+    _v, _s, _dv, _ds = disk.deriv_model(free=True)
+    assert _dv.shape[-1] == disk.nfree and _ds.shape[-1] == disk.nfree, 'Bad derivative shape'
+    assert numpy.allclose(v, _v) and numpy.allclose(s, _s), 'Model should not change'
+    assert numpy.allclose(dv[...,disk.free], _dv) and numpy.allclose(ds[...,disk.free], _ds), \
+            'Free-parameter derivatives are different'
+
+
+def test_disk_warm_start():
+    p0, kin = _synthetic_kin()
+    rng = numpy.random.default_rng(99)
+    kin.vel += rng.normal(size=kin.vel.size)
+    kin.sig += rng.normal(size=kin.sig.size)
+    disk = AxisymmetricDisk(rc=HyperbolicTangent(), dc=Exponential())
+    disk.lsq_fit(kin, sb_wgt=True, p0=p0*1.02, sparse_beam=True)
+    assert disk.beam_matrix is None, 'Should revert to convolving the full map'
+    beam_matrix = disk._fit_domain[1][3]
+    assert beam_matrix is not None, 'Should keep the sparse beam matrix'
+
+    # Reject a few measurements and refit
+    gpm = numpy.where(numpy.logical_not(kin.vel_mask))[0]
+    kin.reject(vel_rej=numpy.isin(numpy.arange(kin.vel.size), gpm[::20]),
+               sig_rej=numpy.isin(numpy.arange(kin.sig.size), gpm[::20]))
+    disk._fit_prep(kin, disk.par, None, None, True, True, True, None, sparse_beam=True)
+    assert disk.beam_matrix is beam_matrix, 'Sparse beam matrix should be reused'
+    disk.lsq_fit(kin, sb_wgt=True, p0=disk.par, sparse_beam=True, warm_start=True)
+
+    # Changing the surface brightness in-place should force it to be reset
+    sb = disk.sb.copy()
+    kin.grid_sb *= 2
+    disk._fit_prep(kin, disk.par, None, None, True, True, True, None, sparse_beam=True)
+    assert numpy.allclose(disk.sb, 2*sb), 'Surface brightness should be reset'
+    kin.grid_sb /= 2
+
+    # Compare to a fit from scratch
+    _disk = AxisymmetricDisk(rc=HyperbolicTangent(), dc=Exponential())
+    _disk.lsq_fit(kin, sb_wgt=True, p0=p0*1.02, sparse_beam=True)
+    assert numpy.allclose(disk.par, _disk.par, rtol=1e-5), 'Warm-started fit is different'
+
+
+def test_disk_mom0():
+    n = 51
+    x = numpy.arange(n, dtype=float)[::-1] - n//2
+    y = numpy.arange(n, dtype=float) - n//2
+    x, y = numpy.meshgrid(x, y)
+    sb = numpy.exp(-numpy.sqrt(x**2 + y**2)/8)
+    psf = gauss2d_kernel(n, 2.)
+    p0 = numpy.array([0.5, -0.3, 45., 50., 10., 200., 5., 100., 20.])
+    disk = AxisymmetricDisk(rc=HyperbolicTangent(), dc=Exponential())
+    v, s = disk.model(p0, x=x, y=y, sb=sb, beam=psf)
+    assert disk.mom0 is not None, 'Zeroth moment should be cached'
+    mom0 = disk.mom0
+    disk.model(p0*1.01)
+    assert disk.mom0 is mom0, 'Zeroth moment should be reused'
+    v, s, dv, ds = disk.deriv_model(p0)
+    assert disk.mom0 is mom0, 'Zeroth moment should be reused'
+
+    # Changing the surface brightness resets the cache
+    _v, _s = disk.model(p0, sb=sb**2)
+    assert disk.mom0 is not mom0, 'Zeroth moment should have been reset'
+    _disk = AxisymmetricDisk(rc=HyperbolicTangent(), dc=Exponential())
+    __v, __s = _disk.model(p0, x=x, y=y, sb=sb**2, beam=psf)
+    assert numpy.allclose(_v, __v) and numpy.allclose(_s, __s), 'Bad model after sb change'
+
+    # Compare to the direct calculation
+    _disk = AxisymmetricDisk(rc=HyperbolicTangent(), dc=Exponential())
+    _v, _s, _dv, _ds = _disk.deriv_model(p0, x=x, y=y, sb=sb, beam=psf)
+    assert numpy.allclose(v, _v) and numpy.allclose(dv, _dv) and numpy.allclose(ds, _ds), \
+            'Cached zeroth moment changed the model'
+
+
 @requires_remote
 def test_disk_derivative_bin():
 
@@ -3,6 +3,7 @@ from IPython import embed
 
 import numpy
 
+from scipy import signal
 from astropy import convolution
 
 from nirvana.models import beam
@@ -114,3 +115,337 @@ def test_smear():
     assert numpy.allclose(vel_smear, _vel_smear), 'SB+Vel+Sig convolution difference in vel.'
     assert numpy.allclose(sig_smear, _sig_smear), 'SB+Vel+Sig convolution difference in sig.'
 
+
+@requires_pyfftw
+def test_fft_stack():
+    n = 51
+    synth = beam.gauss2d_kernel(n, 3.)
+    synth_fft = numpy.fft.fftn(numpy.fft.ifftshift(synth))
+    _convolve_fft = beam.ConvolveFFTW(synth.shape)
+
+    rng = numpy.random.default_rng(99)
+    stack = rng.normal(size=(n,n,5))
+    cnv = numpy.stack([beam.convolve_fft(stack[...,i], synth) for i in range(stack.shape[-1])],
+                      axis=-1)
+
+    # Compare numpy convolution of each image to the stacked convolution
+    _cnv = beam.convolve_fft(stack, synth)
+    assert numpy.allclose(cnv, _cnv, rtol=0., atol=1e-14), 'Difference for stacked numpy'
+
+    # Compare numpy to FFTW stacked convolution
+    _cnv = _convolve_fft(stack, synth_fft, kernel_fft=True)
+    assert numpy.allclose(cnv, _cnv, rtol=0., atol=1e-14), 'Difference for stacked FFTW'
+
+    # Workspace is reused for stacks of the same size
+    assert list(_convolve_fft.stack.keys()) == [5], 'Incorrect stack workspaces'
+    _cnv = _convolve_fft(stack[...,:2].copy(), synth_fft, kernel_fft=True)
+    assert numpy.allclose(cnv[...,:2], _cnv, rtol=0., atol=1e-14), 'Difference for stacked FFTW'
+    assert sorted(_convolve_fft.stack.keys()) == [2, 5], 'Incorrect stack workspaces'
+
+
+@requires_pyfftw
+def test_rfft():
+    n = 50
+    synth = beam.gauss2d_kernel(n, 3.)
+    synth_fft = numpy.fft.fftn(numpy.fft.ifftshift(synth))
+    synth_rfft = numpy.fft.rfftn(numpy.fft.ifftshift(synth))
+    assert synth_rfft.shape == beam.half_spectrum_shape(synth.shape), 'Bad half-spectrum shape'
+    assert numpy.allclose(beam.kernel_fft_form(synth_fft, synth.shape, True), synth_rfft), \
+            'Bad conversion to half spectrum'
+    assert numpy.allclose(beam.kernel_fft_form(synth_rfft, synth.shape, False), synth_fft), \
+            'Bad conversion to full spectrum'
+
+    # Compare numpy with full vs. half spectrum
+    synth2 = beam.convolve_fft(synth, synth)
+    _synth2 = beam.convolve_fft(synth, synth_rfft, kernel_fft=True)
+    assert numpy.allclose(synth2, _synth2), 'Difference if half spectrum is passed for numpy'
+    _synth2 = beam.convolve_fft(synth, synth, real=True)
+    assert numpy.allclose(synth2, _synth2), 'Difference if real FFT is used by numpy'
+
+    # Compare complex and real FFTW
+    _convolve_fft = beam.ConvolveFFTW(synth.shape, real=True)
+    assert _convolve_fft.fft(synth, shift=True).shape == synth_rfft.shape, \
+            'FFTW should return half spectrum'
+    _synth2 = _convolve_fft(synth, synth)
+    assert numpy.allclose(synth2, _synth2), 'Difference between numpy and real FFTW'
+    _synth2 = _convolve_fft(synth, synth_fft, kernel_fft=True)
+    assert numpy.allclose(synth2, _synth2), 'Difference if full spectrum is passed to real FFTW'
+    _synth2 = _convolve_fft(synth, synth_rfft, kernel_fft=True)
+    assert numpy.allclose(synth2, _synth2), 'Difference if half spectrum is passed to real FFTW'
+
+    # Smearing with the half spectrum
+    vel_smear = beam.smear(synth, synth)[1]
+    _vel_smear = beam.smear(synth, synth_rfft, beam_fft=True, cnvfftw=_convolve_fft)[1]
+    assert numpy.allclose(vel_smear, _vel_smear), 'Smearing difference with the half spectrum'
+
+
+
+@requires_pyfftw
+def test_fftw_wisdom(tmp_path):
+    path = str(tmp_path)
+    shape = (37,37)
+    key = beam.fftw_wisdom_key(shape, 'float64', ('FFTW_MEASURE',))
+    assert key == '37x37_float64_FFTW_MEASURE.wisdom', 'Bad wisdom file name'
+
+    # Force the write, even if wisdom for this shape was already saved
+    beam._fftw_wisdom_keys.discard(key)
+    beam.ConvolveFFTW(shape, real=True)
+    ofile = beam.save_fftw_wisdom(shape, 'float64', ('FFTW_MEASURE',), path=path)
+    assert ofile == str(tmp_path / key), 'Bad wisdom file'
+    assert [f.name for f in tmp_path.iterdir()] == [key], 'Temporary file not replaced'
+    ofile = beam.save_fftw_wisdom(shape, 'float64', ('FFTW_MEASURE',), path=path)
+    assert ofile is None, 'Wisdom should only be written once per set of plans'
+    assert beam.load_fftw_wisdom(path=path) == [key], 'Wisdom not loaded'
+
+
+
+@requires_pyfftw
+def test_fftw_wisdom_path(tmp_path, monkeypatch):
+    # The cache is disabled by default
+    monkeypatch.delenv('NIRVANA_FFTW_WISDOM', raising=False)
+    assert beam.fftw_wisdom_path() is None, 'Cache should be disabled'
+    assert beam.load_fftw_wisdom() == [], 'Nothing should be loaded'
+
+    shape = (39,39)
+    key = beam.fftw_wisdom_key(shape, 'float64', ('FFTW_MEASURE',))
+    beam._fftw_wisdom_keys.discard(key)
+    beam.ConvolveFFTW(shape, real=True)
+    assert key not in beam._fftw_wisdom_keys, 'Wisdom should not be saved'
+
+    # Use the environmental variable
+    monkeypatch.setenv('NIRVANA_FFTW_WISDOM', str(tmp_path / 'env'))
+    assert beam.fftw_wisdom_path() == str(tmp_path / 'env'), 'Bad wisdom path'
+    beam.ConvolveFFTW(shape, real=True)
+    assert (tmp_path / 'env' / key).is_file(), 'Wisdom not saved'
+
+    # An explicit path takes precedence
+    beam._fftw_wisdom_keys.discard(key)
+    try:
+        assert beam.set_fftw_wisdom_path(str(tmp_path)) == [], 'Nothing should be loaded'
+        assert beam.fftw_wisdom_path() == str(tmp_path), 'Bad wisdom path'
+        beam.ConvolveFFTW(shape, real=True)
+        assert (tmp_path / key).is_file(), 'Wisdom not saved'
+    finally:
+        beam.set_fftw_wisdom_path(None)
+    assert beam.fftw_wisdom_path() == str(tmp_path / 'env'), 'Bad wisdom path'
+
+
+@requires_pyfftw
+def test_get_convolver():
+    beam.clear_convolvers()
+    cnv = beam.get_convolver((31,31), real=True)
+    assert cnv is beam.get_convolver((31,31), real=True), 'Convolver should be reused'
+    assert cnv is not beam.get_convolver((31,31)), 'Complex and real convolvers should differ'
+    assert cnv is not beam.get_convolver((33,33), real=True), 'Shapes should differ'
+
+    # Each thread has its own registry
+    import threading
+    other = []
+    t = threading.Thread(target=lambda: other.append(beam.get_convolver((31,31), real=True)))
+    t.start()
+    t.join()
+    assert other[0] is not cnv, 'Convolver should not be shared across threads'
+
+    beam.clear_convolvers()
+    assert cnv is not beam.get_convolver((31,31), real=True), 'Registry should be cleared'
+
+
+@requires_pyfftw
+def test_fftw_threads():
+    synth = beam.gauss2d_kernel(73, 3.)
+    synth2 = beam.convolve_fft(synth, synth)
+    _convolve_fft = beam.ConvolveFFTW(synth.shape, real=True, threads=2)
+    assert _convolve_fft.threads == 2, 'Bad number of threads'
+    assert numpy.allclose(synth2, _convolve_fft(synth, synth)), 'Difference with threads'
+    assert beam.get_convolver(synth.shape, real=True, threads=2) \
+            is not beam.get_convolver(synth.shape, real=True), 'Threads should be in the key'
+    assert beam.fftw_wisdom_key(synth.shape, 'float64', ('FFTW_MEASURE',), threads=2) \
+            == '73x73_float64_FFTW_MEASURE_t2.wisdom', 'Bad wisdom file name'
+
+
+def test_convolution_crop():
+    assert beam.smooth_fft_size(97) == 98, 'Bad FFT-friendly size'
+    assert beam.smooth_fft_size(64) == 64, 'Size is already FFT-friendly'
+
+    n = 74
+    synth = beam.gauss2d_kernel(n, 2.)
+    support = beam.beam_support(synth)
+    assert numpy.all(support == support[0]) and support[0] < n//2, 'Bad beam support'
+
+    # Region of interest near the edge, such that the box wraps around it
+    x, y = numpy.meshgrid(*(numpy.arange(n, dtype=float),)*2)
+    gpm = numpy.sqrt((x - 3)**2 + (y - n/2)**2) < 10
+    crop = beam.convolution_crop(gpm, support)
+    shape = tuple([c.size for c in crop])
+    assert all([m < n for m in shape]), 'Box should be smaller than the image'
+    assert numpy.any(crop[1] > n//2) and numpy.any(crop[1] < n//2), 'Box should wrap'
+
+    rng = numpy.random.default_rng(99)
+    img = rng.uniform(size=(n,n))
+    full = beam.convolve_fft(img, synth)
+    _img = img[numpy.ix_(*crop)]
+    cropped = numpy.zeros_like(full)
+    cropped[numpy.ix_(*crop)] = beam.convolve_fft(_img, beam.crop_kernel(synth, shape))
+    assert numpy.allclose(full[gpm], cropped[gpm], rtol=0., atol=1e-10), \
+            'Cropped convolution does not match within the region of interest'
+
+    assert beam.convolution_crop(numpy.ones((n,n), dtype=bool), support) is None, \
+            'Should not crop if the region of interest is the full image'
+
+
+def _linear_convolution(data, kernel):
+    """
+    Linear convolution of an image with a kernel of the same shape, with the
+    kernel center at pixel n//2 along each axis.
+    """
+    n = data.shape
+    return signal.fftconvolve(data, kernel, mode='full')[tuple([slice(m//2, m//2+m) for m in n])]
+
+
+def _crop_support(kernel, support):
+    """
+    Set all kernel values beyond the support to 0.
+    """
+    _kernel = numpy.zeros_like(kernel)
+    box = tuple([slice(n//2-s, n//2+s+1) for n, s in zip(kernel.shape, support)])
+    _kernel[box] = kernel[box]
+    return _kernel
+
+
+def test_fft_pad():
+    assert beam.fft_pad_shape((74,74)) == (112,112), 'Bad padded shape'
+    assert beam.fft_pad_shape((33,44)) == (49,70), 'Bad padded shape'
+    assert beam.fft_pad_shape((74,74), support=(12,12)) == (90,90), 'Bad padded shape'
+    n = 74
+    synth = beam.gauss2d_kernel(n, 2.)
+    assert numpy.array_equal(beam.pad_kernel(synth, (75,75))[:n,:n], synth), \
+            'Padded kernel should keep the same center'
+
+    # The padded convolution should be identical to the linear convolution,
+    # including near the image edges
+    rng = numpy.random.default_rng(99)
+    kernel = beam.gauss2d_kernel(n, 8.)
+    synth_rfft = numpy.fft.rfftn(numpy.fft.ifftshift(kernel))
+    for _n in [n, n-1]:
+        img = rng.uniform(size=(_n,_n))
+        _kernel = kernel[:_n,:_n]
+        lin = _linear_convolution(img, _kernel)
+        assert numpy.allclose(lin, beam.convolve_fft(img, _kernel, pad=True), rtol=0., atol=1e-12), \
+                'Padded convolution is not linear'
+        assert not numpy.allclose(lin, beam.convolve_fft(img, _kernel), rtol=0., atol=1e-3), \
+                'Unpadded convolution should wrap around the image edges'
+    assert numpy.allclose(_linear_convolution(img, kernel[:n-1,:n-1]),
+                          beam.convolve_fft(img, kernel[:n-1,:n-1], pad=True, real=True),
+                          rtol=0., atol=1e-12), 'Bad real-to-complex padded convolution'
+    img = rng.uniform(size=(n,n))
+    assert numpy.allclose(_linear_convolution(img, kernel),
+                          beam.convolve_fft(img, synth_rfft, kernel_fft=True, pad=True),
+                          rtol=0., atol=1e-12), 'Bad padded convolution with kernel FFT'
+
+    # For a compact kernel, the padding only needs to include the kernel
+    # support
+    kernel = beam.gauss2d_kernel(n, 2.)
+    support = beam.beam_support(kernel)
+    assert numpy.array_equal(support, [12,12]), 'Bad support'
+    lin = _linear_convolution(img, _crop_support(kernel, support))
+    for real in [True, False]:
+        assert numpy.allclose(lin, beam.convolve_fft(img, kernel, pad=True, real=real),
+                              rtol=0., atol=1e-12), 'Bad padded convolution for compact kernel'
+
+
+@requires_pyfftw
+def test_fftw_pad():
+    n = 74
+    rng = numpy.random.default_rng(99)
+    kernel = beam.gauss2d_kernel(n, 8.)
+    synth_rfft = numpy.fft.rfftn(numpy.fft.ifftshift(kernel))
+    img = rng.uniform(size=(n,n))
+    lin = _linear_convolution(img, kernel)
+
+    for real in [True, False]:
+        _convolve_fft = beam.ConvolveFFTW(kernel.shape, real=real, pad=True)
+        assert _convolve_fft.grid_shape == (112,112), 'Bad padded shape'
+        assert numpy.allclose(lin, _convolve_fft(img, kernel), rtol=0., atol=1e-12), \
+                'Padded FFTW convolution is not linear'
+        assert numpy.allclose(lin, _convolve_fft(img, synth_rfft, kernel_fft=True),
+                              rtol=0., atol=1e-12), 'Difference with unpadded kernel FFT'
+        kfft = _convolve_fft.fft_kernel(kernel)
+        assert kfft.shape == _convolve_fft.fft_shape, 'Bad kernel FFT shape'
+        assert numpy.allclose(lin, _convolve_fft(img, kfft, kernel_fft=True),
+                              rtol=0., atol=1e-12), 'Difference with padded kernel FFT'
+        stack = numpy.stack([img, 2*img], axis=-1)
+        assert numpy.allclose(2*lin, _convolve_fft(stack, kfft, kernel_fft=True)[...,1],
+                              rtol=0., atol=1e-12), 'Difference for padded stack'
+
+    # Only pad by the support of a compact kernel
+    kernel = beam.gauss2d_kernel(n, 2.)
+    support = beam.beam_support(kernel)
+    lin = _linear_convolution(img, _crop_support(kernel, support))
+    for real in [True, False]:
+        _convolve_fft = beam.ConvolveFFTW(kernel.shape, real=real, pad=True, support=support)
+        assert _convolve_fft.grid_shape == (90,90), 'Bad padded shape'
+        assert numpy.allclose(lin, _convolve_fft(img, kernel), rtol=0., atol=1e-12), \
+                'Padded FFTW convolution is not linear'
+        kfft = _convolve_fft.fft_kernel(kernel)
+        assert numpy.allclose(lin, _convolve_fft(img, kfft, kernel_fft=True),
+                              rtol=0., atol=1e-12), 'Difference with padded kernel FFT'
+        # Beyond the image edges, the smearing is normalized by the zeroth
+        # moment
+        mom0 = _linear_convolution(numpy.ones_like(img), _crop_support(kernel, support))
+        assert numpy.allclose(lin/mom0,
+                              beam.smear(img, kfft, beam_fft=True, cnvfftw=_convolve_fft)[1],
+                              rtol=0., atol=1e-12), 'Bad smearing with padded beam FFT'
+
+
+
+def test_sparse_beam():
+    n = 51
+    synth = beam.gauss2d_kernel(n, 1.5)
+    x, y = numpy.meshgrid(*(numpy.arange(n, dtype=float),)*2)
+    # Include pixels near the edge to test the wrapping
+    gpm = (numpy.sqrt((x - 5)**2 + (y - 25)**2) < 8) | (x > n - 3)
+    sparse_beam = beam.SparseBeam(synth, gpm)
+    assert sparse_beam.matrix.shape == (numpy.sum(gpm), n*n), 'Bad matrix shape'
+
+    rng = numpy.random.default_rng(99)
+    img = rng.uniform(size=(n,n))
+    cnv = sparse_beam(img)
+    assert numpy.allclose(cnv[gpm], beam.convolve_fft(img, synth)[gpm]), \
+            'Sparse convolution is different from FFT'
+    assert numpy.all(cnv[numpy.logical_not(gpm)] == 0.), 'Should only fill the selected pixels'
+
+    stack = numpy.stack([img, 2*img], axis=-1)
+    assert numpy.allclose(sparse_beam(stack)[...,1], 2*cnv), 'Bad stack convolution'
+
+    # Use in smear
+    sb = beam.gauss2d_kernel(n, 10.)
+    v, sig = x - n//2, numpy.full((n,n), 50.)
+    vel_smear, sig_smear = beam.smear(v, synth, sb=sb, sig=sig)[1:]
+    _vel_smear, _sig_smear = beam.smear(v, synth, sb=sb, sig=sig, cnvfftw=sparse_beam)[1:]
+    assert numpy.allclose(vel_smear[gpm], _vel_smear[gpm]), 'Bad sparse smearing'
+    assert numpy.allclose(sig_smear[gpm], _sig_smear[gpm]), 'Bad sparse smearing'
+
+    assert beam.sparse_beam_preferred(gpm, synth), 'Sparse matrix should be faster'
+    assert not beam.sparse_beam_preferred(numpy.ones((n,n), dtype=bool), synth), \
+            'FFT should be faster'
+
+
+def test_zeroth_moment():
+    n = 51
+    synth = beam.gauss2d_kernel(n, 3.)
+    sb = beam.gauss2d_kernel(n, 10.)
+    x = numpy.arange(n, dtype=float) - n//2
+    v = numpy.tile(x, (n,1))
+    sig = numpy.full((n,n), 50.)
+    dv = numpy.stack([v, numpy.ones_like(v)], axis=-1)
+    mom0 = beam.zeroth_moment(synth, (n,n), sb=sb)
+    assert numpy.allclose(mom0[0], beam.convolve_fft(sb, synth)), 'Bad zeroth moment'
+
+    smeared = beam.smear(v, synth, sb=sb, sig=sig)
+    _smeared = beam.smear(v, synth, sb=sb, sig=sig, mom0=mom0)
+    assert all([numpy.allclose(a, b) for a, b in zip(smeared, _smeared)]), \
+            'Precomputed zeroth moment changed the result'
+    smeared = beam.deriv_smear(v, dv, synth, sb=sb, sig=sig)
+    _smeared = beam.deriv_smear(v, dv, synth, sb=sb, sig=sig, mom0=mom0)
+    assert all([a is None or numpy.allclose(a, b) for a, b in zip(smeared, _smeared)]), \
+            'Precomputed zeroth moment changed the result'
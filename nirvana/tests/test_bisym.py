@@ -0,0 +1,129 @@
+"""
+Module for testing the bisymmetric model.
+"""
+
+import pickle
+import multiprocessing as mp
+
+from IPython import embed
+
+import numpy
+import dynesty
+
+from nirvana.data.kinematics import Kinematics
+from nirvana.data.fitargs import FitArgs
+from nirvana.data.util import unpack
+from nirvana.models.beam import gauss2d_kernel
+from nirvana.models.higher_order import bisym_model, bisym_convolver
+from nirvana.models.bisym import loglike, ptform, BisymLikelihood, init_worker, worker_loglike, \
+                                 worker_ptform
+from nirvana.tests.util import requires_pyfftw
+
+
+def _bisym_args(n=31, nbin=2, disp=True, fixcent=True, nglobs=6):
+    """
+    Construct a synthetic, binned dataset and the bisymmetric fit arguments.
+    """
+    x = numpy.arange(n, dtype=float)[::-1] - n//2
+    y = numpy.arange(n, dtype=float) - n//2
+    x, y = numpy.meshgrid(x, y)
+    i, j = numpy.meshgrid(numpy.arange(n)//nbin, numpy.arange(n)//nbin)
+    binid = j*(n//nbin + 1) + i
+    binid[numpy.sqrt(x**2 + y**2) > n//2] = -1
+    sb = numpy.exp(-numpy.sqrt(x**2 + y**2)/5)
+    rng = numpy.random.default_rng(99)
+    kin = Kinematics(numpy.zeros((n,n), dtype=float), vel_ivar=numpy.full((n,n), 0.1),
+                     sig=numpy.full((n,n), 50.), sig_ivar=numpy.full((n,n), 0.01), sb=sb, binid=binid, grid_x=x, grid_y=y, psf=gauss2d_kernel(n, 2.))
+    args = FitArgs(kin, nglobs=nglobs, disp=disp, fixcent=fixcent, noisefloor=5, penalty=100)
+    args.edges = numpy.linspace(0, n//2, 6)
+    nedge = len(args.edges)
+    params = numpy.array([50., 45., 30., 10., 0.5, -0.3][:nglobs]
+                         + list(200*(1-numpy.exp(-args.edges/3)))[fixcent:]
+                         + [20.]*(nedge-fixcent) + [10.]*(nedge-fixcent)
+                         + ([] if not disp else list(80*numpy.exp(-args.edges/5))))
+    if not disp:
+        # bisym_model requires the dispersion mask to be None
+        kin.sig_mask = None
+    # Add noise and mask some data
+    vel, sig = bisym_model(args, unpack(params, args))
+    kin.vel = numpy.ma.getdata(vel) + rng.normal(scale=3., size=kin.vel.size)
+    kin.vel_mask = numpy.zeros(kin.vel.size, dtype=bool)
+    kin.vel_mask[rng.choice(kin.vel.size, size=10, replace=False)] = True
+    if disp:
+        kin.sig_phys2 = numpy.ma.getdata(sig)**2 + rng.normal(scale=100., size=kin.sig.size)
+        kin.sig_phys2_ivar = numpy.full(kin.sig.size, 1e-4)
+        kin.sig_mask = numpy.zeros(kin.sig.size, dtype=bool)
+        kin.sig_mask[rng.choice(kin.sig.size, size=10, replace=False)] = True
+    return args, params
+
+
+def test_likelihood():
+    for disp, fixcent, nglobs in [(True, True, 6), (False, True, 4), (True, False, 6)]:
+        args, params = _bisym_args(disp=disp, fixcent=fixcent, nglobs=nglobs)
+        for squared in [False, True]:
+            like = BisymLikelihood(args, squared=squared)
+            for p in [params, params*1.05]:
+                assert numpy.isclose(like(p), loglike(p, args, squared=squared), rtol=1e-10), \
+                        'Likelihood changed'
+
+
+@requires_pyfftw
+def test_convolver():
+    args, params = _bisym_args()
+    conv = bisym_convolver(args.kin.spatial_shape)
+    assert conv is not None and conv.real, 'Should use the real-to-complex FFTW algorithms'
+    assert bisym_convolver(args.kin.spatial_shape) is conv, 'Convolver should be reused'
+
+    # The model should be the same using the numpy FFTs and FFTW
+    like = BisymLikelihood(args)
+    _like = BisymLikelihood(args, cnvfftw=conv)
+    assert numpy.isclose(like(params), _like(params), rtol=1e-10), 'Bad FFTW likelihood'
+    vel, sig = bisym_model(args, unpack(params, args))
+    _vel, _sig = bisym_model(args, unpack(params, args), cnvfftw=conv)
+    assert numpy.ma.allclose(vel, _vel) and numpy.ma.allclose(sig, _sig), 'Bad FFTW model'
+
+    # The unpickled likelihood should use the convolver of this process
+    _like = pickle.loads(pickle.dumps(_like))
+    assert _like.cnvfftw is conv, 'Should use the process convolver'
+    assert numpy.isclose(like(params), _like(params), rtol=1e-10), 'Bad unpickled likelihood'
+    _like = pickle.loads(pickle.dumps(like))
+    assert _like.cnvfftw is None, 'Should not use FFTW'
+
+
+def test_worker():
+    args, params = _bisym_args()
+    args.setnbins(len(args.edges) - args.fixcent)
+    args.guess = params
+    args.setbounds(incpad=3, incgauss=True)
+    u = numpy.linspace(0.1, 0.9, params.size)
+
+    init_worker(args)
+    assert numpy.isclose(worker_loglike(params), loglike(params, args), rtol=1e-10), \
+            'Bad likelihood'
+    assert numpy.allclose(worker_ptform(u), ptform(u, args)), 'Bad prior transform'
+
+    # Each process installs its own fit state when it starts
+    with mp.Pool(2, initializer=init_worker, initargs=(args,)) as pool:
+        llike = pool.map(worker_loglike, [params, params*1.05])
+    assert numpy.allclose(llike, [worker_loglike(params), worker_loglike(params*1.05)]), \
+            'Bad likelihood from pool'
+
+
+def test_checkpoint(tmp_path):
+    args, params = _bisym_args()
+    args.setnbins(len(args.edges) - args.fixcent)
+    args.guess = params
+    args.setbounds(incpad=3, incgauss=True)
+    init_worker(args)
+
+    # The checkpoint file only needs the sampler state; the fit state is
+    # installed separately by init_worker
+    ofile = str(tmp_path / 'test.ckpt')
+    sampler = dynesty.NestedSampler(worker_loglike, worker_ptform, params.size, nlive=40,
+                                    periodic=[1,2], rstate=numpy.random.default_rng(99))
+    sampler.run_nested(maxiter=50, print_progress=False, checkpoint_file=ofile)
+    _sampler = dynesty.NestedSampler.restore(ofile)
+    assert _sampler.it == sampler.it, 'Bad restored iteration'
+    assert numpy.array_equal(_sampler.live_logl, sampler.live_logl), 'Bad restored live points'
+    assert numpy.isclose(float(_sampler.loglikelihood(params)), worker_loglike(params)), \
+            'Bad restored likelihood'
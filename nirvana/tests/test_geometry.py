@@ -119,3 +119,27 @@ def test_deriv_projected_polar():
 
 
 
+
+
+def test_deriv_disk_polar():
+    x = numpy.array([2., 0., -2., 0., 0., -1., 0.])
+    y = numpy.array([0., 2., 0., -2., 1., 0., -1.])
+    p = numpy.array([0.5, -0.5, 45., 30.])
+
+    _dx = numpy.tile(numpy.array([-1., 0., 0., 0.]), (x.size, 1))
+    _dy = numpy.tile(numpy.array([0., -1., 0., 0.]), (x.size, 1))
+    _dpa = numpy.array([0., 0., 1., 0.])
+    _dinc = numpy.array([0., 0., 0., 1.])
+    r, t, dr, dt = geometry.deriv_projected_polar(x - p[0], y - p[1], *numpy.radians(p[2:]),
+                                                  dxdp=_dx, dydp=_dy, dpadp=_dpa, dincdp=_dinc)
+
+    _r, _t, _dr, _dt = geometry.deriv_disk_polar(x, y, p[0], p[1], *numpy.radians(p[2:]))
+    assert numpy.allclose(r, _r) and numpy.allclose(t, _t), 'Coordinates are different'
+    assert numpy.allclose(dr, _dr) and numpy.allclose(dt, _dt), 'Derivatives are different'
+
+    free = numpy.array([False, True, False, True])
+    _r, _t, _dr, _dt = geometry.deriv_disk_polar(x, y, p[0], p[1], *numpy.radians(p[2:]),
+                                                 free=free)
+    assert _dr.shape == (x.size, 2), 'Bad derivative shape'
+    assert numpy.allclose(dr[:,free], _dr) and numpy.allclose(dt[:,free], _dt), \
+            'Derivatives are different'
@@ -0,0 +1,64 @@
+"""
+Module for testing the kinematics module.
+"""
+
+from IPython import embed
+
+import numpy
+
+from nirvana.data.kinematics import Kinematics
+from nirvana.models.beam import gauss2d_kernel, construct_beam
+
+
+def _binned_kin(n=21, nbin=4):
+    """
+    Construct a synthetic binned dataset, where each bin is a block of
+    ``nbin``x``nbin`` spaxels.
+    """
+    x = numpy.arange(n, dtype=float)[::-1] - n//2
+    y = numpy.arange(n, dtype=float) - n//2
+    x, y = numpy.meshgrid(x, y)
+    i, j = numpy.meshgrid(numpy.arange(n)//nbin, numpy.arange(n)//nbin)
+    binid = j*(n//nbin + 1) + i
+    # Ignore some of the spaxels
+    binid[0,:] = -1
+    vel = numpy.zeros((n,n), dtype=float)
+    return Kinematics(vel, sb=numpy.ones_like(vel), sig=numpy.ones_like(vel), binid=binid,
+                      grid_x=x, grid_y=y)
+
+
+def test_bin_many():
+    kin = _binned_kin()
+    rng = numpy.random.default_rng(99)
+    stack = rng.uniform(size=kin.spatial_shape+(5,))
+    binned = numpy.stack([kin.bin(stack[...,i]) for i in range(stack.shape[-1])], axis=-1)
+    assert numpy.allclose(kin.bin_many(stack), binned), 'Bad binning of stacked maps'
+
+    # Non-contiguous input and output buffer
+    out = numpy.empty_like(binned[:,::2])
+    _binned = kin.bin_many(stack[...,::2], out=out)
+    assert _binned is out, 'Output buffer should be returned'
+    assert numpy.allclose(out, binned[:,::2]), 'Bad binning of stacked maps'
+
+    data, deriv = kin.deriv_bin(stack[...,0], stack)
+    assert numpy.allclose(data, binned[:,0]) and numpy.allclose(deriv, binned), \
+            'Bad derivative binning'
+
+
+def test_pad_beam():
+    n = 21
+    x, y = numpy.meshgrid(*(numpy.arange(n, dtype=float) - n//2,)*2)
+    vel = numpy.zeros((n,n), dtype=float)
+    psf = gauss2d_kernel(n, 3.)
+    aperture = gauss2d_kernel(n, 1.)
+    kin = Kinematics(vel, sb=numpy.ones_like(vel), sig=numpy.ones_like(vel), grid_x=x, grid_y=y,
+                     psf=psf, aperture=aperture)
+    assert not kin.pad_beam, 'Should not pad by default'
+    beam_fft = construct_beam(psf, aperture, return_fft=True, real=True)
+    assert numpy.allclose(kin.beam_fft, beam_fft), 'Bad beam'
+    kin = Kinematics(vel, sb=numpy.ones_like(vel), sig=numpy.ones_like(vel), grid_x=x, grid_y=y,
+                     psf=psf, aperture=aperture, pad_beam=True)
+    _beam_fft = construct_beam(psf, aperture, return_fft=True, real=True, pad=True)
+    assert numpy.allclose(kin.beam_fft, _beam_fft), 'Bad padded beam'
+    assert not numpy.allclose(_beam_fft, beam_fft, rtol=0., atol=1e-6), \
+            'Padded beam should differ'
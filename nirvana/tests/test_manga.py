@@ -105,6 +105,23 @@ def test_covar_fake():
                              subcovar.toarray()), 'Failed in filling the covariance array'
 
 
+def test_covar_stencil():
+    # Fake inverse variance map with some masked spaxels
+    rng = numpy.random.default_rng(99)
+    ivar = rng.uniform(0.5, 2., size=(30,30))
+    ivar[rng.uniform(size=ivar.shape) < 0.2] = 0.
+    gpm, covar = manga.manga_map_covar(ivar, positive_definite=False)
+
+    # Brute-force calculation using the separation between all valid spaxels
+    i, j = numpy.where(gpm)
+    d = numpy.square(i[:,None]-i[None,:]) + numpy.square(j[:,None]-j[None,:])
+    rho = numpy.exp(-d/1.92**2/2)
+    rho[(d > (2*3.2)**2) | (rho < 1e-5)] = 0.
+    err = numpy.sqrt(1/ivar[gpm])
+    assert numpy.allclose(covar.toarray(), rho*numpy.outer(err, err), rtol=0., atol=1e-14), \
+            'Bad covariance matrix'
+
+
 @requires_remote
 def test_inv_covar():
     maps_file = remote_data_file('manga-8138-12704-MAPS-{0}.fits.gz'.format(dap_test_daptype))
@@ -0,0 +1,96 @@
+"""
+Module for testing the intrinsic scatter module.
+"""
+
+from IPython import embed
+
+import numpy
+
+from nirvana.data.scatter import IntrinsicScatter
+
+
+def _correlated_resid(n=300, sig=2.):
+    """
+    Construct a set of residuals with correlated errors and intrinsic
+    scatter.
+    """
+    rng = numpy.random.default_rng(99)
+    i = numpy.arange(n)
+    band = numpy.exp(-numpy.square(i[:,None]-i[None,:])/2/1.5**2)
+    band[numpy.absolute(i[:,None]-i[None,:]) > 4] = 0.
+    covar = numpy.dot(band, band.T) + numpy.identity(n)*0.1
+    resid = numpy.dot(numpy.linalg.cholesky(covar), rng.normal(size=n)) \
+                + rng.normal(scale=sig, size=n)
+    # Add some outliers
+    resid[rng.choice(n, size=5, replace=False)] += 50.
+    return resid, covar
+
+
+def test_merit_eigen():
+    resid, covar = _correlated_resid()
+    gpm = numpy.ones(resid.size, dtype=bool)
+    gpm[:10] = False
+    scat = IntrinsicScatter(resid, covar=covar, gpm=gpm)
+
+    scat._fit_init()
+    assert scat._eig is not None and numpy.array_equal(scat._eig[0], gpm), \
+            'Decomposition should be for the current mask'
+    for x in [0., 0.5, 3.]:
+        assert numpy.isclose(scat._merit_eigen([x]), scat._merit_covar([x])), 'Bad merit'
+
+    # Exclude a few more points; the decomposition should be reused
+    eig = scat._eig
+    scat.gpm[[20,50,51,200]] = False
+    scat._fit_init()
+    assert scat._eig is eig, 'Decomposition should have been reused'
+    for x in [0., 0.5, 3.]:
+        assert numpy.isclose(scat._merit_eigen([x]), scat._merit_covar([x])), 'Bad merit'
+
+    # Including new points requires a new decomposition
+    scat.gpm[:10] = True
+    scat._fit_init()
+    assert scat._eig is not eig, 'Decomposition should have been recomputed'
+    assert numpy.isclose(scat._merit_eigen([1.]), scat._merit_covar([1.])), 'Bad merit'
+
+
+
+def test_merit_eigen_fixed_rho():
+    resid, covar = _correlated_resid()
+    gpm = numpy.ones(resid.size, dtype=bool)
+    gpm[:10] = False
+    scat = IntrinsicScatter(resid, covar=covar, gpm=gpm)
+
+    scat._fit_init(fixed_rho=True)
+    assert scat._eig is not None and scat._eig[1], 'Should decompose the correlation matrix'
+    for x in [0., 0.5, 3.]:
+        assert numpy.isclose(scat._merit_eigen([x]), scat._merit_covar([x])), 'Bad merit'
+
+    # Exclude a few more points; the decomposition should be reused
+    eig = scat._eig
+    scat.gpm[[20,50,51,200]] = False
+    scat._fit_init(fixed_rho=True)
+    assert scat._eig is eig, 'Decomposition should have been reused'
+    for x in [0., 0.5, 3.]:
+        assert numpy.isclose(scat._merit_eigen([x]), scat._merit_covar([x])), 'Bad merit'
+
+    # Changing the correlation matrix requires a new decomposition
+    scat._fit_init()
+    assert scat._eig is not eig, 'Decomposition should have been recomputed'
+    assert numpy.isclose(scat._merit_eigen([1.]), scat._merit_covar([1.])), 'Bad merit'
+
+
+def test_fit_eigen():
+    resid, covar = _correlated_resid()
+    sig, rej, gpm = IntrinsicScatter(resid, covar=covar).iter_fit()
+    _sig, _rej, _gpm = IntrinsicScatter(resid, covar=covar, eigen=False).iter_fit()
+    assert numpy.isclose(sig, _sig), 'Different intrinsic scatter'
+    assert numpy.array_equal(rej, _rej) and numpy.array_equal(gpm, _gpm), 'Different rejections'
+    assert numpy.sum(rej) >= 5, 'Outliers should have been rejected'
+
+
+def test_fit_eigen_fixed_rho():
+    resid, covar = _correlated_resid()
+    sig, rej, gpm = IntrinsicScatter(resid, covar=covar).iter_fit(fixed_rho=True)
+    _sig, _rej, _gpm = IntrinsicScatter(resid, covar=covar, eigen=False).iter_fit(fixed_rho=True)
+    assert numpy.isclose(sig, _sig), 'Different intrinsic scatter'
+    assert numpy.array_equal(rej, _rej) and numpy.array_equal(gpm, _gpm), 'Different rejections'
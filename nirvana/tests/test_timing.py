@@ -0,0 +1,64 @@
+"""
+Module for testing the timing instrumentation.
+"""
+
+from IPython import embed
+
+import numpy
+
+from nirvana.util import timing
+from nirvana.models import beam
+from nirvana.models.axisym import AxisymmetricDisk
+from nirvana.models.oned import HyperbolicTangent, Exponential
+from nirvana.tests.test_axisym import _synthetic_kin
+
+
+def test_timed():
+    @timing.timed('test')
+    def func(x):
+        return x + 1
+
+    timing.timer.reset()
+    assert func(1) == 2, 'Bad function result'
+    assert len(timing.timer.time) == 0, 'Timer should be disabled by default'
+
+    timing.enable()
+    try:
+        func(1)
+        func(2)
+        with timing.timer('block'):
+            func(3)
+    finally:
+        timing.disable()
+    steps, ncalls, t = timing.timer.summary()
+    assert sorted(steps) == ['block', 'test'], 'Bad steps'
+    assert timing.timer.ncalls == {'block': 1, 'test': 3}, 'Bad number of calls'
+    assert numpy.all(numpy.diff(t) <= 0), 'Steps should be sorted by time'
+
+
+def test_convolve_timing():
+    kernel = beam.gauss2d_kernel(21, 2.)
+    timing.enable()
+    try:
+        beam.convolve_fft(kernel, kernel)
+        beam.convolve_fft(kernel, kernel, pad=True)
+    finally:
+        timing.disable()
+    assert timing.timer.ncalls['convolve'] == 2, 'Padded convolution should be counted once'
+    timing.timer.reset()
+
+
+def test_fit_timing():
+    p0, kin = _synthetic_kin()
+    disk = AxisymmetricDisk(rc=HyperbolicTangent(), dc=Exponential())
+    timing.enable()
+    try:
+        disk.lsq_fit(kin, sb_wgt=True, p0=p0*1.02)
+    finally:
+        timing.disable()
+    for key in ['lsq_fit', 'fit_prep', 'fom', 'jac', 'model', 'deriv_model', 'smear',
+                'deriv_smear', 'convolve', 'bin']:
+        assert key in timing.timer.ncalls, f'{key} not recorded'
+    assert timing.timer.ncalls['lsq_fit'] == 1, 'Bad number of fits'
+    assert timing.timer.time['fom'] < timing.timer.time['lsq_fit'], 'Bad inclusive time'
+    timing.timer.reset()
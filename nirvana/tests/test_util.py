@@ -0,0 +1,107 @@
+"""
+Module for testing the data utility module.
+"""
+
+from IPython import embed
+
+import numpy
+from scipy import sparse
+
+from nirvana.data import util
+
+
+def test_map_bin_transformations():
+    rng = numpy.random.default_rng(99)
+    binid = rng.integers(-1, 40, size=(30,30))
+    # Include non-sequential bin IDs
+    binid[binid == 7] = -1
+
+    ubinid, nbin, ubin_indx, grid_indx, bin_inverse, bin_transform \
+            = util.get_map_bin_transformations(binid=binid)
+
+    assert numpy.array_equal(ubinid, binid.flat[ubin_indx]), 'Bad unique bin indices'
+    _binid = numpy.full(binid.shape, -1, dtype=int)
+    _binid[numpy.unravel_index(grid_indx, binid.shape)] = ubinid[bin_inverse]
+    assert numpy.array_equal(binid, _binid), 'Bad inverse indices'
+
+    # Brute-force construction of the transformation matrix
+    _bin_transform = numpy.zeros((ubinid.size, binid.size), dtype=float)
+    for i, b in enumerate(ubinid):
+        indx = binid.ravel() == b
+        _bin_transform[i,indx] = 1/numpy.sum(indx)
+    assert numpy.array_equal(nbin, numpy.sum(_bin_transform > 0, axis=1)), 'Bad bin counts'
+    assert numpy.allclose(bin_transform.toarray(), _bin_transform), 'Bad transformation matrix'
+
+    # The result is cached
+    assert util.get_map_bin_transformations(binid=binid.copy())[-1] is bin_transform, \
+            'Transformations should have been cached'
+    assert not ubinid.flags.writeable, 'Cached arrays should be read-only'
+
+
+def test_impose_positive_definite():
+    # Construct a matrix with two independent blocks, one of which is not
+    # positive definite
+    rng = numpy.random.default_rng(99)
+    a = rng.normal(size=(10,10))
+    a = numpy.dot(a, a.T)
+    b = numpy.array([[1., 0.9, 0.9], [0.9, 1., 0.1], [0.9, 0.1, 1.]])
+    assert numpy.any(numpy.linalg.eigvalsh(b) < 0), 'Test matrix should not be positive definite'
+    mat = numpy.zeros((13,13), dtype=float)
+    mat[:10,:10] = a
+    mat[10:,10:] = b
+    # Mix up the order of the blocks
+    srt = rng.permutation(13)
+    mat = mat[numpy.ix_(srt,srt)]
+
+    # Brute-force calculation using the full matrix
+    w, v = numpy.linalg.eigh(mat)
+    _mat = numpy.dot(v * numpy.maximum(w, 1e-10)[None,:], v.T)
+    t = numpy.sqrt(numpy.diag(mat)/numpy.diag(_mat))
+    _mat *= numpy.outer(t,t)
+
+    pd_mat = util.impose_positive_definite(sparse.csr_matrix(mat))
+    assert numpy.allclose(pd_mat.toarray(), _mat), 'Bad positive-definite matrix'
+    assert numpy.all(numpy.linalg.eigvalsh(pd_mat.toarray()) > 0), \
+            'Matrix should be positive definite'
+    _pd_mat = util.impose_positive_definite(sparse.csr_matrix(mat))
+    assert numpy.array_equal(pd_mat.toarray(), _pd_mat.toarray()), 'Cached result is different'
+
+    # Positive-definite matrices are returned directly
+    a = sparse.csr_matrix(a)
+    assert util.impose_positive_definite(a) is a, 'Matrix is already positive definite'
+
+
+def test_cholesky_whitener():
+    # Banded covariance matrix with a random ordering
+    n = 200
+    rng = numpy.random.default_rng(99)
+    i = numpy.arange(n)
+    band = numpy.exp(-numpy.square(i[:,None]-i[None,:])/2/2.**2)
+    band[numpy.absolute(i[:,None]-i[None,:]) > 4] = 0.
+    covar = numpy.dot(band, band.T) + numpy.identity(n)*0.1
+    srt = rng.permutation(n)
+    covar = covar[numpy.ix_(srt,srt)]
+
+    vec = rng.normal(size=n)
+    jac = rng.normal(size=(n,3))
+    ucov = util.cinv(covar, upper=True)
+
+    # Dense matrix reproduces the result using the inverse
+    whiten = util.CholeskyWhitener(covar)
+    assert whiten.bandwidth is None, 'Should not use banded form'
+    assert numpy.allclose(whiten(vec), numpy.dot(vec, ucov)), 'Bad whitened vector'
+    assert numpy.allclose(whiten(jac), numpy.dot(jac.T, ucov).T), 'Bad whitened array'
+
+    # Sparse matrix is reordered, but the chi-square and Jacobian products
+    # should be the same
+    whiten = util.CholeskyWhitener(sparse.csr_matrix(covar))
+    assert whiten.bandwidth is not None and whiten.bandwidth < 20, 'Should use banded form'
+    chi = numpy.dot(vec, ucov)
+    _chi = whiten(vec)
+    assert numpy.isclose(numpy.sum(chi**2), numpy.sum(_chi**2)), 'Bad chi-square'
+    _jac = whiten(jac)
+    assert _jac.shape == jac.shape, 'Bad shape'
+    assert numpy.allclose(numpy.dot(_jac.T, _chi), numpy.dot(jac.T, numpy.dot(ucov, chi))), \
+            'Bad gradient'
+    assert numpy.allclose(numpy.dot(_jac.T, _jac), numpy.dot(jac.T, numpy.dot(ucov, ucov.T).dot(jac))), \
+            'Bad Hessian approximation'
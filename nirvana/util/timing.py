@@ -0,0 +1,167 @@
+r"""
+Opt-in instrumentation used to track the wall time and number of calls of the
+main computational steps of a fit.
+
+The instrumentation is disabled by default, in which case the decorated
+functions are called directly.  To record the timing of a fit, use:
+
+.. code-block:: python
+
+    from nirvana.util import timing
+    timing.enable()
+    # Run the fit, e.g., using nirvana.models.axisym.axisym_iter_fit
+    timing.timer.report()
+
+All recorded times are *inclusive*; e.g., the time recorded for a model
+evaluation includes the time spent in the beam-smearing convolutions, which
+is also recorded separately.
+
+----
+
+.. include common links, assuming primary doc root is up one directory
+.. include:: ../include/links.rst
+"""
+import time
+import functools
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class FitTimer:
+    """
+    Accumulate the wall time and number of calls for a set of named steps.
+
+    Attributes:
+        enabled (:obj:`bool`):
+            Flag that the timing is being recorded.
+        ncalls (:obj:`dict`):
+            The number of calls for each step.
+        time (:obj:`dict`):
+            The cumulative wall time in seconds for each step.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.ncalls = {}
+        self.time = {}
+
+    def reset(self):
+        """
+        Remove all recorded steps.
+        """
+        self.ncalls = {}
+        self.time = {}
+
+    def record(self, key, dt):
+        """
+        Record a single call of a step.
+
+        Args:
+            key (:obj:`str`):
+                Name of the step.
+            dt (:obj:`float`):
+                Wall time in seconds for the call.
+        """
+        self.ncalls[key] = self.ncalls.get(key, 0) + 1
+        self.time[key] = self.time.get(key, 0.) + dt
+
+    @contextmanager
+    def __call__(self, key):
+        """
+        Context manager that records the wall time of the enclosed block, if
+        the timer is enabled.
+
+        Args:
+            key (:obj:`str`):
+                Name of the step.
+        """
+        if not self.enabled:
+            yield
+            return
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(key, time.perf_counter() - t)
+
+    def summary(self):
+        """
+        Return the recorded steps.
+
+        Returns:
+            :obj:`tuple`: Three `numpy.ndarray`_ objects with the name of
+            each step, its number of calls, and its cumulative wall time in
+            seconds, sorted by decreasing time.
+        """
+        keys = np.array(list(self.time.keys()), dtype=str)
+        ncalls = np.array([self.ncalls[k] for k in keys], dtype=int)
+        t = np.array([self.time[k] for k in keys], dtype=float)
+        srt = np.argsort(t)[::-1]
+        return keys[srt], ncalls[srt], t[srt]
+
+    def report(self):
+        """
+        Print the recorded steps to the screen.
+        """
+        if len(self.time) == 0:
+            print('No timing data recorded.')
+            return
+        keys, ncalls, t = self.summary()
+        max_key_len = max(max([len(k) for k in keys]), 4)
+        print('-'*70)
+        print(f'{"Timing (inclusive)":^70}')
+        print('-'*70)
+        print(f'{"Step":>{max_key_len}} {"Ncall":>8} {"Time (s)":>10} {"Per call (ms)":>14}')
+        for k, n, _t in zip(keys, ncalls, t):
+            print(f'{k:>{max_key_len}} {n:>8} {_t:>10.3f} {1e3*_t/n:>14.3f}')
+        print('-'*70)
+
+
+timer = FitTimer()
+"""
+Global instance used to record the timing of all instrumented functions.
+"""
+
+
+def enable(reset=True):
+    """
+    Start recording the timing of the instrumented functions.
+
+    Args:
+        reset (:obj:`bool`, optional):
+            Remove any previously recorded steps.
+    """
+    if reset:
+        timer.reset()
+    timer.enabled = True
+
+
+def disable():
+    """
+    Stop recording the timing of the instrumented functions.  Any recorded
+    steps are kept.
+    """
+    timer.enabled = False
+
+
+def timed(key):
+    """
+    Decorator that records the wall time of each call to the decorated
+    function using :attr:`timer`.
+
+    Args:
+        key (:obj:`str`):
+            Name of the step.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not timer.enabled:
+                return func(*args, **kwargs)
+            t = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timer.record(key, time.perf_counter() - t)
+        return wrapper
+    return decorator